@@ -0,0 +1,167 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Ledger I/O off the Tk main loop.
+#
+# The GUI clients hand every ledger call to a LedgerWorker instead of making
+# it in a button handler, so the window keeps redrawing however large the
+# ledger is. Calls run on a background thread; their results come back
+# through a queue that the Tk loop polls with after(), because Tk itself
+# must only be touched from the main thread. The worker has a single
+# thread: the process-wide ledger backend and read cache are not
+# thread-safe (a SQLite connection belongs to the thread that opened it),
+# and one user's requests don't gain from running side by side.
+#
+# A watch keeps the screen live: the worker polls a ledger subscription
+# (ledger.subscribe) every WATCH_MS, which with a ledger daemon only hands
+# over changes it has pushed, and the Tk loop gets just the wallets that
+# changed.
+
+POLL_MS = 15 # How often the Tk loop checks for finished calls while any are pending
+WATCH_MS = 250 # How often a watch asks its subscription for changes
+
+class _Watch:
+    def __init__(self):
+        self.subscription = None
+        self.timer = None # pending after() of the next poll
+        self.stopped = False
+
+class LedgerWorker:
+    """Runs ledger calls in the background and delivers results on the Tk thread.
+
+    Every request has a key ("login", "status", ...). A newer request with
+    the same key supersedes an older one: if the old one hasn't started it
+    never runs, and if it has, its result is dropped. cancel() drops
+    everything pending, e.g. on logout, so a slow reply can't land on the
+    wrong screen. Buttons passed to submit() stay disabled until the
+    request is answered or superseded.
+    """
+
+    def __init__(self, root, poll_ms=POLL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cooin-ledger')
+        self._done = queue.Queue()
+        self._pending = {} # key -> (request id, future, buttons)
+        self._next_id = 0
+        self._polling = None
+        self._watch = None
+
+    def submit(self, key, call, on_result, on_error=None, buttons=()):
+        """Runs `call()` in the background, then `on_result(result)` (or `on_error(exception)`) on the Tk thread."""
+        self.cancel(key)
+        self._next_id += 1
+        request_id = self._next_id
+        for button in buttons:
+            button.config(state='disabled')
+
+        future = self._executor.submit(call)
+        self._pending[key] = (request_id, future, buttons)
+        future.add_done_callback(lambda f: self._done.put((key, request_id, f, on_result, on_error)))
+        if self._polling is None:
+            self._polling = self.root.after(self.poll_ms, self._poll)
+        return request_id
+
+    def watch(self, subscribe, on_change, interval_ms=WATCH_MS):
+        """Calls `on_change({address: wallet or None})` on the Tk thread whenever a watched wallet changes.
+
+        `subscribe()` opens the subscription (e.g. ledger.subscribe([address]));
+        it and every poll run in the background under the key "watch". The
+        first call gets the wallets as they are. A ledger error is retried on
+        the next poll. Replaces any earlier watch; unwatch() ends it.
+        """
+        self.unwatch()
+        watch = self._watch = _Watch()
+
+        def open_subscription():
+            subscription = subscribe()
+            watch.subscription = subscription
+            if watch.stopped: # unwatched while opening
+                subscription.close()
+            return subscription
+
+        def poll():
+            watch.timer = None
+            if watch.subscription is None:
+                self.submit('watch', open_subscription, lambda subscription: poll(), next_poll)
+            else:
+                self.submit('watch', watch.subscription.poll, delivered, next_poll)
+
+        def delivered(changes):
+            if changes:
+                on_change(changes)
+            next_poll()
+
+        def next_poll(error=None):
+            if not watch.stopped:
+                watch.timer = self.root.after(interval_ms, poll)
+
+        poll()
+
+    def unwatch(self):
+        """Ends the current watch, if any."""
+        watch, self._watch = self._watch, None
+        if watch is None:
+            return
+        watch.stopped = True
+        self.cancel('watch')
+        if watch.timer is not None:
+            self.root.after_cancel(watch.timer)
+        if watch.subscription is not None:
+            watch.subscription.close()
+
+    def busy(self, key=None):
+        """Whether a request (with this key) is still waiting for its answer."""
+        return key in self._pending if key is not None else bool(self._pending)
+
+    def cancel(self, key=None):
+        """Drops the pending request with this key, or all of them."""
+        for k in [key] if key is not None else list(self._pending):
+            pending = self._pending.pop(k, None)
+            if pending is None:
+                continue
+            _, future, buttons = pending
+            future.cancel()
+            self._enable(buttons)
+
+    def _enable(self, buttons):
+        for button in buttons:
+            try:
+                button.config(state='normal')
+            except Exception: # the widget was destroyed with its screen
+                pass
+
+    def _poll(self):
+        self._polling = None
+        try:
+            while True:
+                try:
+                    key, request_id, future, on_result, on_error = self._done.get_nowait()
+                except queue.Empty:
+                    break
+                pending = self._pending.get(key)
+                if pending is None or pending[0] != request_id or future.cancelled():
+                    continue # superseded or cancelled: nobody wants this answer any more
+                del self._pending[key]
+                self._enable(pending[2])
+
+                error = future.exception()
+                if error is None:
+                    on_result(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    self.root.report_callback_exception(type(error), error, error.__traceback__)
+        finally:
+            # Callbacks may have submitted follow-up requests (and started polling)
+            if self._pending and self._polling is None:
+                self._polling = self.root.after(self.poll_ms, self._poll)
+
+    def shutdown(self):
+        """Drops pending requests and stops the worker thread (after the current call)."""
+        self.unwatch()
+        self.cancel()
+        if self._polling is not None:
+            self.root.after_cancel(self._polling)
+            self._polling = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,186 @@
+import argparse
+import sys
+
+import numpy as np
+
+import journal
+import ledger
+import metrics
+from core import MINE_COST, FLIGHT_SCORE_INCREASE, RULES, flight_reward, resolve_flight, uncapped_chance
+
+# Headless batch Proof-of-Flight mining.
+#
+# Runs K flights for a whole set of wallets in one pass: every success and
+# reward roll is drawn up front as a (K, wallets) NumPy array, the flights are
+# resolved one attempt at a time across all wallets at once, and the outcome
+# is committed to the ledger as a single transaction. No progress bars, no
+# sleeps. With a seed the draws (and therefore the results) are reproducible.
+
+# --- Engine ---
+
+def draw_rolls(attempts, count, seed=None):
+    """Success and reward rolls for every (attempt, wallet) pair."""
+    rng = np.random.default_rng(seed)
+    return rng.random((attempts, count)), rng.random((attempts, count))
+
+def mine_vectorized(balances, scores, rolls, reward_rolls, rules=RULES):
+    """Resolves every flight for all wallets at once.
+
+    Returns (flown, rewards, balances, scores): `flown[k, i]` says whether
+    wallet i could pay for attempt k, `rewards[k, i]` is the reward earned
+    (NaN on failure), followed by the final balances and flight scores.
+    """
+    cost, increase = rules['mine_cost'], rules['flight_score_increase']
+    balance = np.array(balances, dtype=np.float64)
+    score = np.array(scores, dtype=np.float64)
+    flown = np.zeros(rolls.shape, dtype=bool)
+    rewards = np.full(rolls.shape, np.nan)
+
+    for k in range(rolls.shape[0]):
+        can_fly = balance >= cost
+        balance = np.where(can_fly, balance - cost, balance)
+
+        chance = np.minimum(rules['max_success_chance'], uncapped_chance(score, rules))
+        success = can_fly & (rolls[k] < chance)
+        reward = flight_reward(reward_rolls[k], rules)
+
+        balance = np.where(success, balance + reward, balance)
+        score = np.where(success, score + increase, score)
+        flown[k] = can_fly
+        rewards[k] = np.where(success, reward, np.nan)
+
+    return flown, rewards, balance, score
+
+def mine_sequential(balances, scores, rolls, reward_rolls, rules=RULES):
+    """Reference implementation: the same rolls through the per-flight logic, one flight at a time."""
+    cost, increase = rules['mine_cost'], rules['flight_score_increase']
+    balances = [float(b) for b in balances]
+    scores = [float(s) for s in scores]
+    flown = np.zeros(rolls.shape, dtype=bool)
+    rewards = np.full(rolls.shape, np.nan)
+
+    for i in range(len(balances)):
+        for k in range(rolls.shape[0]):
+            if balances[i] < cost:
+                continue
+            balances[i] -= cost
+            flown[k, i] = True
+
+            reward = resolve_flight(scores[i], rolls[k, i], reward_rolls[k, i], rules)
+            if reward is not None:
+                balances[i] += reward
+                scores[i] += increase
+                rewards[k, i] = reward
+
+    return flown, rewards, np.array(balances), np.array(scores)
+
+def flight_records(addresses, wallets, flown, rewards):
+    """One 'flights' record per wallet that flew, pinned to the version that was mined."""
+    records = []
+    for i, address in enumerate(addresses):
+        paid = rewards[flown[:, i], i]
+        if not paid.size:
+            continue
+        results = [None if np.isnan(r) else float(r) for r in paid]
+        record = journal.flights(address, MINE_COST, FLIGHT_SCORE_INCREASE, results)
+        record['expect'] = wallets[address].get('version', 0)
+        records.append(record)
+    return records
+
+def mine_batch(addresses, attempts, seed=None, engine=mine_vectorized):
+    """Runs `attempts` flights for every address and commits the outcome.
+
+    The outcome goes to the ledger in one commit (one per shard on a sharded
+    ledger). Returns {address: summary}. Wallets that another process changed
+    before the commit landed are re-mined, with the same rolls, on their
+    fresh balances.
+    """
+    addresses = sorted(set(addresses))
+    column = {address: i for i, address in enumerate(addresses)}
+    rolls, reward_rolls = draw_rolls(attempts, len(addresses), seed)
+
+    results = {}
+    pending = addresses
+    for _ in range(ledger.MAX_RETRIES):
+        wallets = ledger.get_wallets(pending)
+        missing = [address for address in pending if address not in wallets]
+        if missing:
+            raise ledger.LedgerError(f"Unknown wallet: {missing[0]}")
+
+        columns = [column[address] for address in pending]
+        flown, rewards, balances, scores = engine(
+            [wallets[address]['balance'] for address in pending],
+            [wallets[address]['flight_score'] for address in pending],
+            rolls[:, columns], reward_rolls[:, columns],
+        )
+        records = flight_records(pending, wallets, flown, rewards)
+        conflicts = {record['addr'] for record in ledger.commit_independent(records)} if records else set()
+
+        for i, address in enumerate(pending):
+            if address in conflicts:
+                continue
+            results[address] = {
+                "flights": int(flown[:, i].sum()),
+                "successes": int((~np.isnan(rewards[:, i])).sum()),
+                "earned": float(np.nansum(rewards[:, i])),
+                "balance": float(balances[i]),
+                "flight_score": float(scores[i]),
+            }
+
+        if metrics.ENABLED:
+            committed = [i for i, address in enumerate(pending) if address not in conflicts]
+            metrics.inc('cooin_mining_attempts_total', int(flown[:, committed].sum()))
+            metrics.inc('cooin_mining_successes_total', int((~np.isnan(rewards[:, committed])).sum()))
+
+        pending = [address for address in pending if address in conflicts]
+        if not pending:
+            return {address: results[address] for address in addresses}
+
+    raise ledger.VersionConflict("Gave up committing the mining batch after repeated conflicts.")
+
+def engines_agree(balances, scores, attempts, seed, rules=RULES):
+    """Checks that the vectorized engine reproduces the sequential per-flight results exactly."""
+    rolls, reward_rolls = draw_rolls(attempts, len(balances), seed)
+    fast = mine_vectorized(balances, scores, rolls, reward_rolls, rules)
+    slow = mine_sequential(balances, scores, rolls, reward_rolls, rules)
+    return all(np.array_equal(a, b, equal_nan=(a.dtype.kind == 'f')) for a, b in zip(fast, slow))
+
+# --- Main Execution ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless batch Proof-of-Flight miner.")
+    parser.add_argument('addresses', nargs='*', help="wallet addresses to mine for")
+    parser.add_argument('--all', action='store_true', help="mine for every wallet in the ledger")
+    parser.add_argument('-k', '--attempts', type=int, default=1, help="flights per wallet")
+    parser.add_argument('--seed', type=int, help="seed for reproducible draws")
+    parser.add_argument('--verify', action='store_true',
+                        help="check the vectorized engine against the per-flight logic first")
+    args = parser.parse_args(argv)
+
+    try:
+        addresses = list(ledger.load_all_wallets()['wallets']) if args.all else args.addresses
+        if not addresses:
+            parser.error("give wallet addresses or --all")
+
+        if args.verify:
+            wallets = ledger.get_wallets(addresses)
+            ordered = [wallets[address] for address in sorted(set(addresses)) if address in wallets]
+            if not engines_agree([w['balance'] for w in ordered], [w['flight_score'] for w in ordered],
+                                 args.attempts, args.seed):
+                print("❌ Vectorized engine disagrees with the per-flight logic. Nothing committed.")
+                return 1
+
+        results = mine_batch(addresses, args.attempts, args.seed)
+    except ledger.LedgerError as e:
+        print(f"Error: {e}")
+        return 1
+
+    for address, r in results.items():
+        print(f"{address}  flights={r['flights']:<6} successes={r['successes']:<6} "
+              f"earned={r['earned']:.4f}  balance={r['balance']:.4f}  score={r['flight_score']:.2f}")
+    print(f"Mined {sum(r['flights'] for r in results.values())} flights for {len(results)} wallets, "
+          f"earned {sum(r['earned'] for r in results.values()):.4f} COO.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Binary (memory-mapped) ledger vs the JSON ledger at large wallet counts.
+
+Builds a synthetic binary ledger (1M wallets by default), then measures open
+time, login lookups (hits and misses) and single-wallet balance updates.
+The same operations run against a JSON ledger of --json-wallets wallets for
+comparison; cold JSON open means parsing the whole snapshot.
+
+    python benchmarks/bench_binary_ledger.py --wallets 1000000 --json-wallets 100000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journal
+import ledger
+from binledger import BinaryBackend
+
+CHARACTERS = string.ascii_letters + string.digits
+
+def synthetic_wallets(count, seed=1):
+    rng = random.Random(seed)
+    for _ in range(count):
+        address = ''.join(rng.choices(CHARACTERS, k=16))
+        yield address, {
+            "balance": rng.random() * 100,
+            "flight_score": 1.0 + rng.random() * 5,
+            "wallet_address": address,
+        }
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+def measure(backend, addresses, lookups, updates):
+    rng = random.Random(2)
+    hits = [rng.choice(addresses) for _ in range(lookups)]
+    misses = [''.join(rng.choices(CHARACTERS, k=16)) for _ in range(lookups)]
+
+    results = {}
+    for name, targets in (("lookup_hit", hits), ("lookup_miss", misses)):
+        samples = []
+        for address in targets:
+            began = time.perf_counter()
+            backend.wallet_exists(address)
+            samples.append(time.perf_counter() - began)
+        results[name] = percentiles(samples)
+
+    samples = []
+    for address in hits[:updates]:
+        began = time.perf_counter()
+        backend.commit([journal.credit(address, 0.5)])
+        samples.append(time.perf_counter() - began)
+    results["update"] = percentiles(samples)
+    return results
+
+def report(label, opened, results):
+    print(f"\n{label}")
+    print(f"  open: {opened:.3f} s")
+    for name, (p50, p99) in results.items():
+        print(f"  {name:<12} p50={p50:>9.1f} us  p99={p99:>9.1f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wallets', type=int, default=1_000_000)
+    parser.add_argument('--json-wallets', type=int, default=100_000, help="0 skips the JSON comparison")
+    parser.add_argument('--lookups', type=int, default=20_000)
+    parser.add_argument('--updates', type=int, default=2_000)
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp(prefix='cooin-bin-bench-')
+
+    path = os.path.join(workdir, 'cooin_data.bin')
+    addresses = []
+    def tracked(items):
+        for address, wallet in items:
+            addresses.append(address)
+            yield address, wallet
+
+    began = time.perf_counter()
+    BinaryBackend(path).bulk_load(tracked(synthetic_wallets(args.wallets)))
+    built = time.perf_counter() - began
+    size = sum(os.path.getsize(os.path.join(workdir, f)) for f in os.listdir(workdir))
+    print(f"binary ledger: {args.wallets} wallets built in {built:.1f} s, {size / 1e6:.1f} MB on disk")
+
+    began = time.perf_counter()
+    backend = BinaryBackend(path)
+    backend.wallet_count()
+    opened = time.perf_counter() - began
+    report(f"binary, {args.wallets} wallets", opened, measure(backend, addresses, args.lookups, args.updates))
+    backend.close()
+
+    if args.json_wallets:
+        path = os.path.join(workdir, 'cooin_data.json')
+        data = {"wallets": dict(synthetic_wallets(args.json_wallets))}
+        ledger.JSONBackend(path).save_all(data)
+        began = time.perf_counter()
+        backend = ledger.JSONBackend(path)
+        backend.wallet_count()
+        opened = time.perf_counter() - began
+        report(f"json, {args.json_wallets} wallets", opened,
+               measure(backend, list(data['wallets']), args.lookups, args.updates))
+        backend.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Concurrent writer stress benchmark.
+
+Spawns N writer processes that each perform optimistic read-modify-write
+updates (ledger.update_wallet) against one ledger, then checks that no update
+was lost. By default every process updates its own wallet, which shows how
+throughput scales when writers touch different wallets; --shared makes them
+all fight over one wallet to exercise version conflicts and retries.
+
+    python benchmarks/bench_concurrency.py --backend json --processes 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journal
+import ledger
+
+AMOUNT = 1.0
+
+def wallet_address(i):
+    return f"BENCH{i:011d}"
+
+def writer(backend_name, path, address, ops, start, results):
+    ledger.set_backend(ledger.open_backend(backend_name, path))
+    attempts = 0
+
+    def add_one(wallet):
+        nonlocal attempts
+        attempts += 1
+        return [journal.credit(address, AMOUNT)]
+
+    start.wait()
+    for _ in range(ops):
+        ledger.update_wallet(address, add_one, retries=1000)
+    results.put(attempts - ops)
+
+def run(backend_name, processes, ops, shared):
+    workdir = tempfile.mkdtemp(prefix='cooin-bench-')
+    path = os.path.join(workdir, os.path.basename(ledger.DEFAULT_DATA_FILES[backend_name]))
+    backend = ledger.open_backend(backend_name, path)
+
+    addresses = [wallet_address(0 if shared else i) for i in range(processes)]
+    for address in set(addresses):
+        backend.commit([journal.register(address, {
+            "balance": 0.0, "flight_score": 1.0, "wallet_address": address,
+        })])
+
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=writer, args=(backend_name, path, address, ops, start, results))
+        for address in addresses
+    ]
+    for w in workers:
+        w.start()
+
+    began = time.perf_counter()
+    start.set()
+    conflicts = sum(results.get() for _ in workers)
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - began
+
+    expected = {}
+    for address in addresses:
+        expected[address] = expected.get(address, 0.0) + ops * AMOUNT
+    wallets = backend.load_all()['wallets']
+    lost = sum(round(expected[a] - wallets[a]['balance']) for a in expected)
+    backend.close()
+
+    total = processes * ops
+    return {
+        "processes": processes,
+        "updates": total,
+        "seconds": elapsed,
+        "updates_per_sec": total / elapsed,
+        "conflicts": conflicts,
+        "lost_updates": lost,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(ledger.BACKENDS), default='json')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--ops', type=int, default=2000, help="updates per process")
+    parser.add_argument('--shared', action='store_true', help="all processes update one wallet")
+    args = parser.parse_args()
+
+    print(f"backend={args.backend} ops/process={args.ops} {'shared wallet' if args.shared else 'one wallet per process'}")
+    print(f"{'procs':>5} {'updates':>9} {'seconds':>8} {'updates/s':>10} {'conflicts':>9} {'lost':>5}")
+    failed = False
+    for n in args.processes:
+        r = run(args.backend, n, args.ops, args.shared)
+        print(f"{r['processes']:>5} {r['updates']:>9} {r['seconds']:>8.2f} {r['updates_per_sec']:>10.0f} "
+              f"{r['conflicts']:>9} {r['lost_updates']:>5}")
+        failed = failed or r['lost_updates'] != 0
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
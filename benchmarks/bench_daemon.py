@@ -0,0 +1,112 @@
+"""Ledger daemon (ledgerd.py) vs direct file access.
+
+N client processes each do a mix of single-wallet reads and credit commits
+on their own wallet, first straight against the ledger files, then through
+a daemon started for the same ledger. Reports throughput and per-call
+latency, plus how many group writes the daemon needed for its commits.
+
+    python benchmarks/bench_daemon.py --backend json --processes 1 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import journal
+import ledger
+import ledgerd
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2] * 1e6, samples[int(len(samples) * 0.99)] * 1e6
+
+def client(backend_name, path, daemon, address, ops, start, results):
+    if daemon:
+        backend = ledgerd.connect(backend_name, path)
+    else:
+        backend = ledger.open_backend(backend_name, path)
+    reads, writes = [], []
+    start.wait()
+    for _ in range(ops):
+        began = time.perf_counter()
+        backend.get_wallet(address)
+        reads.append(time.perf_counter() - began)
+
+        began = time.perf_counter()
+        backend.commit([journal.credit(address, 1.0)])
+        writes.append(time.perf_counter() - began)
+    backend.close()
+    results.put((reads, writes))
+
+def run(backend_name, path, processes, ops, daemon):
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=client,
+                                args=(backend_name, path, daemon, f"bench{p:011d}", ops, start, results))
+        for p in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    time.sleep(0.2) # let every client connect first
+    began = time.perf_counter()
+    start.set()
+    reads, writes = [], []
+    for _ in workers:
+        r, w = results.get()
+        reads.extend(r)
+        writes.extend(w)
+    elapsed = time.perf_counter() - began
+    for w in workers:
+        w.join()
+    return len(reads) / elapsed, len(writes) / elapsed, percentiles(reads), percentiles(writes)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(ledger.BACKENDS), default='json')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--ops', type=int, default=1000, help="read + commit pairs per process")
+    args = parser.parse_args()
+
+    print(f"backend={args.backend} ops/process={args.ops} cpus={os.cpu_count()}")
+    print(f"{'procs':>5} {'mode':>7} {'reads/s':>9} {'commits/s':>9} "
+          f"{'read p50/p99 us':>17} {'commit p50/p99 us':>19} {'groups':>7}")
+    for n in args.processes:
+        workdir = tempfile.mkdtemp(prefix='cooin-daemon-bench-')
+        path = os.path.join(workdir, os.path.basename(ledger.DEFAULT_DATA_FILES[args.backend]))
+        backend = ledger.open_backend(args.backend, path)
+        for p in range(n):
+            address = f"bench{p:011d}"
+            backend.commit([journal.register(address, {
+                "balance": 0.0, "flight_score": 1.0, "wallet_address": address,
+            })])
+        backend.close()
+
+        for mode in ('direct', 'daemon'):
+            daemon = None
+            groups = ''
+            if mode == 'daemon':
+                daemon = subprocess.Popen(
+                    [sys.executable, os.path.join(ROOT, 'ledgerd.py'), '--backend', args.backend,
+                     '--data-file', path], stdout=subprocess.DEVNULL)
+                while ledgerd.connect(args.backend, path) is None:
+                    time.sleep(0.05)
+            reads, commits, (r50, r99), (w50, w99) = run(args.backend, path, n, args.ops, daemon is not None)
+            if daemon is not None:
+                probe = ledgerd.connect(args.backend, path)
+                groups = probe._call('stats')['groups']
+                probe.close()
+                daemon.terminate()
+                daemon.wait()
+            print(f"{n:>5} {mode:>7} {reads:>9.0f} {commits:>9.0f} "
+                  f"{r50:>8.0f}/{r99:<8.0f} {w50:>9.0f}/{w99:<9.0f} {groups:>7}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""Cold-start cost of the Cooin modules.
+
+Times what a fresh process pays before it can do useful work: importing a
+module (and for the ledger, opening it and reading one wallet), each in a
+new interpreter so nothing is cached in sys.modules. Reports the median
+over --runs processes. With --against REV the same steps are timed on that
+git revision too (exported to a temporary directory), to show the change.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --against HEAD~1 --runs 30
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each step lists alternatives; the first one that runs in a tree is timed
+# (older trees kept the wallet helpers in the tkinter GUI module)
+STEPS = [
+    ("import ledger", ["import ledger"]),
+    ("import journal", ["import journal"]),
+    ("open ledger + read wallet", ["import ledger; ledger.get_wallet('x' * 16)"]),
+    ("new address (headless)", ["import core; core.generate_wallet_address()",
+                                "import wallet; wallet.generate_wallet_address()"]),
+    ("import miner", ["import miner"]),
+    ("import payout", ["import payout"]),
+    ("import tasks (GUI)", ["import tasks"]),
+    ("import wallet (GUI)", ["import wallet"]),
+]
+
+TIMER = "import time; _t = time.perf_counter(); {}; print(time.perf_counter() - _t)"
+
+def time_step(tree, statement, runs, env):
+    """Median seconds for `statement` in fresh interpreters, or None if it fails in this tree."""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', TIMER.format(statement)], cwd=tree, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        timings.append(float(result.stdout.split()[-1]))
+    return statistics.median(timings)
+
+def measure(tree, runs, env):
+    results = {}
+    for name, alternatives in STEPS:
+        results[name] = None
+        for statement in alternatives:
+            results[name] = time_step(tree, statement, runs, env)
+            if results[name] is not None:
+                break
+    return results
+
+def export(revision):
+    tree = tempfile.mkdtemp(prefix='cooin-import-')
+    archive = subprocess.run(['git', 'archive', revision], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', tree], input=archive, check=True)
+    subprocess.run([sys.executable, '-m', 'compileall', '-q', tree], check=True)
+    return tree
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help="fresh processes per step")
+    parser.add_argument('--against', help="git revision to compare with")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cooin-import-data-')
+    env = dict(os.environ, COOIN_DATA_FILE=os.path.join(workdir, 'cooin_data.json'),
+               COOIN_METRICS='')
+    env.pop('COOIN_BACKEND', None)
+    old_tree = None
+    try:
+        subprocess.run([sys.executable, '-m', 'compileall', '-q', ROOT], check=True)
+        current = measure(ROOT, args.runs, env)
+        if args.against:
+            old_tree = export(args.against)
+            previous = measure(old_tree, args.runs, env)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if old_tree:
+            shutil.rmtree(old_tree, ignore_errors=True)
+
+    def ms(seconds):
+        return f"{seconds * 1e3:.1f}" if seconds is not None else "n/a"
+
+    print(f"median of {args.runs} fresh processes, python={sys.version.split()[0]}")
+    if not args.against:
+        print(f"{'step':<28} {'ms':>8}")
+        for name, _ in STEPS:
+            print(f"{name:<28} {ms(current[name]):>8}")
+        return 0
+
+    print(f"{'step':<28} {args.against:>10} {'now':>8} {'change':>8}")
+    for name, _ in STEPS:
+        old, new = previous[name], current[name]
+        change = f"{(new / old - 1) * 100:+.0f}%" if old and new else ""
+        print(f"{name:<28} {ms(old):>10} {ms(new):>8} {change:>8}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
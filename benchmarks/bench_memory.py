@@ -0,0 +1,131 @@
+"""Memory held by a loaded JSON ledger: wallet dicts vs the columnar WalletTable.
+
+Writes a snapshot of --wallets wallets (a --history share of them with a
+full flight score history), then measures:
+
+  * in this process, with tracemalloc: the memory the parsed wallets take
+    as plain dicts (json.loads) and as a WalletTable, and the peak during
+    parsing
+  * in a fresh process per step: the resident and peak resident size of a
+    client that opened the ledger and read one wallet (Linux only). With --against REV the same is measured
+    on that git revision (exported to a temporary directory).
+
+    python benchmarks/bench_memory.py --wallets 1000000
+    python benchmarks/bench_memory.py --wallets 1000000 --against HEAD~1
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import provision
+import wallettable
+from history import FlightHistory
+
+CLIENT = """
+import os, sys, time
+import ledger
+began = time.perf_counter()
+backend = ledger.open_backend('json', sys.argv[1])
+backend.get_wallet(sys.argv[2])
+elapsed = time.perf_counter() - began
+with open('/proc/self/status') as f:
+    status = dict(line.split(':', 1) for line in f)
+print(int(status['VmRSS'].split()[0]) * 1024, int(status['VmHWM'].split()[0]) * 1024, elapsed)
+"""
+
+def make_snapshot(path, count, history_share, seed=42):
+    rng = random.Random(seed)
+    history = FlightHistory()
+    for _ in range(200):
+        history.append(1.0 + rng.random())
+    stored = history.to_stored()
+    wallets = {}
+    for address in provision.generate_addresses(count):
+        wallet = {"balance": rng.random() * 100, "flight_score": 1.0 + rng.random(),
+                  "wallet_address": address, "version": rng.randrange(1000)}
+        if rng.random() < history_share:
+            wallet['flight_score_history'] = dict(stored)
+        wallets[address] = wallet
+    with open(path, 'w') as f:
+        json.dump({"wallets": wallets, "journal_generation": 0}, f, separators=(',', ':'))
+    return next(iter(wallets))
+
+def traced(loads, text):
+    """(bytes held by the result, peak bytes while parsing, seconds)."""
+    gc.collect()
+    tracemalloc.start()
+    began = time.perf_counter()
+    data = loads(text)
+    elapsed = time.perf_counter() - began
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return held, peak, elapsed
+
+def client(tree, path, address):
+    result = subprocess.run([sys.executable, '-c', CLIENT, path, address], cwd=tree,
+                            env=dict(os.environ, COOIN_DAEMON='0', COOIN_METRICS=''),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    resident, peak, elapsed = result.stdout.split()
+    return int(resident), int(peak), float(elapsed)
+
+def export(revision):
+    tree = tempfile.mkdtemp(prefix='cooin-memory-')
+    archive = subprocess.run(['git', 'archive', revision], cwd=ROOT, capture_output=True, check=True).stdout
+    subprocess.run(['tar', '-x', '-C', tree], input=archive, check=True)
+    return tree
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--wallets', type=int, default=200_000)
+    parser.add_argument('--history', type=float, default=0.1, help="share of wallets with a flight score history")
+    parser.add_argument('--against', help="git revision to compare client processes with")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cooin-memory-data-')
+    old_tree = None
+    try:
+        path = os.path.join(workdir, 'cooin_data.json')
+        address = make_snapshot(path, args.wallets, args.history)
+        with open(path) as f:
+            text = f.read()
+
+        def mb(n):
+            return f"{n / 2**20:.1f}"
+
+        print(f"wallets={args.wallets} with history={args.history:.0%} snapshot={mb(len(text))} MB")
+        print(f"{'layout':<22} {'held MB':>9} {'bytes/wallet':>13} {'parse peak MB':>14} {'parse s':>8}")
+        for name, loads in (("dict of dicts", json.loads), ("WalletTable", wallettable.loads_snapshot)):
+            held, peak, elapsed = traced(loads, text)
+            print(f"{name:<22} {mb(held):>9} {held / args.wallets:>13.0f} {mb(peak):>14} {elapsed:>8.2f}")
+        del text
+
+        trees = [("now", ROOT)]
+        if args.against:
+            old_tree = export(args.against)
+            trees.insert(0, (args.against, old_tree))
+        print(f"\n{'client process':<22} {'resident MB':>12} {'peak MB':>9} {'open s':>8}")
+        for name, tree in trees:
+            resident, peak, elapsed = client(tree, path, address)
+            print(f"{name:<22} {mb(resident):>12} {mb(peak):>9} {elapsed:>8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+        if old_tree:
+            shutil.rmtree(old_tree, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Aggregate mining throughput for 1..N miner processes, unsharded vs sharded.
+
+Every process runs the miner's per-flight path (one optimistic transaction
+that pays for the flight, resolves it and records the reward) without the
+interactive sleeps, for its own set of wallets. With sharding on, miner p only owns
+wallets from shard p % shards, which is how one-miner-per-core is deployed.
+
+    python benchmarks/bench_sharding.py --processes 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import core
+import journal
+import ledger
+
+def random_address():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=16))
+
+def fly(address):
+    """One flight through the miner's logic, minus the progress bar."""
+    roll, reward_roll = random.random(), random.random()
+    ledger.run_transaction(lambda tx: core.fly(tx, address, roll, reward_roll))
+
+def fly_batched(address, batcher):
+    """The same flight, queued on a CommitBatcher instead of committed on its own."""
+    tx = ledger.Transaction()
+    core.fly(tx, address, random.random(), random.random())
+    batcher.submit(tx)
+
+def mine_worker(backend_name, path, shards, addresses, flights, window, start, results):
+    ledger.set_backend(ledger.open_backend(backend_name, path, shards))
+    start.wait()
+    began = time.perf_counter()
+    if window:
+        # One batch never pins a wallet twice
+        with ledger.CommitBatcher(window, max_size=len(addresses)) as batcher:
+            for i in range(flights):
+                fly_batched(addresses[i % len(addresses)], batcher)
+    else:
+        for i in range(flights):
+            fly(addresses[i % len(addresses)])
+    results.put(time.perf_counter() - began)
+
+def run(backend_name, processes, shards, wallets_per_process, flights, window=0.0):
+    workdir = tempfile.mkdtemp(prefix='cooin-shard-bench-')
+    path = os.path.join(workdir, os.path.basename(ledger.DEFAULT_DATA_FILES[backend_name]))
+    backend = ledger.open_backend(backend_name, path, shards)
+
+    # Give each miner wallets from "its" shard
+    owned = [[] for _ in range(processes)]
+    while any(len(o) < wallets_per_process for o in owned):
+        address = random_address()
+        for p in range(processes):
+            if ledger.shard_index(address, shards) == p % shards and len(owned[p]) < wallets_per_process:
+                owned[p].append(address)
+                backend.commit([journal.register(address, {
+                    "balance": 1e6, "flight_score": 1.0, "wallet_address": address,
+                })])
+                break
+    backend.close()
+
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [
+        multiprocessing.Process(target=mine_worker,
+                                args=(backend_name, path, shards, owned[p], flights, window, start, results))
+        for p in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    began = time.perf_counter()
+    start.set()
+    for _ in workers:
+        results.get()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - began
+
+    return processes * flights / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(ledger.BACKENDS), default='json')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--wallets', type=int, default=20, help="wallets per miner process")
+    parser.add_argument('--flights', type=int, default=2000, help="flights per miner process")
+    parser.add_argument('--commit-window', type=float, default=0.0,
+                        help="batch flights for up to this many ms (default: commit every flight)")
+    args = parser.parse_args()
+    window = args.commit_window / 1000
+
+    print(f"backend={args.backend} flights/process={args.flights} commit window={args.commit_window} ms "
+          f"cpus={os.cpu_count()}")
+    print(f"{'procs':>5} {'unsharded flights/s':>20} {'sharded flights/s':>18} {'speedup':>8}")
+    for n in args.processes:
+        flat = run(args.backend, n, 1, args.wallets, args.flights, window)
+        sharded = run(args.backend, n, n, args.wallets, args.flights, window)
+        print(f"{n:>5} {flat:>20.0f} {sharded:>18.0f} {sharded / flat:>7.2f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Headless benchmark suite for the ledger and client hot paths.
+
+Generates synthetic ledgers of each requested size (wallets with realistic,
+compact flight_score_history), then measures, for every size:
+
+    load      cold load_all_wallets() in a fresh backend
+    save      save_all_wallets() of the whole ledger
+    login     single-wallet lookups (the wallet, task and miner logins)
+    mine      one flight through the miner's transaction, without the sleeps
+    task      one wallet's daily task payout (payout.pay_daily_tasks)
+    register  a new wallet with a fresh address (the wallet's Register)
+
+Each operation runs in its own spawned process, so the reported peak RSS
+belongs to that operation (plus opening the ledger). Results are written as
+JSON; pass an earlier file to --compare to see the change in p50 latency.
+Ledgers are generated without holding them in memory, but loading a 10M
+wallet JSON ledger still needs well over 10 GB; use --backend binary there.
+
+    python benchmarks/bench_suite.py --sizes 1000 10000 100000 --output results.json
+    python benchmarks/bench_suite.py --backend binary --sizes 10000000 --ops login mine task
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core
+import journal
+import ledger
+import payout
+from history import FlightHistory
+
+CHARACTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+OPS = ['load', 'save', 'login', 'mine', 'task', 'register']
+
+# --- Synthetic Ledgers ---
+
+def synthetic_address(i):
+    """A stable, random-looking 16-character address for wallet number i."""
+    digest = hashlib.blake2b(i.to_bytes(8, 'little'), digest_size=16).digest()
+    return ''.join(CHARACTERS[b % len(CHARACTERS)] for b in digest)
+
+def history_templates(count=256, seed=1):
+    """Compact histories of varied lengths: most wallets fly a little, a few fly a lot."""
+    rng = random.Random(seed)
+    templates = []
+    for _ in range(count):
+        flights = min(int(rng.lognormvariate(3, 1.5)), 20_000)
+        history = FlightHistory([1.0])
+        score = 1.0
+        for _ in range(flights):
+            score += core.FLIGHT_SCORE_INCREASE
+            history.append(score)
+        templates.append((score, history.to_stored()))
+    return templates
+
+def synthetic_wallets(count, seed=1):
+    rng = random.Random(seed)
+    templates = history_templates(seed=seed)
+    for i in range(count):
+        address = synthetic_address(i)
+        score, history = rng.choice(templates)
+        yield address, {
+            "balance": round(rng.random() * 50, 4),
+            "flight_score": score,
+            "wallet_address": address,
+            "flight_score_history": history,
+        }
+
+def write_ledger(backend_name, path, count):
+    """Writes a synthetic ledger straight to disk, without holding it in memory."""
+    if backend_name == 'json':
+        with open(path, 'w') as f:
+            f.write('{"journal_generation":0,"wallets":{')
+            for i, (address, wallet) in enumerate(synthetic_wallets(count)):
+                f.write(("," if i else "") + json.dumps(address) + ":" + json.dumps(wallet, separators=(',', ':')))
+            f.write('}}')
+    elif backend_name == 'sqlite':
+        backend = ledger.SQLiteBackend(path)
+        backend.conn.execute("BEGIN")
+        backend.conn.executemany(backend.INSERT,
+                                 (backend._wallet_to_row(a, w) for a, w in synthetic_wallets(count)))
+        backend.conn.execute("COMMIT")
+        backend.close()
+    else:
+        backend = ledger.open_backend(backend_name, path)
+        backend.bulk_load(synthetic_wallets(count))
+        backend.close()
+
+# --- Operations ---
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def run_op(backend_name, path, wallets, op, samples, results):
+    """Child process: times `samples` runs of one operation."""
+    os.environ['COOIN_DAEMON'] = '0'
+    rng = random.Random(op)
+    ledger.set_backend(ledger.open_backend(backend_name, path))
+    if op not in ('load', 'save'):
+        ledger.wallet_count() # open (and for JSON, parse) the ledger outside the timings
+
+    def existing():
+        return synthetic_address(rng.randrange(wallets))
+
+    def once():
+        if op == 'load':
+            backend = ledger.open_backend(backend_name, path)
+            backend.load_all()
+            backend.close()
+        elif op == 'save':
+            ledger.save_all_wallets(data)
+        elif op == 'login':
+            ledger.get_wallet(existing())
+        elif op == 'mine':
+            address = existing()
+            roll, reward_roll = rng.random(), rng.random()
+            ledger.run_transaction(lambda tx: core.fly(tx, address, roll, reward_roll))
+        elif op == 'task':
+            # A fresh day per sample, so every sample pays
+            payout.pay_daily_tasks([existing()], day=base_day + len(timings))
+        elif op == 'register':
+            address = ''.join(rng.choices(CHARACTERS, k=16))
+            ledger.commit(journal.register(address, {
+                "balance": 0.0, "flight_score": 1.0, "wallet_address": address,
+            }))
+
+    data = ledger.load_all_wallets() if op == 'save' else None
+    base_day = payout.today()
+    timings = []
+    began = time.perf_counter()
+    for _ in range(samples):
+        start = time.perf_counter()
+        once()
+        timings.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - began
+    results.put((timings, elapsed, peak_rss_mb()))
+
+def measure(backend_name, path, wallets, op, samples):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    child = context.Process(target=run_op, args=(backend_name, path, wallets, op, samples, results))
+    child.start()
+    timings, elapsed, rss = results.get()
+    child.join()
+
+    timings.sort()
+    return {
+        "backend": backend_name,
+        "wallets": wallets,
+        "op": op,
+        "samples": len(timings),
+        "p50_ms": timings[len(timings) // 2] * 1e3,
+        "p99_ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e3,
+        "ops_per_s": len(timings) / elapsed,
+        "peak_rss_mb": rss,
+    }
+
+def samples_for(op, wallets, args):
+    if op in ('load', 'save'):
+        # Whole-ledger operations get fewer runs as the ledger grows
+        return max(1, min(args.reps, 10_000_000 // max(wallets, 1)))
+    return args.samples
+
+# --- Reporting ---
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+    previous = {(r['backend'], r['wallets'], r['op']): r for r in baseline['results']}
+    print(f"\nvs {baseline_path} ({baseline.get('revision') or 'unknown revision'}):")
+    for r in results:
+        old = previous.get((r['backend'], r['wallets'], r['op']))
+        if old:
+            change = (r['p50_ms'] / old['p50_ms'] - 1) * 100 if old['p50_ms'] else 0.0
+            print(f"  {r['wallets']:>9} {r['op']:<9} p50 {old['p50_ms']:>10.3f} -> {r['p50_ms']:>10.3f} ms"
+                  f" ({change:+.1f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(ledger.BACKENDS), default='json')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+    parser.add_argument('--ops', nargs='+', choices=OPS, default=OPS)
+    parser.add_argument('--samples', type=int, default=1000, help="runs of each single-wallet operation")
+    parser.add_argument('--reps', type=int, default=5, help="runs of load and save (fewer for big ledgers)")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="earlier results file to compare p50 latencies with")
+    args = parser.parse_args()
+
+    results = []
+    print(f"backend={args.backend} python={platform.python_version()} cpus={os.cpu_count()}")
+    print(f"{'wallets':>9} {'op':<9} {'p50 ms':>10} {'p99 ms':>10} {'ops/s':>10} {'peak RSS MB':>12}")
+    for wallets in args.sizes:
+        workdir = tempfile.mkdtemp(prefix='cooin-suite-')
+        path = os.path.join(workdir, os.path.basename(ledger.DEFAULT_DATA_FILES[args.backend]))
+        try:
+            write_ledger(args.backend, path, wallets)
+            for op in OPS:
+                if op not in args.ops:
+                    continue
+                r = measure(args.backend, path, wallets, op, samples_for(op, wallets, args))
+                results.append(r)
+                rss = f"{r['peak_rss_mb']:.1f}" if r['peak_rss_mb'] is not None else "n/a"
+                print(f"{wallets:>9} {op:<9} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} "
+                      f"{r['ops_per_s']:>10.1f} {rss:>12}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "revision": git_revision(),
+                "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "results": results,
+            }, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Transfer throughput and confirmation latency by block size.
+
+Provisions a ledger of funded wallets, then pushes the same stream of
+random transfers through a Mempool and BlockProducer once per block size:
+each transfer is submitted (and validated), and a block is applied whenever
+one is full. Reports confirmed transfers per second, the time spent
+committing blocks, and how long transfers waited from submission to
+confirmation. Block size 1 is what committing every transfer on its own
+costs.
+
+    python benchmarks/bench_transfers.py --backend json --block-sizes 1 10 100 1000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger
+import provision
+import transfers
+
+def run(addresses, stream, block_size):
+    mempool = transfers.Mempool(max_size=len(stream) + 1)
+    producer = transfers.BlockProducer(mempool, block_size=block_size)
+    refused = 0
+    began = time.perf_counter()
+    for sender, recipient, amount in stream:
+        try:
+            mempool.submit(sender, recipient, amount)
+        except transfers.TransferRejected:
+            refused += 1
+        if len(mempool) >= block_size:
+            producer.produce()
+    producer.drain()
+    elapsed = time.perf_counter() - began
+    return elapsed, refused, producer.stats()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=sorted(ledger.BACKENDS), default='json')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--wallets', type=int, default=10_000)
+    parser.add_argument('--transfers', type=int, default=20_000, help="transfers per block size")
+    parser.add_argument('--block-sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cooin-transfers-')
+    try:
+        path = os.path.join(workdir, os.path.basename(ledger.DEFAULT_DATA_FILES[args.backend]))
+        ledger.set_backend(ledger.open_backend(args.backend, path, args.shards))
+        addresses = provision.provision(args.wallets, balance=1000.0)
+        rng = random.Random(42)
+        stream = [(*rng.sample(addresses, 2), round(rng.uniform(0.01, 5.0), 4)) for _ in range(args.transfers)]
+
+        print(f"backend={args.backend} shards={args.shards} wallets={args.wallets} transfers={args.transfers}")
+        print(f"{'block':>6} {'blocks':>7} {'transfers/s':>12} {'commit s':>9} "
+              f"{'latency p50 ms':>15} {'p99 ms':>8} {'rejected':>9}")
+        for block_size in args.block_sizes:
+            elapsed, refused, stats = run(addresses, stream, block_size)
+            print(f"{block_size:>6} {stats['blocks']:>7} {stats['confirmed'] / elapsed:>12.0f} "
+                  f"{stats['commit_seconds']:>9.2f} {stats['latency_p50'] * 1e3:>15.2f} "
+                  f"{stats['latency_p99'] * 1e3:>8.2f} {stats['rejected'] + refused:>9}")
+    finally:
+        ledger.set_backend(None)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,493 @@
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from contextlib import contextmanager
+
+import journal
+import leaderboard
+import ledger
+
+# Memory-mapped fixed-width binary ledger (COOIN_BACKEND=binary).
+#
+#   cooin_data.bin   header + one 48-byte record per wallet: address (16
+#                    bytes), balance (f64), flight_score (f64), version (u32),
+#                    last daily task day (u32 date ordinal, 0 = never),
+#                    history pointer (u64)
+#   cooin_data.idx   open-addressing hash table of u64 slots (record index
+#                    + 1, 0 = empty), so a login check or a single-wallet
+#                    update touches a few bytes instead of parsing the ledger
+#   cooin_data.hist  append-only history blobs (u32 length + JSON); a
+#                    record's history pointer is the blob offset + 1. A
+#                    blob replaced by a newer one is dead; once dead blobs
+#                    are most of the file, the live ones are copied to a
+#                    fresh cooin_data.hist.<generation> (see _compact_history)
+#   cooin_data.redo  after-images of the commit being applied, replayed if a
+#                    process died half-way through writing them
+#
+# Writers hold the exclusive ledger lock and update records in place;
+# readers hold the shared lock. Files are resized while mapped, so this
+# backend is POSIX only.
+
+MAGIC = b'COOINBL1'
+# magic, count, capacity, index slots, index epoch, history file generation, dead history bytes
+HEADER = struct.Struct('<8sQQQQQQ')
+HEADER_SIZE = 64
+# Version and task day share what used to be a u64 version, so older files
+# read back with task day 0
+RECORD = struct.Struct('<16sddIIQ')
+SLOT = struct.Struct('<Q')
+BLOB_LEN = struct.Struct('<I')
+REDO_HEADER = struct.Struct('<IQQ') # crc32 of the rest, new record count, entry count
+REDO_ENTRY = struct.Struct('<Q')    # record index, followed by the packed record
+ADDRESS_SIZE = 16
+MIN_CAPACITY = 1024
+MAX_LOAD = 0.5
+# The history file is rewritten once dead blobs take up this many bytes and more than half of it
+HISTORY_COMPACT_MIN = 1 << 20
+
+def address_key(address):
+    key = address.encode('ascii')
+    if len(key) > ADDRESS_SIZE:
+        raise ledger.LedgerError(f"Address longer than {ADDRESS_SIZE} characters: {address}")
+    return key
+
+def address_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+def _slots_for(count):
+    slots = 2 * MIN_CAPACITY
+    while count > slots * MAX_LOAD:
+        slots *= 2
+    return slots
+
+def _build_index(keys, slots):
+    """Hash table (as bytes) for record keys in record order."""
+    table = bytearray(slots * SLOT.size)
+    mask = slots - 1
+    for rec, key in enumerate(keys):
+        i = address_hash(key) & mask
+        while SLOT.unpack_from(table, i * SLOT.size)[0]:
+            i = (i + 1) & mask
+        SLOT.pack_into(table, i * SLOT.size, rec + 1)
+    return table
+
+class BinaryBackend(ledger.LedgerBackend):
+    def __init__(self, path):
+        self.path = path
+        root = os.path.splitext(path)[0]
+        self.index_path = root + '.idx'
+        self.history_path = root + '.hist' # generation 0; see _history_path()
+        self.redo_path = root + '.redo'
+        self._lock = journal.LedgerLock(path)
+        self._file = self._map = None
+        self._index_file = self._index = None
+        self._hist_fd = None
+        self._stat = None
+        try:
+            self._redo_fd = os.open(self.redo_path, os.O_RDWR | os.O_CREAT, 0o644)
+            with self._lock.hold(exclusive=True):
+                if not os.path.exists(path):
+                    self._write_files([], 0, [])
+                self._remap()
+                self._recover()
+                self._remove_stale_histories()
+        except (IOError, ValueError) as e:
+            raise ledger.LedgerError(f"Could not open binary ledger: {e}")
+
+    def _history_path(self, generation):
+        return self.history_path if not generation else f"{self.history_path}.{generation}"
+
+    def _remove_stale_histories(self):
+        """Deletes history files of other generations, left by a rewrite that died half-way."""
+        directory = os.path.dirname(self.history_path) or '.'
+        prefix = os.path.basename(self.history_path) + '.'
+        stale = [name for name in os.listdir(directory)
+                 if name.startswith(prefix) and name[len(prefix):].isdigit()
+                 and int(name[len(prefix):]) != self._history_generation]
+        if self._history_generation and os.path.exists(self.history_path):
+            stale.append(os.path.basename(self.history_path))
+        for name in stale:
+            os.remove(os.path.join(directory, name))
+
+    # --- Mapping ---
+
+    def _close_maps(self):
+        for m in (self._map, self._index):
+            if m is not None:
+                m.close()
+        for f in (self._file, self._index_file):
+            if f is not None:
+                f.close()
+        if self._hist_fd is not None:
+            os.close(self._hist_fd)
+        self._file = self._map = self._index_file = self._index = self._hist_fd = None
+
+    def _remap(self):
+        self._close_maps()
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        st = os.fstat(self._file.fileno())
+        self._stat = (st.st_ino, st.st_size)
+
+        (magic, self._count, self._capacity, self._slots, self._epoch,
+         self._history_generation, self._dead) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a Cooin binary ledger")
+
+        self._index_file = open(self.index_path, 'r+b')
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+        self._hist_fd = os.open(self._history_path(self._history_generation),
+                                os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _sync(self):
+        """Picks up files another process grew, rebuilt or replaced. Caller holds the lock."""
+        st = os.stat(self.path)
+        if (st.st_ino, st.st_size) != self._stat:
+            self._remap()
+            return
+        _, self._count, self._capacity, self._slots, epoch, _, self._dead = HEADER.unpack_from(self._map, 0)
+        if epoch != self._epoch:
+            self._remap()
+
+    def _write_header(self):
+        HEADER.pack_into(self._map, 0, MAGIC, self._count, self._capacity, self._slots, self._epoch,
+                         self._history_generation, self._dead)
+
+    @contextmanager
+    def _held(self, exclusive=False):
+        try:
+            if os.fstat(self._redo_fd).st_size:
+                with self._lock.hold(exclusive=True):
+                    self._sync()
+                    self._recover()
+            with self._lock.hold(exclusive):
+                self._sync()
+                yield
+        except (IOError, ValueError, struct.error) as e:
+            raise ledger.LedgerError(f"Binary ledger I/O error: {e}")
+
+    # --- Records ---
+
+    def _offset(self, rec):
+        return HEADER_SIZE + rec * RECORD.size
+
+    def _find(self, key):
+        """Record index for an address key, or -1."""
+        padded = key.ljust(ADDRESS_SIZE, b'\0')
+        mask = self._slots - 1
+        i = address_hash(key) & mask
+        while True:
+            value = SLOT.unpack_from(self._index, i * SLOT.size)[0]
+            if not value:
+                return -1
+            offset = self._offset(value - 1)
+            if self._map[offset:offset + ADDRESS_SIZE] == padded:
+                return value - 1
+            i = (i + 1) & mask
+
+    def _read(self, rec):
+        raw, balance, flight_score, version, task_day, history = RECORD.unpack_from(self._map, self._offset(rec))
+        wallet = {
+            "balance": balance,
+            "flight_score": flight_score,
+            "wallet_address": raw.rstrip(b'\0').decode('ascii'),
+            "version": version,
+        }
+        if task_day:
+            wallet['task_day'] = task_day
+        if history:
+            wallet['flight_score_history'] = self._read_history(history - 1)
+        return wallet, history
+
+    def _read_history(self, offset):
+        (length,) = BLOB_LEN.unpack(os.pread(self._hist_fd, BLOB_LEN.size, offset))
+        return json.loads(os.pread(self._hist_fd, length, offset + BLOB_LEN.size))
+
+    def _append_history(self, stored):
+        blob = json.dumps(stored, separators=(',', ':')).encode()
+        offset = os.fstat(self._hist_fd).st_size
+        os.write(self._hist_fd, BLOB_LEN.pack(len(blob)) + blob)
+        return offset + 1
+
+    def _history_size(self, history):
+        """Bytes taken by the blob a history pointer points to."""
+        (length,) = BLOB_LEN.unpack(os.pread(self._hist_fd, BLOB_LEN.size, history - 1))
+        return BLOB_LEN.size + length
+
+    def _compact_history(self):
+        """Rewrites the ledger with only the live history blobs. Caller holds the exclusive lock.
+
+        The blobs go to a history file of the next generation, and the new
+        main file naming it replaces the old one last, so a crash at any
+        point leaves either the old ledger or the new one.
+        """
+        wallets = ((wallet['wallet_address'], wallet) for wallet, _ in map(self._read, range(self._count)))
+        self._replace_files(wallets)
+
+    def _replace_files(self, items):
+        old_history = self._history_path(self._history_generation)
+        self._write_files(items, self._epoch + 1, history_generation=self._history_generation + 1)
+        self._remap()
+        try:
+            os.remove(old_history)
+        except FileNotFoundError:
+            pass
+
+    def _index_insert(self, key, rec):
+        mask = self._slots - 1
+        i = address_hash(key) & mask
+        while SLOT.unpack_from(self._index, i * SLOT.size)[0]:
+            i = (i + 1) & mask
+        SLOT.pack_into(self._index, i * SLOT.size, rec + 1)
+
+    def _reserve(self, count):
+        """Grows the record area and the index so `count` records fit."""
+        if count > self._capacity:
+            capacity = self._capacity
+            while count > capacity:
+                capacity *= 2
+            self._map.close()
+            self._file.truncate(HEADER_SIZE + capacity * RECORD.size)
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self._capacity = capacity
+            self._write_header()
+            st = os.fstat(self._file.fileno())
+            self._stat = (st.st_ino, st.st_size)
+
+        if count > self._slots * MAX_LOAD:
+            keys = (self._map[self._offset(rec):self._offset(rec) + ADDRESS_SIZE].rstrip(b'\0')
+                    for rec in range(self._count))
+            table = _build_index(keys, _slots_for(count))
+            tmp = self.index_path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(table)
+            os.replace(tmp, self.index_path)
+            self._slots = len(table) // SLOT.size
+            self._epoch += 1
+            self._write_header()
+            self._index.close()
+            self._index_file.close()
+            self._index_file = open(self.index_path, 'r+b')
+            self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+    # --- Crash Recovery ---
+
+    def _apply_images(self, count, images):
+        for rec, packed in images:
+            self._map[self._offset(rec):self._offset(rec) + RECORD.size] = packed
+            if rec >= self._count:
+                self._index_insert(packed[:ADDRESS_SIZE].rstrip(b'\0'), rec)
+        self._count = max(self._count, count)
+        self._write_header()
+
+    def _recover(self):
+        """Re-applies a commit a dead process left half-written. Caller holds the exclusive lock."""
+        size = os.fstat(self._redo_fd).st_size
+        if not size:
+            return
+        redo = os.pread(self._redo_fd, size, 0)
+        if len(redo) >= REDO_HEADER.size:
+            crc, count, entries = REDO_HEADER.unpack_from(redo, 0)
+            body = redo[REDO_HEADER.size:]
+            if zlib.crc32(redo[4:]) == crc and len(body) == entries * (REDO_ENTRY.size + RECORD.size):
+                # Complete redo record: the commit may be partially applied
+                self._reserve(count)
+                images = []
+                for i in range(entries):
+                    start = i * (REDO_ENTRY.size + RECORD.size)
+                    (rec,) = REDO_ENTRY.unpack_from(body, start)
+                    packed = body[start + REDO_ENTRY.size:start + REDO_ENTRY.size + RECORD.size]
+                    if rec >= self._count and self._find(packed[:ADDRESS_SIZE].rstrip(b'\0')) >= 0:
+                        continue
+                    images.append((rec, packed))
+                self._apply_images(count, images)
+            # A torn redo record means the commit never started applying
+        os.ftruncate(self._redo_fd, 0)
+
+    # --- Backend Interface ---
+
+    def load_all(self):
+        with self._held():
+            return {"wallets": {wallet['wallet_address']: wallet
+                                for wallet, _ in map(self._read, range(self._count))}}
+
+    def save_all(self, data):
+        self.bulk_load(data['wallets'].items())
+
+    def bulk_load(self, items):
+        """Replaces the ledger with (address, wallet) pairs, streamed straight to new files."""
+        with self._held(exclusive=True):
+            self._replace_files(items)
+
+    def _write_files(self, items, epoch, keys=None, history_generation=0):
+        keys = [] if keys is None else keys
+        history_path = self._history_path(history_generation)
+        tmp = {path: path + '.tmp' for path in (self.path, self.index_path, history_path)}
+
+        with open(tmp[self.path], 'wb') as main, open(tmp[history_path], 'wb') as hist:
+            main.write(bytes(HEADER_SIZE))
+            hist_offset = 0
+            for address, wallet in items:
+                key = address_key(address)
+                history = 0
+                if wallet.get('flight_score_history') is not None:
+                    blob = json.dumps(wallet['flight_score_history'], separators=(',', ':')).encode()
+                    hist.write(BLOB_LEN.pack(len(blob)) + blob)
+                    history = hist_offset + 1
+                    hist_offset += BLOB_LEN.size + len(blob)
+                main.write(RECORD.pack(key, wallet['balance'], wallet['flight_score'],
+                                       wallet.get('version', 0), wallet.get('task_day', 0), history))
+                keys.append(key)
+
+            count = len(keys)
+            capacity = max(MIN_CAPACITY, count)
+            main.truncate(HEADER_SIZE + capacity * RECORD.size)
+            table = _build_index(keys, _slots_for(count))
+            main.seek(0)
+            main.write(HEADER.pack(MAGIC, count, capacity, len(table) // SLOT.size, epoch, history_generation, 0))
+
+        with open(tmp[self.index_path], 'wb') as f:
+            f.write(table)
+        # The main file goes last: other processes remap when its inode
+        # changes, and until then the history file it names is still there
+        for path in (history_path, self.index_path, self.path):
+            os.replace(tmp[path], path)
+
+    def get_wallet(self, address):
+        with self._held():
+            rec = self._find(address_key(address))
+            return self._read(rec)[0] if rec >= 0 else None
+
+    def get_wallets(self, addresses):
+        wallets = {}
+        with self._held():
+            for address in addresses:
+                rec = self._find(address_key(address))
+                if rec >= 0:
+                    wallets[address] = self._read(rec)[0]
+        return wallets
+
+    def wallet_exists(self, address):
+        with self._held():
+            return self._find(address_key(address)) >= 0
+
+    def wallet_count(self):
+        with self._held():
+            return self._count
+
+    def _ranking_keys(self, field):
+        """(-value, address) for every record, straight from the mapped records."""
+        column = 1 + leaderboard.FIELDS.index(field)
+        for values in RECORD.iter_unpack(self._map[HEADER_SIZE:self._offset(self._count)]):
+            yield -values[column], values[0].rstrip(b'\0').decode('ascii')
+
+    def top_wallets(self, field, n):
+        # Fixed-width records scan fast enough that a separate ranking file
+        # isn't worth keeping in step with in-place updates
+        leaderboard.check_field(field)
+        with self._held():
+            return [(address, -negated) for negated, address in heapq.nsmallest(n, self._ranking_keys(field))]
+
+    def count_ahead(self, field, value, address):
+        leaderboard.check_field(field)
+        key = (-value, address)
+        with self._held():
+            return sum(1 for other in self._ranking_keys(field) if other < key)
+
+    def commit(self, records):
+        error = ledger.malformed(records)
+        if error is not None:
+            raise error
+        with self._held(exclusive=True):
+            touched = {"wallets": {}}
+            before = {}
+            for address in {record['addr'] for record in records}:
+                rec = self._find(address_key(address))
+                if rec >= 0:
+                    wallet, history = self._read(rec)
+                    touched['wallets'][address] = wallet
+                    before[address] = (rec, history, wallet.get('flight_score_history'))
+
+            if not journal.apply_commit(touched, records):
+                raise ledger.VersionConflict("Wallet was modified by another process.")
+
+            count = self._count
+            images = []
+            for address, wallet in touched['wallets'].items():
+                rec, history, stored = before.get(address, (None, 0, None))
+                if rec is None:
+                    rec = count
+                    count += 1
+                if wallet.get('flight_score_history') is not stored:
+                    if history:
+                        self._dead += self._history_size(history)
+                    history = self._append_history(wallet['flight_score_history'])
+                images.append((rec, RECORD.pack(address_key(address), wallet['balance'], wallet['flight_score'],
+                                                wallet['version'], wallet.get('task_day', 0), history)))
+
+            self._reserve(count)
+            body = b''.join(REDO_ENTRY.pack(rec) + packed for rec, packed in images)
+            redo = struct.pack('<QQ', count, len(images)) + body
+            os.pwrite(self._redo_fd, struct.pack('<I', zlib.crc32(redo)) + redo, 0)
+            self._apply_images(count, images)
+            os.ftruncate(self._redo_fd, 0)
+
+            if self._dead >= HISTORY_COMPACT_MIN and 2 * self._dead > os.fstat(self._hist_fd).st_size:
+                # The commit is already applied: a failed rewrite mustn't fail it
+                try:
+                    self._compact_history()
+                except (IOError, ValueError) as e:
+                    print(f"Warning: could not compact {self._history_path(self._history_generation)}: {e}",
+                          file=sys.stderr)
+                    self._dead = 0 # count afresh instead of retrying on every commit
+
+    def close(self):
+        self._close_maps()
+        os.close(self._redo_fd)
+        self._lock.close()
+
+# --- Converters ---
+
+def import_json(json_path, bin_path):
+    """Converts a cooin_data.json ledger (snapshot + journal) to the binary format."""
+    data = ledger.JSONBackend(json_path).load_all()
+    BinaryBackend(bin_path).bulk_load(data['wallets'].items())
+    return len(data['wallets'])
+
+def export_json(bin_path, json_path):
+    """Converts a binary ledger back to a cooin_data.json snapshot."""
+    data = BinaryBackend(bin_path).load_all()
+    ledger.JSONBackend(json_path).save_all(data)
+    return len(data['wallets'])
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert between cooin_data.json and the binary ledger.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('import', help="JSON ledger -> binary ledger")
+    p.add_argument('json_path')
+    p.add_argument('bin_path')
+    p = sub.add_parser('export', help="binary ledger -> JSON ledger")
+    p.add_argument('bin_path')
+    p.add_argument('json_path')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'import':
+            count = import_json(args.json_path, args.bin_path)
+            print(f"Imported {count} wallets into {args.bin_path}.")
+        else:
+            count = export_json(args.bin_path, args.json_path)
+            print(f"Exported {count} wallets to {args.json_path}.")
+    except ledger.LedgerError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
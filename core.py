@@ -0,0 +1,129 @@
+import journal
+import ledger
+import provision
+from history import is_compact
+
+# Cooin's wallet, mining and task rules, without any user interface.
+#
+# The GUI clients (wallet.py, tasks.py), the command-line miner and the
+# headless tools (batch_miner.py, payout.py, provision.py, the benchmarks)
+# all build on this module. It never imports tkinter, prints or blocks, so
+# scripts and cron jobs can use it without a display and without paying
+# for Tk at startup.
+
+# Rewards and difficulty settings
+BASE_MINE_REWARD = 1.0
+MINE_COST = 0.005
+FLIGHT_SCORE_INCREASE = 0.01
+BASE_SUCCESS_CHANCE = 0.6
+MAX_SUCCESS_CHANCE = 0.95
+REWARD_RANGE = (0.9, 1.1) # multiplier on BASE_MINE_REWARD
+CHANCE_SCORE_SCALE = 10.0 # flight score points per +1.0 of success chance
+
+DAILY_TASK_REWARD = 0.5 # Fixed, guaranteed reward for a quick task
+
+# The settings above as one dict. The rule functions below take an optional
+# `rules` argument so offline tools (econ_sim.py) can try other values with
+# exactly the same arithmetic; the clients always use these.
+RULES = {
+    "base_mine_reward": BASE_MINE_REWARD,
+    "mine_cost": MINE_COST,
+    "flight_score_increase": FLIGHT_SCORE_INCREASE,
+    "base_success_chance": BASE_SUCCESS_CHANCE,
+    "max_success_chance": MAX_SUCCESS_CHANCE,
+    "chance_score_scale": CHANCE_SCORE_SCALE,
+    "reward_range": REWARD_RANGE,
+    "daily_task_reward": DAILY_TASK_REWARD,
+}
+
+def make_rules(**changes):
+    """A copy of RULES with some settings changed."""
+    unknown = set(changes) - set(RULES)
+    if unknown:
+        raise ValueError(f"Unknown rule settings: {', '.join(sorted(unknown))}")
+    return dict(RULES, **changes)
+
+# --- Wallets ---
+
+def generate_wallet_address():
+    """Generates a random 16-character alphanumeric wallet address (Token)."""
+    return provision.generate_address()
+
+def register_wallet():
+    """Registers a new, empty wallet and returns its address."""
+    # The register record refuses to overwrite an existing wallet, so retry
+    # with a fresh address on a collision
+    for _ in range(ledger.MAX_RETRIES):
+        new_address = generate_wallet_address()
+        try:
+            ledger.commit(journal.register(new_address, {
+                "balance": 0.0,
+                "flight_score": 1.0,
+                "wallet_address": new_address
+            }))
+            return new_address
+        except ledger.VersionConflict:
+            continue
+    raise ledger.VersionConflict("Could not allocate a unique wallet address.")
+
+# --- Mining Logic ---
+
+def uncapped_chance(flight_score, rules=RULES):
+    """Success chance before the cap. Also works elementwise on arrays."""
+    return rules['base_success_chance'] + (flight_score - 1.0) / rules['chance_score_scale']
+
+def success_chance(flight_score, rules=RULES):
+    """Success chance increases with Flight Score (up to a max of 95%)."""
+    return min(rules['max_success_chance'], uncapped_chance(flight_score, rules))
+
+def flight_reward(reward_roll, rules=RULES):
+    """Reward for a successful flight; reward_roll is uniform in [0, 1).
+
+    Same arithmetic as random.uniform(*REWARD_RANGE), so a recorded roll
+    always reproduces the exact reward. Also works elementwise on arrays.
+    """
+    low, high = rules['reward_range']
+    return rules['base_mine_reward'] * (low + (high - low) * reward_roll)
+
+def resolve_flight(flight_score, roll, reward_roll, rules=RULES):
+    """Outcome of one paid flight: the reward earned, or None on failure."""
+    if roll < success_chance(flight_score, rules):
+        return flight_reward(reward_roll, rules)
+    return None
+
+def flight_cost_records(wallet_data):
+    """Records that pay for one flight, or None if the balance can't cover it."""
+    current_address = wallet_data['wallet_address']
+    if wallet_data['balance'] < MINE_COST:
+        return None
+
+    records = [journal.debit(current_address, MINE_COST)]
+    # Note: History tracking needs to be initialized (or migrated) if not present
+    if not is_compact(wallet_data.get('flight_score_history')):
+        records.append(journal.init_history(current_address))
+    return records
+
+def flight_records(wallet_data, reward):
+    """All records of one flight (cost, backfill, reward), or None if the balance can't cover it."""
+    records = flight_cost_records(wallet_data)
+    if records is not None and reward is not None:
+        current_address = wallet_data['wallet_address']
+        records += [journal.credit(current_address, reward),
+                    journal.score(current_address, FLIGHT_SCORE_INCREASE)]
+    return records
+
+def fly(tx, current_address, roll, reward_roll):
+    """One flight as a single transaction.
+
+    Returns (updated wallet, reward or None), or (None, None) if the wallet
+    can't pay for the flight.
+    """
+    wallet_data = tx.get_wallet(current_address)
+    if wallet_data is None:
+        raise ledger.LedgerError(f"Unknown wallet: {current_address}")
+    reward = resolve_flight(wallet_data['flight_score'], roll, reward_roll)
+    records = flight_records(wallet_data, reward)
+    if records is None:
+        return None, None
+    tx.add(*records)
+    return tx.updated(current_address), reward
@@ -0,0 +1,198 @@
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import core
+from batch_miner import engines_agree, mine_vectorized
+
+# Offline economic parameter sweep.
+#
+# Simulates a population of fresh wallets over a number of days for every
+# combination of reward settings in a grid, and reports how the coin supply
+# grows and where flight scores end up. Nothing touches the ledger.
+#
+# Population model, per day:
+#   * every wallet completes the daily task with some probability (task
+#     earners with --task-rate, miners with --miner-task-rate), at most once
+#     a day, as tasks.py and payout.py allow
+#   * every miner then attempts --flights flights, each paid for only while
+#     the balance covers the flight cost, exactly like miner.py
+# Flights are resolved by batch_miner.mine_vectorized with the configuration's
+# rules (core.make_rules), the same engine and arithmetic the batch miner
+# commits, and --verify checks it against the per-flight logic of
+# core.resolve_flight for every configuration before the sweep.
+#
+# Configurations run in parallel on a process pool. Every configuration
+# uses the same random draws (seeded by --seed), so differences between
+# rows come from the settings, not from luck.
+
+# Grid settings that can be swept, with their core.RULES key
+SWEEPABLE = ('base_mine_reward', 'mine_cost', 'flight_score_increase', 'daily_task_reward',
+             'base_success_chance', 'max_success_chance', 'chance_score_scale')
+
+SCORE_PERCENTILES = (50, 90, 99)
+
+# --- Simulation ---
+
+def simulate(rules, miners, earners, days, flights, task_rate, miner_task_rate, seed):
+    """Runs one configuration. Returns a summary dict (see summarize)."""
+    rng = np.random.default_rng(seed)
+    balance = np.zeros(miners + earners)
+    score = np.ones(miners)
+    task_rates = np.concatenate([np.full(miners, miner_task_rate), np.full(earners, task_rate)])
+
+    supply = np.zeros(days + 1)
+    totals = {"tasks": 0, "flights": 0, "successes": 0, "minted": 0.0, "burned": 0.0}
+    for day in range(days):
+        # Daily tasks first: a new miner can't fly before its first task reward
+        done = rng.random(miners + earners) < task_rates
+        balance += np.where(done, rules['daily_task_reward'], 0.0)
+        tasks = int(done.sum())
+        totals['tasks'] += tasks
+        totals['minted'] += tasks * rules['daily_task_reward']
+
+        if miners and flights:
+            rolls, reward_rolls = rng.random((flights, miners)), rng.random((flights, miners))
+            flown, rewards, balance[:miners], score = mine_vectorized(balance[:miners], score, rolls,
+                                                                      reward_rolls, rules)
+            paid = int(flown.sum())
+            totals['flights'] += paid
+            totals['successes'] += int((~np.isnan(rewards)).sum())
+            totals['burned'] += paid * rules['mine_cost']
+            totals['minted'] += float(np.nansum(rewards))
+        supply[day + 1] = balance.sum()
+
+    return summarize(rules, supply, score, balance[:miners], totals)
+
+def summarize(rules, supply, score, miner_balance, totals):
+    days = len(supply) - 1
+    half = days // 2
+    # Compound daily growth over the second half, once the starting-from-zero effect has worn off
+    growth = (supply[days] / supply[half]) ** (1 / (days - half)) - 1 if half and supply[half] > 0 else None
+    summary = {
+        "supply": float(supply[days]),
+        "minted": totals['minted'],
+        "burned": totals['burned'],
+        "daily_issuance": float(supply[days] - supply[days - 1]) if days else 0.0,
+        "daily_growth": growth,
+        "tasks": totals['tasks'],
+        "flights": totals['flights'],
+        "success_rate": totals['successes'] / totals['flights'] if totals['flights'] else None,
+        "broke_miners": float((miner_balance < rules['mine_cost']).mean()) if miner_balance.size else None,
+    }
+    if score.size:
+        summary['score_mean'] = float(score.mean())
+        for q, value in zip(SCORE_PERCENTILES, np.percentile(score, SCORE_PERCENTILES)):
+            summary[f'score_p{q}'] = float(value)
+        summary['score_max'] = float(score.max())
+        # Miners whose success chance has reached the cap
+        summary['at_max_chance'] = float((core.uncapped_chance(score, rules) >= rules['max_success_chance']).mean())
+    return summary
+
+def run_config(job):
+    """Pool entry point: (settings, simulation arguments) -> (settings, summary, seconds)."""
+    settings, args = job
+    started = time.perf_counter()
+    summary = simulate(core.make_rules(**settings), **args)
+    return settings, summary, time.perf_counter() - started
+
+def grid(values):
+    """Every combination of {setting: [values]}, as a list of {setting: value}."""
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+def sweep(configs, workers=None, **args):
+    """Simulates every configuration on a process pool. Yields results as they finish, in order."""
+    jobs = [(settings, args) for settings in configs]
+    if workers == 1:
+        yield from map(run_config, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(run_config, jobs)
+
+# --- Main Execution ---
+
+def parse_values(text):
+    return [float(value) for value in text.split(',') if value.strip()]
+
+def format_row(settings, summary, names):
+    def number(value, spec, scale=1):
+        return format(value * scale, spec) if value is not None else "n/a"
+    cells = [f"{settings[name]:>{max(len(name), 8)}g}" for name in names]
+    cells += [f"{summary['supply']:>12.1f}", f"{number(summary['daily_growth'], '.2f', 100):>8}",
+              f"{number(summary['success_rate'], '.3f'):>7}", f"{number(summary['broke_miners'], '.3f'):>6}"]
+    if 'score_mean' in summary:
+        cells += [f"{summary['score_mean']:>6.2f}"] + [f"{summary[f'score_p{q}']:>6.2f}" for q in SCORE_PERCENTILES]
+        cells += [f"{summary['at_max_chance']:>6.3f}"]
+    return "  ".join(cells)
+
+def main(argv=None):
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(
+        description="Sweep Cooin reward settings over a simulated population of miners and task earners.",
+        epilog="Each setting takes a comma-separated list of values; every combination is simulated. "
+               "Unset settings keep the live values from core.py.")
+    for name in SWEEPABLE:
+        parser.add_argument('--' + name.replace('_', '-'), type=parse_values, metavar='V[,V...]',
+                            default=[core.RULES[name]])
+    parser.add_argument('--miners', type=int, default=10_000, help="wallets that mine (and sometimes do tasks)")
+    parser.add_argument('--earners', type=int, default=10_000, help="wallets that only do the daily task")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--flights', type=int, default=20, help="flights each miner attempts per day")
+    parser.add_argument('--task-rate', type=float, default=0.8, help="chance a task earner does the daily task")
+    parser.add_argument('--miner-task-rate', type=float, default=0.5, help="chance a miner does the daily task")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="processes (default: one per CPU)")
+    parser.add_argument('--verify', action='store_true',
+                        help="check the flight engine against the per-flight logic for every configuration first")
+    parser.add_argument('--json', metavar='FILE', help="also write every result to FILE")
+    args = parser.parse_args(argv)
+
+    values = {name: getattr(args, name) for name in SWEEPABLE}
+    configs = grid(values)
+    swept = [name for name in SWEEPABLE if len(values[name]) > 1] or ['base_mine_reward']
+
+    if args.verify:
+        for settings in configs:
+            rules = core.make_rules(**settings)
+            balances = np.linspace(0, 20 * rules['mine_cost'], 64)
+            scores = np.linspace(1.0, 1.0 + 2 * rules['chance_score_scale'], 64)
+            if not engines_agree(balances, scores, 50, args.seed, rules):
+                print(f"❌ Flight engine disagrees with the per-flight logic for {settings}. Nothing simulated.")
+                return 1
+        print(f"Flight engine matches the per-flight logic for all {len(configs)} configurations.")
+
+    flights = args.miners * args.flights * args.days
+    print(f"{len(configs)} configurations x {args.days} days: {args.miners} miners "
+          f"(up to {flights:,} flights per configuration), {args.earners} task earners, {args.workers} workers")
+    header = [f"{name:>{max(len(name), 8)}}" for name in swept]
+    header += [f"{'supply':>12}", f"{'%/day':>8}", f"{'success':>7}", f"{'broke':>6}"]
+    if args.miners:
+        header += [f"{'score':>6}"] + [f"{f'p{q}':>6}" for q in SCORE_PERCENTILES] + [f"{'capped':>6}"]
+    print("  ".join(header))
+
+    results = []
+    started = time.perf_counter()
+    for settings, summary, seconds in sweep(configs, args.workers, miners=args.miners, earners=args.earners,
+                                            days=args.days, flights=args.flights, task_rate=args.task_rate,
+                                            miner_task_rate=args.miner_task_rate, seed=args.seed):
+        print(format_row(settings, summary, swept))
+        results.append({"settings": settings, "summary": summary, "seconds": seconds})
+    elapsed = time.perf_counter() - started
+    simulated = sum(r['summary']['flights'] for r in results)
+    print(f"Simulated {simulated:,} flights and {sum(r['summary']['tasks'] for r in results):,} tasks "
+          f"in {elapsed:.1f}s ({simulated / elapsed / 1e6:.1f}M flights/s).")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"population": {k: v for k, v in vars(args).items() if k not in SWEEPABLE},
+                       "results": results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
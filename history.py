@@ -0,0 +1,98 @@
+import array
+import base64
+import os
+import sys
+
+# Bounded, compact flight score history.
+#
+# A wallet keeps its most recent RECENT_LIMIT scores verbatim (stored as a
+# packed float64 array, not a JSON list). Older scores are folded into
+# aggregate buckets of up to BUCKET_SIZE entries: [count, min, max, mean].
+# Once there are more than MAX_BUCKETS buckets the two oldest are merged, so
+# the distant past gets coarser while the stored size stays bounded.
+#
+# Stored form: {"total": n, "recent": "<base64 float64>", "buckets": [...]}
+# Wallets still holding the old plain JSON list are migrated the first time
+# their history is touched. Keep the settings identical across clients.
+
+RECENT_LIMIT = int(os.environ.get('COOIN_HISTORY_RECENT', '50'))
+BUCKET_SIZE = int(os.environ.get('COOIN_HISTORY_BUCKET', '100'))
+MAX_BUCKETS = int(os.environ.get('COOIN_HISTORY_BUCKETS', '64'))
+
+def _pack(values):
+    values = array.array('d', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+def _unpack(text):
+    values = array.array('d')
+    values.frombytes(base64.b64decode(text))
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def _merge(older, newer):
+    count = older[0] + newer[0]
+    mean = (older[3] * older[0] + newer[3] * newer[0]) / count
+    return [count, min(older[1], newer[1]), max(older[2], newer[2]), mean]
+
+def is_compact(stored):
+    """True if a stored history is already in the compact form."""
+    return isinstance(stored, dict)
+
+class FlightHistory:
+    """Recent flight scores plus downsampled aggregates of older ones."""
+
+    __slots__ = ('recent', 'buckets', 'total')
+
+    def __init__(self, recent=(), buckets=None, total=None):
+        self.recent = array.array('d', recent)
+        self.buckets = buckets if buckets is not None else []
+        if total is None:
+            total = len(self.recent) + sum(bucket[0] for bucket in self.buckets)
+        self.total = total
+
+    @classmethod
+    def load(cls, stored):
+        """Reads any stored form: None, a legacy list, or the compact dict."""
+        if stored is None:
+            return cls()
+        if isinstance(stored, list):
+            history = cls()
+            for score in stored:
+                history.append(score)
+            return history
+        return cls(_unpack(stored['recent']), [list(bucket) for bucket in stored['buckets']], stored['total'])
+
+    def append(self, score):
+        self.recent.append(score)
+        self.total += 1
+        if len(self.recent) > RECENT_LIMIT:
+            self._retire(self.recent.pop(0))
+
+    def _retire(self, score):
+        last = self.buckets[-1] if self.buckets else None
+        if last is None or last[0] >= BUCKET_SIZE:
+            self.buckets.append([1, score, score, score])
+        else:
+            count, low, high, mean = last
+            last[:] = [count + 1, min(low, score), max(high, score), mean + (score - mean) / (count + 1)]
+
+        if len(self.buckets) > MAX_BUCKETS:
+            self.buckets[0:2] = [_merge(self.buckets[0], self.buckets[1])]
+
+    def last(self, n):
+        """The n most recent scores, oldest first (at most RECENT_LIMIT)."""
+        return list(self.recent[-n:]) if n > 0 else []
+
+    def __len__(self):
+        """Total number of scores ever recorded, including aggregated ones."""
+        return self.total
+
+    def to_stored(self):
+        return {
+            "total": self.total,
+            "recent": _pack(self.recent),
+            "buckets": [list(bucket) for bucket in self.buckets],
+        }
@@ -0,0 +1,594 @@
+import json
+import os
+import re
+import struct
+import sys
+import zlib
+from array import array
+from json.encoder import encode_basestring_ascii as encode_string
+
+import wallettable
+
+# Record checksums for the JSON ledger snapshot.
+#
+# A snapshot used to be a single JSON document, so one damaged byte made
+# the whole ledger unreadable. Snapshots are now written one wallet per
+# line, sorted by address, and still parse as one JSON document:
+#
+#   {"journal_generation":7,"wallets":{
+#   "ADDRESS":{...},
+#   ...
+#   },"checksum":1234567890}
+#
+# checksum is the CRC-32 of everything before the last line, so every load
+# checks the snapshot in one pass without any other file. cooin_data.sums,
+# written next to it, holds where each wallet line starts and a tree of
+# checksums over them: a leaf is the CRC-32 of one line, and a node above it
+# is the CRC-32 of all the lines under it (its left child's CRC continued
+# over its right child's lines), up to the root. A damaged snapshot is
+# narrowed down from the root, checking one child per level, to the damaged
+# lines in O(log n) checks; every other wallet still loads. One wallet is
+# checked by a binary search for its line and that line's CRC.
+#
+# Journal lines carry their own CRC-32 (see journal.py), so checking what
+# changed since the last verification reads only the journal appended
+# since then (verify --incremental).
+#
+#   python integrity.py verify [--record ADDRESS ...] [--incremental]
+#   python integrity.py repair [--drop]
+
+SUMS_SUFFIX = '.sums'
+VERIFIED_SUFFIX = '.verified'
+SUMS_MAGIC = b'COOINCK1'
+# magic, journal generation, wallet lines, root of the checksum tree
+SUMS_HEADER = struct.Struct('<8sQQI')
+SUMS_TRAILER = struct.Struct('<I')
+
+ADDRESS_PREFIX = re.compile(rb'("(?:[^"\\]|\\.){1,128}"):')
+GENERATION_PREFIX = re.compile(rb'\{"journal_generation":(\d+),')
+
+# Damaged lines listed per snapshot by verify
+REPORT_LINES = 20
+
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+
+def sums_path(snapshot_path):
+    return os.path.splitext(snapshot_path)[0] + SUMS_SUFFIX
+
+class Checksums:
+    """Line offsets and checksum tree of one snapshot."""
+
+    def __init__(self, generation, offsets, levels):
+        self.generation = generation
+        self.offsets = offsets # where each wallet line starts, then where the last one ends
+        self.levels = levels # levels[0]: one CRC-32 per line; the last level is the root
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def root(self):
+        return self.levels[-1][0] if len(self) else 0
+
+    def span(self, level, node):
+        """Byte range of the lines under a node."""
+        width = 1 << level
+        return self.offsets[node * width], self.offsets[min((node + 1) * width, len(self))]
+
+def build_levels(view, offsets, leaves):
+    """The checksum tree over the lines of `view` that start at `offsets`, from their CRCs up."""
+    count = len(offsets) - 1
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        below, width = levels[-1], 1 << (len(levels) - 1)
+        level = array('I')
+        for node in range(0, len(below) - 1, 2):
+            start, end = offsets[(node + 1) * width], offsets[min((node + 2) * width, count)]
+            level.append(zlib.crc32(view[start:end], below[node]))
+        if len(below) % 2:
+            level.append(below[-1]) # a lone last node covers the same lines as its child
+        levels.append(level)
+    return levels
+
+# --- Snapshot Layout ---
+
+def encode_snapshot(data):
+    """Serializes a snapshot one wallet per line. Returns (bytes, Checksums)."""
+    wallets = data['wallets']
+    rest = {key: value for key, value in data.items() if key not in ('wallets', 'checksum')}
+    head = _encode(rest)[:-1] + ',' if rest else '{'
+    body = bytearray((head + '"wallets":{\n').encode())
+
+    if isinstance(wallets, wallettable.WalletTable):
+        row_dict, index = wallets.row_dict, wallets.index
+        def wallet_of(address):
+            return row_dict(index[address])
+    else:
+        wallet_of = wallets.__getitem__
+    offsets, leaves = array('Q'), array('I')
+    for address in sorted(wallets):
+        line = (encode_string(address) + ':' + _encode(wallet_of(address)) + ',\n').encode()
+        offsets.append(len(body))
+        leaves.append(zlib.crc32(line))
+        body += line
+    if leaves:
+        body[-2:] = b'\n' # no comma after the last wallet
+        leaves[-1] = zlib.crc32(body[offsets[-1]:])
+    offsets.append(len(body))
+
+    view = memoryview(body)
+    levels = build_levels(view, offsets, leaves)
+    view.release()
+    sums = Checksums(data.get('journal_generation', 0), offsets, levels)
+    body += b'},"checksum":%d}\n' % zlib.crc32(body)
+    return body, sums
+
+def checksum_intact(raw, checksum):
+    """Checks a parsed snapshot against its checksum."""
+    end = raw.rfind(b'\n', 0, len(raw) - 1) + 1
+    with memoryview(raw) as view:
+        return end > 0 and zlib.crc32(view[:end]) == checksum
+
+def damaged_lines(view, sums):
+    """Indexes of the lines that don't match their checksums, narrowed down from the root."""
+    if not len(sums):
+        return []
+
+    def intact(level, node):
+        start, end = sums.span(level, node)
+        return zlib.crc32(view[start:end]) == sums.levels[level][node] and end <= len(view)
+
+    top = len(sums.levels) - 1
+    if intact(top, 0):
+        return []
+    damaged = []
+    suspects = [(top, 0)] # nodes known to cover damage
+    while suspects:
+        level, node = suspects.pop()
+        if level == 0:
+            damaged.append(node)
+            continue
+        left, right = 2 * node, 2 * node + 1
+        if right >= len(sums.levels[level - 1]):
+            suspects.append((level - 1, left))
+        elif intact(level - 1, left):
+            # The damage is all in the right half
+            suspects.append((level - 1, right))
+        else:
+            suspects.append((level - 1, left))
+            if not intact(level - 1, right):
+                suspects.append((level - 1, right))
+    return sorted(damaged)
+
+def line_address(view, sums, i):
+    """The address a wallet line starts with, or None if it can't be read."""
+    start = sums.offsets[i]
+    match = ADDRESS_PREFIX.match(bytes(view[start:min(start + 300, sums.offsets[i + 1])]))
+    if match is None:
+        return None
+    try:
+        address = json.loads(match.group(1))
+    except ValueError:
+        return None
+    return address if isinstance(address, str) else None
+
+def neighbours(view, sums, i, damaged):
+    """Addresses of the nearest intact lines before and after line i (None at either end)."""
+    lower = upper = None
+    before, after = i - 1, i + 1
+    while before >= 0 and before in damaged:
+        before -= 1
+    while after < len(sums) and after in damaged:
+        after += 1
+    if before >= 0:
+        lower = line_address(view, sums, before)
+    if after < len(sums):
+        upper = line_address(view, sums, after)
+    return lower, upper
+
+def damaged_records(view, sums):
+    """(line, address) of every damaged line; the address is None if the damage makes it unreadable."""
+    bad = damaged_lines(view, sums)
+    skip = set(bad)
+    damaged = []
+    for i in bad:
+        address = line_address(view, sums, i)
+        # Lines are sorted by address, so a damaged address usually breaks the order
+        lower, upper = neighbours(view, sums, i, skip)
+        if address is not None and ((lower is not None and address <= lower) or
+                                    (upper is not None and address >= upper)):
+            address = None
+        damaged.append((i, address))
+    return damaged
+
+def salvage(raw, sums, loads=json.loads):
+    """Parses the intact wallet lines of a damaged snapshot. Returns (data, damaged_records())."""
+    with memoryview(raw) as view:
+        damaged = damaged_records(view, sums)
+        skip = {i for i, _ in damaged}
+        lines = [bytes(view[sums.offsets[i]:sums.offsets[i + 1]]).rstrip(b',\n')
+                 for i in range(len(sums)) if i not in skip]
+    text = b'{"journal_generation":%d,"wallets":{\n%s\n}}' % (sums.generation, b',\n'.join(lines))
+    return loads(text), damaged
+
+def find_line(view, sums, address):
+    """Index of the wallet's line by binary search, or None."""
+    lo, hi = 0, len(sums)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        found = line_address(view, sums, mid)
+        if found is None:
+            return None # damaged on the search path
+        if found == address:
+            return mid
+        if found < address:
+            lo = mid + 1
+        else:
+            hi = mid
+    return None
+
+def matches(raw, sums):
+    """Whether `sums` were written for this snapshot (as far as its first line tells)."""
+    match = GENERATION_PREFIX.match(raw)
+    return match is None or int(match.group(1)) == sums.generation
+
+# --- Checksum File ---
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+def write_sums(path, sums):
+    """Writes a checksum file and syncs it to disk."""
+    payload = bytearray(SUMS_HEADER.pack(SUMS_MAGIC, sums.generation, len(sums), sums.root))
+    payload += _little_endian(sums.offsets)
+    for level in sums.levels:
+        payload += _little_endian(level)
+    payload += SUMS_TRAILER.pack(zlib.crc32(payload))
+    with open(path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(payload)
+
+def read_sums(path):
+    """Reads a checksum file. Returns None if it is missing or damaged."""
+    try:
+        with open(path, 'rb') as f:
+            payload = f.read()
+    except FileNotFoundError:
+        return None
+    if len(payload) < SUMS_HEADER.size + SUMS_TRAILER.size:
+        return None
+    (stored,) = SUMS_TRAILER.unpack_from(payload, len(payload) - SUMS_TRAILER.size)
+    if zlib.crc32(memoryview(payload)[:-SUMS_TRAILER.size]) != stored:
+        return None
+    magic, generation, count, root = SUMS_HEADER.unpack_from(payload)
+    if magic != SUMS_MAGIC:
+        return None
+
+    position = SUMS_HEADER.size
+    offsets = _from_little_endian('Q', payload[position:position + 8 * (count + 1)])
+    position += 8 * (count + 1)
+    levels, size = [], count
+    while True:
+        levels.append(_from_little_endian('I', payload[position:position + 4 * size]))
+        position += 4 * size
+        if size <= 1:
+            break
+        size = (size + 1) // 2
+    if position != len(payload) - SUMS_TRAILER.size:
+        return None
+    sums = Checksums(generation, offsets, levels)
+    return sums if sums.root == root else None
+
+# --- Verification ---
+
+def _data_files(path, shards, addresses=None):
+    """{data file: addresses} of a ledger, sharded or not; `addresses` go to their own shard."""
+    if shards <= 1:
+        return {path: addresses}
+    import ledger
+    if addresses is None:
+        return {ledger.shard_path(path, index): None for index in range(shards)}
+    files = {}
+    for address in addresses:
+        files.setdefault(ledger.shard_path(path, ledger.shard_index(address, shards)), []).append(address)
+    return files
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def check_snapshot(path):
+    """Checks one snapshot file. Returns (problems, summary line)."""
+    raw = _read(path)
+    if raw is None:
+        return [], "no snapshot"
+    try:
+        data = json.loads(raw)
+        wallets = data['wallets']
+        checksum = data.get('checksum')
+    except (ValueError, KeyError, TypeError):
+        data, checksum = None, None
+
+    if data is not None and checksum is None:
+        return [], f"{len(wallets)} wallets, written before checksums (checked when next compacted)"
+    if data is not None and checksum_intact(raw, checksum):
+        return [], f"{len(wallets)} wallets, checksums match"
+
+    sums = read_sums(sums_path(path))
+    if sums is None or not matches(raw, sums):
+        return [f"{path} is damaged and has no usable checksum file to find the damage with"], "damaged"
+    with memoryview(raw) as view:
+        damaged = damaged_records(view, sums)
+    problems = [f"{path}: line {i + 2} ({address or 'address unreadable'}) is damaged"
+                for i, address in damaged[:REPORT_LINES]]
+    if len(damaged) > REPORT_LINES:
+        problems.append(f"{path}: and {len(damaged) - REPORT_LINES} more damaged lines")
+    if not problems:
+        problems = [f"{path}: the snapshot's first or last line is damaged; every wallet line is intact"]
+    return problems, f"{len(sums) - len(damaged)} of {len(sums)} wallets intact"
+
+def check_records(path, addresses):
+    """Checks single wallets against their line checksums, without reading the rest of the snapshot."""
+    import mmap
+    sums = read_sums(sums_path(path))
+    if sums is None:
+        return [f"{path} has no usable checksum file"]
+    problems = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if not matches(mapped[:64], sums):
+            return [f"{path} doesn't match its checksum file"]
+        view = memoryview(mapped)
+        try:
+            for address in addresses:
+                i = find_line(view, sums, address)
+                if i is None:
+                    problems.append(f"{address}: not found in {path}")
+                elif zlib.crc32(view[sums.offsets[i]:sums.offsets[i + 1]]) != sums.levels[0][i]:
+                    problems.append(f"{address}: line {i + 2} of {path} is damaged")
+                else:
+                    print(f"{address}: intact (line {i + 2})")
+        finally:
+            view.release()
+    return problems
+
+def check_journals(data_file, since=None):
+    """Checks the CRC of every complete journal line (from the offsets in `since`).
+
+    Returns (problems, {generation: offset checked up to}).
+    """
+    import journal
+    problems, reached = [], {}
+    for generation in journal.journal_generations(data_file):
+        offset = (since or {}).get(str(generation), 0)
+        path = journal.journal_path(data_file, generation)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1
+        position = offset
+        for line in chunk[:end].splitlines(keepends=True):
+            try:
+                journal.decode_commit(line)
+            except (ValueError, KeyError, TypeError):
+                problems.append(f"{path}: the commit at byte {position} is damaged and was skipped")
+            position += len(line)
+        reached[str(generation)] = offset + end
+    return problems, reached
+
+def _snapshot_id(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+def verify(data_file, incremental=False):
+    """Checks a ledger's snapshots and journals. Returns the problems found."""
+    import journal
+    stamp_path = os.path.splitext(data_file)[0] + VERIFIED_SUFFIX
+    stamp = {}
+    if incremental:
+        try:
+            with open(stamp_path) as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            stamp = {}
+
+    problems = []
+    with journal.locked(data_file):
+        snapshot_id = _snapshot_id(data_file)
+        if stamp.get('snapshot') == snapshot_id and snapshot_id is not None:
+            print(f"{data_file}: unchanged since the last verification")
+            since = stamp.get('journals')
+        else:
+            for path in (data_file, journal.previous_snapshot_path(data_file)):
+                found, summary = check_snapshot(path)
+                print(f"{path}: {summary}")
+                problems += found
+            since = None
+        found, reached = check_journals(data_file, since)
+        problems += found
+
+    checked = sum(reached.values()) - sum((since or {}).get(g, 0) for g in reached)
+    print(f"{data_file}: {checked} journal bytes checked, {len(found)} damaged commits")
+    if not problems:
+        with open(stamp_path, 'w') as f:
+            json.dump({"snapshot": snapshot_id, "journals": reached}, f)
+    return problems
+
+# --- Repair ---
+
+def _replay(data_file, data, generation, stop_generation):
+    """Applies the journals of generations [generation, stop_generation) to `data`.
+
+    Returns the addresses of the wallets the replay can't vouch for: those
+    of commits whose outcome hinged on a wallet `data` doesn't have.
+    """
+    import journal
+    wallets, untrusted = data['wallets'], set()
+    for current in range(generation, stop_generation):
+        commits, _ = journal.read_commits(data_file, current, 0)
+        for records in commits:
+            if records is None:
+                continue
+            if journal.is_rotation(records):
+                break
+            missing = {record['addr'] for record in records
+                       if record['op'] != 'register' and record['addr'] not in wallets}
+            if missing:
+                present = [record for record in records if record['addr'] not in missing]
+                if any(record['op'] == 'spend' or record.get('expect') is not None
+                       for record in records if record['addr'] in missing):
+                    # A missing wallet's check decided the commit. If the
+                    # others' checks fail it failed anyway; if not, nobody
+                    # can tell whether it landed.
+                    if journal.can_apply(data, present):
+                        untrusted.update(record['addr'] for record in records)
+                    continue
+                # Credits and the like to missing wallets can't fail, so the
+                # outcome rests on the wallets that are here
+                records = present
+            journal.apply_commit(data, records)
+    return untrusted
+
+def _previous_state(data_file, generation):
+    """The wallets the snapshot of `generation` should hold, replayed from the previous snapshot.
+
+    Returns (data, untrusted addresses, previous generation), or None. A
+    damaged previous snapshot still gives the wallets it has intact.
+    """
+    import journal
+    previous = journal.previous_snapshot_path(data_file)
+    try:
+        data = journal.read_snapshot_file(previous)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raw, sums = _read(previous), read_sums(sums_path(previous))
+        if sums is None or not matches(raw, sums):
+            print(f"{previous} can't be used: {e}")
+            return None
+        data, damaged = salvage(raw, sums)
+        print(f"{previous} is damaged too; using its {len(data['wallets'])} intact wallets.")
+    previous_generation = data.get('journal_generation', 0)
+    return data, _replay(data_file, data, previous_generation, generation), previous_generation
+
+def repair(data_file, drop=False):
+    """Rewrites a damaged snapshot, restoring its damaged wallets from the previous snapshot and journals.
+
+    With drop=True, damaged wallets that can't be restored are left out.
+    Returns the problems that remain. The caller holds the compaction lock
+    and the ledger lock, exclusively.
+    """
+    import journal
+    raw = _read(data_file)
+    if raw is None:
+        return [f"{data_file}: no snapshot"]
+    found, _ = check_snapshot(data_file)
+    if not found:
+        print(f"{data_file}: intact, nothing to repair")
+        if check_snapshot(journal.previous_snapshot_path(data_file))[0]:
+            print("The previous snapshot is damaged; the next compaction replaces it.")
+        return []
+
+    sums = read_sums(sums_path(data_file))
+    if sums is not None and not matches(raw, sums):
+        sums = None
+    match = GENERATION_PREFIX.match(raw)
+    generation = sums.generation if sums is not None else int(match.group(1)) if match else None
+    state = _previous_state(data_file, generation) if generation is not None else None
+    expected, untrusted, previous_generation = state if state is not None else ({"wallets": {}}, set(), generation)
+
+    if sums is not None:
+        data, damaged = salvage(raw, sums)
+        wallets = data['wallets']
+        with memoryview(raw) as view:
+            skip = {i for i, _ in damaged}
+            restored = 0
+            for i, address in damaged:
+                if address is None:
+                    # The only wallet that fits between the intact lines around it
+                    lower, upper = neighbours(view, sums, i, skip)
+                    fits = [candidate for candidate in expected['wallets'] if candidate not in wallets and
+                            (lower is None or candidate > lower) and (upper is None or candidate < upper)]
+                    address = fits[0] if len(fits) == 1 and skip.isdisjoint((i - 1, i + 1)) else None
+                if address is not None and address in expected['wallets'] and address not in untrusted:
+                    wallets[address] = expected['wallets'][address]
+                    restored += 1
+        lost = len(damaged) - restored
+        print(f"Restored {restored} of {len(damaged)} damaged wallets from the previous snapshot and journals.")
+        if lost and not drop:
+            return [f"{data_file}: {lost} damaged wallets have no intact copy to restore them from; "
+                    f"rerun with --drop to rewrite the snapshot without them"]
+        if lost:
+            print(f"Dropped {lost} damaged wallets.")
+    elif state is not None and not untrusted:
+        data = expected
+        print("Rebuilt the whole snapshot from the previous snapshot and journals.")
+    else:
+        return [f"{data_file}: can't be repaired without a checksum file and an intact previous snapshot"]
+
+    data['journal_generation'] = generation
+    tmp_file = journal.write_snapshot(data_file, data)
+    # The previous snapshot stays, and so do the journals it needs
+    journal.install_snapshot(data_file, tmp_file, generation, previous_generation, keep_previous=False)
+    print(f"{data_file}: rewritten with {len(data['wallets'])} wallets.")
+    return []
+
+# --- Main Execution ---
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Check and repair a Cooin JSON ledger.")
+    parser.add_argument('--data', default=os.environ.get('COOIN_DATA_FILE') or 'cooin_data.json')
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('COOIN_SHARDS', '1')))
+    commands = parser.add_subparsers(dest='command', required=True)
+    check = commands.add_parser('verify', help="check the snapshots and journals")
+    check.add_argument('--record', nargs='+', metavar='ADDRESS', help="only check these wallets' snapshot lines")
+    check.add_argument('--incremental', action='store_true',
+                       help="only check what was written since the last clean verification")
+    fix = commands.add_parser('repair', help="restore the damaged wallets of a snapshot")
+    fix.add_argument('--drop', action='store_true',
+                     help="leave out damaged wallets that can't be restored")
+    args = parser.parse_args(argv)
+
+    import journal
+    problems = []
+    records = args.record if args.command == 'verify' else None
+    for data_file, addresses in _data_files(args.data, args.shards, records).items():
+        try:
+            if addresses:
+                problems += check_records(data_file, addresses)
+            elif args.command == 'verify':
+                problems += verify(data_file, args.incremental)
+            else:
+                with journal.LedgerLock(data_file, journal.COMPACT_LOCK_SUFFIX).hold(exclusive=True), \
+                        journal.locked(data_file, exclusive=True):
+                    problems += repair(data_file, args.drop)
+        except OSError as e:
+            problems.append(f"{data_file}: {e}")
+
+    for problem in problems:
+        print(f"❌ {problem}")
+    if problems:
+        return 1
+    print("✅ No damage found." if args.command == 'verify' else "✅ Repaired.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
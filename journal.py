@@ -0,0 +1,541 @@
+import json
+import os
+import sys
+import zlib
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import integrity
+import metrics
+from history import FlightHistory, is_compact
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Append-only ledger journal.
+#
+# The snapshot (cooin_data.json) is only rewritten on checkpoints. Every
+# commit in between is appended to the journal as one small JSON line, so
+# the cost of a flight, task or registration no longer grows with the ledger.
+# Loading reads the snapshot and replays the journal on top of it.
+#
+# Each snapshot carries a generation number and its journal is named after
+# it (cooin_data.<generation>.journal), so records folded into a snapshot
+# are never replayed twice, even if a checkpoint is interrupted.
+#
+# Checkpoints: a checkpoint first ends the current journal with a rotate
+# marker, so new commits go to the next generation's journal, then writes
+# the snapshot of everything before the marker to a temporary file, syncs
+# it to disk and renames it over the old one. Only the two short steps at
+# either end hold the exclusive lock; other processes keep committing while
+# the snapshot is written. The replaced snapshot is kept as
+# cooin_data.prev.json along with the journals after it, so a damaged
+# snapshot is recovered from the previous one instead of being read as an
+# empty ledger. Loading replays only the journals written since the
+# snapshot it starts from, so recovery time depends on the commits since the
+# last checkpoint, not on the age of the ledger.
+#
+# Integrity: every journal line ends with a CRC-32 of the rest of it, and
+# snapshots are written one wallet per line with a checksum per line (see
+# integrity.py). A damaged journal line is skipped with a warning; a
+# snapshot whose previous one can't be read either is loaded without its
+# damaged wallets.
+#
+# Concurrency: appends take a shared lock and a single O_APPEND write, so
+# writers never block each other; checkpoints take the exclusive lock for
+# their two short steps. Every applied record bumps the wallet's "version",
+# and a record carrying "expect" only applies if the wallet is still at that
+# version. Replay order is the journal order, so every process agrees on
+# which commits won.
+
+JOURNAL_SUFFIX = '.journal'
+LOCK_SUFFIX = '.lock'
+COMPACT_LOCK_SUFFIX = '.compact.lock'
+PREVIOUS_SUFFIX = '.prev'
+# Fold the journal into the snapshot once it holds this many commits
+COMPACT_THRESHOLD = 5000
+
+# --- Records ---
+
+def debit(address, amount):
+    return {"op": "debit", "addr": address, "amount": amount}
+
+def credit(address, amount):
+    return {"op": "credit", "addr": address, "amount": amount}
+
+def spend(address, amount):
+    """Payment out of a wallet: a debit that only applies if the balance covers it."""
+    return {"op": "spend", "addr": address, "amount": amount}
+
+def score(address, increase):
+    """Flight score bump; the new score is also appended to the history."""
+    return {"op": "score", "addr": address, "increase": increase}
+
+def flights(address, cost, increase, rewards):
+    """A run of paid flights: one reward (or None for a failure) per flight."""
+    return {"op": "flights", "addr": address, "cost": cost, "increase": increase, "rewards": rewards}
+
+def task(address, amount, day):
+    """Daily task reward. Pays at most once per wallet per day (a date ordinal)."""
+    return {"op": "task", "addr": address, "amount": amount, "day": day}
+
+def init_history(address):
+    """Backfills flight_score_history for wallets created before it existed,
+    or migrates a legacy JSON-list history to the compact form."""
+    return {"op": "init_history", "addr": address}
+
+def register(address, wallet):
+    """Creates a wallet. Fails (like a version conflict) if the address is taken."""
+    return {"op": "register", "addr": address, "wallet": wallet, "expect": None}
+
+# Numeric fields each kind of record needs, besides op and addr (and the
+# ones checked on their own: register's wallet, flights' rewards, task's day)
+RECORD_FIELDS = {
+    'register': (),
+    'debit': ('amount',),
+    'credit': ('amount',),
+    'spend': ('amount',),
+    'score': ('increase',),
+    'flights': ('cost', 'increase'),
+    'task': ('amount',),
+    'init_history': (),
+}
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def check_commit(records):
+    """Raises ValueError unless `records` is a list of well-formed mutation records.
+
+    Backends check every commit before writing it, and replay checks every
+    journal line, so apply_record() never sees a record it can't apply.
+    """
+    if not isinstance(records, list):
+        raise ValueError("a commit must be a list of records")
+    for record in records:
+        op = record.get('op') if isinstance(record, dict) else None
+        fields = RECORD_FIELDS.get(op) if isinstance(op, str) else None
+        if fields is None:
+            raise ValueError(f"unknown record {record!r:.80}")
+        if not isinstance(record.get('addr'), str):
+            raise ValueError(f"{record['op']} record without an address")
+        if not all(_is_number(record.get(field)) for field in fields):
+            raise ValueError(f"{record['op']} record for {record['addr']} needs numeric {', '.join(fields)}")
+        if op == 'register':
+            wallet = record.get('wallet')
+            if not (isinstance(wallet, dict) and _is_number(wallet.get('balance'))
+                    and _is_number(wallet.get('flight_score'))):
+                raise ValueError(f"register record for {record['addr']} needs a wallet with a balance and flight_score")
+        elif op == 'flights':
+            rewards = record.get('rewards')
+            if not isinstance(rewards, list) or not all(reward is None or _is_number(reward) for reward in rewards):
+                raise ValueError(f"flights record for {record['addr']} needs a list of rewards")
+        elif op == 'task':
+            if not isinstance(record.get('day'), int) or isinstance(record['day'], bool):
+                raise ValueError(f"task record for {record['addr']} needs a day")
+        expect = record.get('expect')
+        if expect is not None and (not isinstance(expect, int) or isinstance(expect, bool)):
+            raise ValueError(f"{op} record for {record['addr']} expects a non-integer version")
+
+def can_apply(data, records):
+    """Checks a commit against the ledger: version expectations, and that
+    the balances before the commit cover all of its spend records."""
+    wallets = data['wallets']
+    spent = {}
+    for record in records:
+        if record['op'] == 'spend':
+            wallet = wallets.get(record['addr'])
+            total = spent[record['addr']] = spent.get(record['addr'], 0.0) + record['amount']
+            if wallet is None or wallet['balance'] < total:
+                return False
+        if 'expect' not in record:
+            continue
+        wallet = wallets.get(record['addr'])
+        if record['expect'] is None:
+            if wallet is not None:
+                return False
+        elif wallet is None or wallet.get('version', 0) != record['expect']:
+            return False
+    return True
+
+def apply_record(data, record):
+    """Applies a single journal record to an in-memory ledger."""
+    wallets = data['wallets']
+    op = record['op']
+    address = record['addr']
+
+    if op == 'register':
+        wallets[address] = dict(record['wallet'], version=0)
+        return
+
+    wallet = wallets.get(address)
+    if wallet is None:
+        # Wallet vanished from the snapshot; nothing to apply the record to
+        return
+
+    if op == 'debit' or op == 'spend':
+        wallet['balance'] -= record['amount']
+    elif op == 'credit':
+        wallet['balance'] += record['amount']
+    elif op == 'score':
+        history = _load_history(wallet)
+        wallet['flight_score'] += record['increase']
+        history.append(wallet['flight_score'])
+        wallet['flight_score_history'] = history.to_stored()
+    elif op == 'flights':
+        # Same float operations, in the same order, as one debit/credit/score
+        # sequence per flight
+        history = _load_history(wallet)
+        for reward in record['rewards']:
+            wallet['balance'] -= record['cost']
+            if reward is not None:
+                wallet['balance'] += reward
+                wallet['flight_score'] += record['increase']
+                history.append(wallet['flight_score'])
+        wallet['flight_score_history'] = history.to_stored()
+    elif op == 'task':
+        if wallet.get('task_day') == record['day']:
+            # Already paid for this day: a rerun or a duplicate click
+            return
+        wallet['balance'] += record['amount']
+        wallet['task_day'] = record['day']
+    elif op == 'init_history':
+        if not is_compact(wallet.get('flight_score_history')):
+            wallet['flight_score_history'] = _load_history(wallet).to_stored()
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+    wallet['version'] = wallet.get('version', 0) + 1
+
+def _load_history(wallet):
+    """The wallet's history, seeded with its current score if it has none yet.
+
+    Legacy list histories are migrated here, on first touch.
+    """
+    stored = wallet.get('flight_score_history')
+    if stored is None:
+        return FlightHistory([wallet.get('flight_score', 1.0)])
+    return FlightHistory.load(stored)
+
+def apply_commit(data, records):
+    """Applies one commit all-or-nothing. Returns False if a version check failed."""
+    if not can_apply(data, records):
+        return False
+    for record in records:
+        apply_record(data, record)
+    return True
+
+# --- Journal File ---
+
+def journal_path(data_file, generation):
+    return f"{os.path.splitext(data_file)[0]}.{generation}{JOURNAL_SUFFIX}"
+
+def lock_path(data_file, suffix=LOCK_SUFFIX):
+    return os.path.splitext(data_file)[0] + suffix
+
+def previous_snapshot_path(data_file):
+    base, ext = os.path.splitext(data_file)
+    return base + PREVIOUS_SUFFIX + ext
+
+def journal_generations(data_file):
+    """Generations of the journal files on disk."""
+    directory, name = os.path.split(os.path.splitext(data_file)[0])
+    generations = []
+    for entry in os.listdir(directory or '.'):
+        if entry.startswith(name + '.') and entry.endswith(JOURNAL_SUFFIX):
+            number = entry[len(name) + 1:-len(JOURNAL_SUFFIX)]
+            if number.isdigit():
+                generations.append(int(number))
+    return sorted(generations)
+
+def encode_commit(records):
+    """Encodes one commit as a single journal line, ending in a CRC-32 of the rest of it."""
+    payload = records[0] if len(records) == 1 else {"op": "batch", "records": records}
+    with metrics.timed('cooin_ledger_seconds', op='serialize'):
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        return b'%s,"crc":%d}\n' % (body[:-1], zlib.crc32(body))
+
+def decode_commit(line):
+    """Decodes a journal line. Raises ValueError if it doesn't match its CRC or isn't a valid commit."""
+    line = line.rstrip(b"\n")
+    cut = line.rfind(b',"crc":')
+    if cut > 0 and line.endswith(b'}') and line[cut + 7:-1].isdigit():
+        body = line[:cut] + b'}'
+        if zlib.crc32(body) != int(line[cut + 7:-1]):
+            raise ValueError("journal line doesn't match its checksum")
+        line = body
+    # Lines without a CRC were written before checksums
+    payload = json.loads(line)
+    if payload == {"op": "rotate"}:
+        return [payload]
+    records = payload['records'] if payload['op'] == 'batch' else [payload]
+    check_commit(records)
+    return records
+
+# Last line of a journal that a checkpoint has ended; replay continues in the next generation's journal
+ROTATE_LINE = b'{"op":"rotate"}\n'
+
+def is_rotation(records):
+    return len(records) == 1 and records[0].get('op') == 'rotate'
+
+def rotate(data_file, generation):
+    """Ends journal `generation`; later commits go to generation + 1. The caller must hold the exclusive lock."""
+    append_commit(data_file, generation, ROTATE_LINE)
+    return generation + 1
+
+def append_commit(data_file, generation, line):
+    """Appends an encoded commit in one write. Returns the offset where it starts."""
+    with metrics.timed('cooin_ledger_seconds', op='write'):
+        fd = os.open(journal_path(data_file, generation), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            end = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+    metrics.inc('cooin_ledger_bytes_written_total', len(line), file='journal')
+    return end - len(line)
+
+def read_commits(data_file, generation, offset, stop=None):
+    """Reads complete commits from `offset` (up to `stop`).
+
+    Returns (commits, new_offset). A damaged line (a torn write from a
+    crashed process, or a bad CRC) is returned as None so callers skip it.
+    """
+    try:
+        with open(journal_path(data_file, generation), 'rb') as f:
+            f.seek(offset)
+            chunk = f.read() if stop is None else f.read(stop - offset)
+    except FileNotFoundError:
+        return [], offset
+    if not chunk:
+        return [], offset
+
+    metrics.inc('cooin_ledger_bytes_read_total', len(chunk), file='journal')
+    end = chunk.rfind(b"\n") + 1
+    commits = []
+    with metrics.timed('cooin_ledger_seconds', op='parse'):
+        position = offset
+        for line in chunk[:end].splitlines(keepends=True):
+            try:
+                commits.append(decode_commit(line))
+            except (ValueError, KeyError, TypeError):
+                commits.append(None)
+                print(f"Warning: skipped the damaged commit at byte {position} of "
+                      f"{journal_path(data_file, generation)}.", file=sys.stderr)
+            position += len(line)
+    return commits, offset + end
+
+# --- Snapshots ---
+
+class CorruptSnapshot(ValueError):
+    pass
+
+def _read_snapshot_bytes(path):
+    with metrics.timed('cooin_ledger_seconds', op='load'):
+        with open(path, 'rb') as f:
+            raw = f.read()
+    metrics.inc('cooin_ledger_bytes_read_total', len(raw), file='snapshot')
+    return raw
+
+def _check_snapshot(data):
+    if not isinstance(data, dict) or not isinstance(data.get('wallets'), Mapping):
+        raise CorruptSnapshot("no wallets in the snapshot")
+    return data
+
+def read_snapshot_file(path, loads=json.loads, raw=None):
+    """Parses one snapshot file, checking its wallets against their checksum. Raises ValueError if damaged."""
+    if raw is None:
+        raw = _read_snapshot_bytes(path)
+    with metrics.timed('cooin_ledger_seconds', op='parse'):
+        data = _check_snapshot(loads(raw))
+        # Snapshots written before checksums have none
+        checksum = data.pop('checksum', None)
+        if checksum is not None and not integrity.checksum_intact(raw, checksum):
+            raise CorruptSnapshot("snapshot doesn't match its checksum")
+    return data
+
+def _salvage_snapshot(path, raw, loads):
+    """The intact wallets of a damaged snapshot, as (data, damaged), or None without a usable checksum file."""
+    sums = integrity.read_sums(integrity.sums_path(path))
+    if sums is None or not integrity.matches(raw, sums):
+        return None
+    with metrics.timed('cooin_ledger_seconds', op='parse'):
+        try:
+            data, damaged = integrity.salvage(raw, sums, loads)
+            return _check_snapshot(data), damaged
+        except ValueError:
+            return None
+
+def read_snapshot(data_file, loads=json.loads):
+    """Loads the newest valid snapshot (parsed with `loads`).
+
+    Returns (data, previous, damaged), where `previous` is True if the
+    current snapshot was damaged and the previous one was loaded instead,
+    or (None, False, []) for a ledger that has no snapshot yet. If neither
+    snapshot can be read whole, the intact wallets of the newest one with a
+    checksum file are loaded and `damaged` lists (line, address or None)
+    for the wallets left out. Raises CorruptSnapshot if nothing can be read.
+    """
+    problems = []
+    damaged_files = []
+    for path in (data_file, previous_snapshot_path(data_file)):
+        try:
+            raw = _read_snapshot_bytes(path)
+            data = read_snapshot_file(path, loads, raw)
+        except FileNotFoundError:
+            continue
+        except ValueError as e:
+            problems.append(f"{path}: {e}")
+            damaged_files.append((path, raw))
+            continue
+        if problems:
+            print(f"Warning: {'; '.join(problems)}. Recovered the ledger from {path}.", file=sys.stderr)
+        return data, bool(problems), []
+
+    for path, raw in damaged_files:
+        salvaged = _salvage_snapshot(path, raw, loads)
+        if salvaged is None:
+            continue
+        data, damaged = salvaged
+        print(f"Warning: {'; '.join(problems)}. Loaded the {len(data['wallets'])} intact wallets of {path} "
+              f"({len(damaged)} damaged); run 'python integrity.py repair'.", file=sys.stderr)
+        return data, path != data_file, damaged
+    if problems:
+        raise CorruptSnapshot(f"No readable snapshot ({'; '.join(problems)})")
+    return None, False, []
+
+def _sync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError: # Windows can't open directories; its renames are durable already
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_snapshot(data_file, data):
+    """Writes `data` to a temporary snapshot file, and its checksum file, synced to disk. Returns its path.
+
+    Needs no ledger lock, but only one process may write at a time (hold
+    the compaction lock).
+    """
+    with metrics.timed('cooin_ledger_seconds', op='serialize'):
+        body, sums = integrity.encode_snapshot(data)
+    tmp_file = data_file + '.tmp'
+    with metrics.timed('cooin_ledger_seconds', op='write'):
+        with open(tmp_file, 'wb') as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        written = integrity.write_sums(integrity.sums_path(data_file) + '.tmp', sums)
+    metrics.inc('cooin_ledger_bytes_written_total', len(body), file='snapshot')
+    metrics.inc('cooin_ledger_bytes_written_total', written, file='checksums')
+    return tmp_file
+
+def _link_or_copy(src, dst):
+    """Points `dst` at the current `src` (a hard link where possible), replacing it atomically."""
+    try:
+        os.link(src, dst + '.tmp')
+    except FileExistsError:
+        os.remove(dst + '.tmp')
+        os.link(src, dst + '.tmp')
+    except OSError: # no hard links on this file system
+        import shutil
+        shutil.copyfile(src, dst + '.tmp')
+    os.replace(dst + '.tmp', dst)
+
+def install_snapshot(data_file, tmp_file, generation, loaded_generation, keep_previous=True):
+    """Replaces the snapshot with `tmp_file` (of `generation`), keeping the old one as the previous snapshot.
+
+    Journals the previous snapshot doesn't need are deleted: those older
+    than `loaded_generation`, the generation of the snapshot being replaced
+    (or of the previous one, if that is what the caller recovered from).
+    Pass keep_previous=False when the current snapshot is the damaged one.
+    The caller must hold the exclusive lock.
+    """
+    sums, tmp_sums = integrity.sums_path(data_file), integrity.sums_path(data_file) + '.tmp'
+    with metrics.timed('cooin_ledger_seconds', op='write'):
+        previous = previous_snapshot_path(data_file)
+        previous_sums = integrity.sums_path(previous)
+        if keep_previous and os.path.exists(data_file):
+            _link_or_copy(data_file, previous)
+            if os.path.exists(sums):
+                _link_or_copy(sums, previous_sums)
+            elif os.path.exists(previous_sums):
+                os.remove(previous_sums) # belonged to the snapshot that was previous until now
+        os.replace(tmp_file, data_file)
+        if os.path.exists(tmp_sums):
+            os.replace(tmp_sums, sums)
+        _sync_directory(data_file)
+
+    oldest_needed = loaded_generation if os.path.exists(previous) else generation
+    for old_generation in journal_generations(data_file):
+        if old_generation < oldest_needed:
+            os.remove(journal_path(data_file, old_generation))
+
+# --- Locking ---
+
+class LedgerLock:
+    """Cross-process ledger lock (flock; msvcrt on Windows) on a persistent handle.
+
+    Not re-entrant: don't nest hold() calls on the same lock.
+    """
+
+    def __init__(self, data_file, suffix=LOCK_SUFFIX):
+        self.path = lock_path(data_file, suffix)
+        self._file = None
+
+    @contextmanager
+    def hold(self, exclusive=False, blocking=True):
+        """Holds the lock. Yields False if a non-blocking request failed."""
+        if self._file is None:
+            self._file = open(self.path, 'a+')
+        fd = self._file.fileno()
+
+        if fcntl:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            try:
+                fcntl.flock(fd, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            # msvcrt only has exclusive locks; appends serialize on Windows
+            self._file.seek(0)
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            except OSError:
+                if blocking:
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                self._file.seek(0)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+@contextmanager
+def locked(data_file, exclusive=False, blocking=True):
+    """One-off hold of the ledger lock. Yields False if a non-blocking request failed."""
+    lock = LedgerLock(data_file)
+    try:
+        with lock.hold(exclusive, blocking) as acquired:
+            yield acquired
+    finally:
+        lock.close()
@@ -0,0 +1,207 @@
+import gc
+import heapq
+import random
+from contextlib import contextmanager
+
+# Leaderboard index.
+#
+# Ranks wallets by balance and by flight score: highest first, ties broken
+# by address. Each ranking is an indexable skiplist of (-value, address)
+# keys, where every link also records how many wallets it skips, so
+# inserting, removing and finding a wallet's rank all take O(log n) and the
+# top N is the first N nodes. The JSON backend builds a Leaderboard on the
+# first query and then updates it for every commit it replays, so flights,
+# task rewards and registrations (its own and other processes') move
+# wallets as they happen. SQLite answers the same queries from column
+# indexes; other backends fall back to a scan (top_of, count_ahead_of).
+
+FIELDS = ('balance', 'flight_score')
+
+MAX_LEVEL = 32
+LEVEL_CHANCE = 0.25 # chance that a node also appears one level up
+
+@contextmanager
+def _gc_paused():
+    # Building millions of nodes would otherwise trigger a full collection
+    # every few thousand allocations, which makes the build several times slower
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# A node is one list: [key, next on level 0, width on level 0, next on
+# level 1, width on level 1, ...]. A width is how many positions the link
+# skips (to one past the end if next is None). One flat list per node keeps
+# a million-wallet index to one allocation per node.
+
+def _node(key, level):
+    return [key] + [None, 1] * level
+
+def _level_of(node):
+    return (len(node) - 1) // 2
+
+class IndexableSkiplist:
+    """Sorted, distinct keys with O(log n) insert, remove and rank lookups."""
+
+    def __init__(self, sorted_keys=()):
+        self._head = _node(None, MAX_LEVEL)
+        self._levels = 1
+        self._size = 0
+        self._random = random.Random()
+
+        # Linking presorted keys level by level is O(n), instead of n inserts
+        head = self._head
+        last = [head] * MAX_LEVEL
+        last_position = [0] * MAX_LEVEL
+        position = 0
+        with _gc_paused():
+            for position, key in enumerate(sorted_keys, 1):
+                level = self._random_level()
+                node = [key, None, 1] if level == 1 else _node(key, level)
+                for i in range(level):
+                    before = last[i]
+                    before[1 + 2 * i] = node
+                    before[2 + 2 * i] = position - last_position[i]
+                    last[i] = node
+                    last_position[i] = position
+                if level > self._levels:
+                    self._levels = level
+        self._size = position
+        for i in range(MAX_LEVEL):
+            last[i][2 + 2 * i] = self._size + 1 - last_position[i]
+
+    def __len__(self):
+        return self._size
+
+    def _random_level(self):
+        level = 1
+        while level < MAX_LEVEL and self._random.random() < LEVEL_CHANCE:
+            level += 1
+        return level
+
+    def _path(self, key):
+        """Last node before `key` on every level, with its position."""
+        nodes = [self._head] * MAX_LEVEL
+        positions = [0] * MAX_LEVEL
+        node, position = self._head, 0
+        for i in reversed(range(self._levels)):
+            while node[1 + 2 * i] is not None and node[1 + 2 * i][0] < key:
+                position += node[2 + 2 * i]
+                node = node[1 + 2 * i]
+            nodes[i] = node
+            positions[i] = position
+        return nodes, positions
+
+    def rank(self, key):
+        """Number of keys smaller than `key` (its index, if present)."""
+        node, position = self._head, 0
+        for i in reversed(range(self._levels)):
+            while node[1 + 2 * i] is not None and node[1 + 2 * i][0] < key:
+                position += node[2 + 2 * i]
+                node = node[1 + 2 * i]
+        return position
+
+    def insert(self, key):
+        nodes, positions = self._path(key)
+        level = self._random_level()
+        if level > self._levels:
+            for i in range(self._levels, level):
+                self._head[2 + 2 * i] = self._size + 1
+            self._levels = level
+
+        node = _node(key, level)
+        position = positions[0] + 1
+        for i in range(level):
+            before = nodes[i]
+            node[1 + 2 * i] = before[1 + 2 * i]
+            before[1 + 2 * i] = node
+            node[2 + 2 * i] = before[2 + 2 * i] - (position - positions[i]) + 1
+            before[2 + 2 * i] = position - positions[i]
+        for i in range(level, self._levels):
+            nodes[i][2 + 2 * i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        nodes, _ = self._path(key)
+        node = nodes[0][1]
+        if node is None or node[0] != key:
+            raise KeyError(key)
+        level = _level_of(node)
+        for i in range(self._levels):
+            before = nodes[i]
+            if i < level:
+                before[2 + 2 * i] += node[2 + 2 * i] - 1
+                before[1 + 2 * i] = node[1 + 2 * i]
+            else:
+                before[2 + 2 * i] -= 1
+        self._size -= 1
+
+    def first(self, n):
+        """The `n` smallest keys, in order."""
+        keys = []
+        node = self._head[1]
+        while node is not None and len(keys) < n:
+            keys.append(node[0])
+            node = node[1]
+        return keys
+
+class Leaderboard:
+    """Rankings of a set of wallets by each of FIELDS, updated one wallet at a time."""
+
+    def __init__(self, wallets):
+        self._values = {}
+        self._rankings = {}
+        with _gc_paused():
+            for field in FIELDS:
+                if hasattr(wallets, 'column'): # a WalletTable
+                    values = dict(wallets.column(field))
+                else:
+                    values = {address: wallet[field] for address, wallet in wallets.items()}
+                self._values[field] = values
+                self._rankings[field] = IndexableSkiplist(sorted((-value, address) for address, value in values.items()))
+
+    def __len__(self):
+        return len(self._values[FIELDS[0]])
+
+    def update(self, address, wallet):
+        """Re-ranks one wallet after a change (`wallet` None if it is gone)."""
+        for field in FIELDS:
+            values = self._values[field]
+            old = values.get(address)
+            new = wallet[field] if wallet is not None else None
+            if old == new:
+                continue
+            ranking = self._rankings[field]
+            if old is not None:
+                ranking.remove((-old, address))
+                del values[address]
+            if new is not None:
+                ranking.insert((-new, address))
+                values[address] = new
+
+    def top(self, field, n):
+        """The `n` highest-ranked wallets as (address, value) pairs."""
+        return [(address, -negated) for negated, address in self._rankings[field].first(n)]
+
+    def count_ahead(self, field, value, address):
+        """How many wallets rank above a wallet with this value and address."""
+        return self._rankings[field].rank((-value, address))
+
+# --- Scans (for backends without an index) ---
+
+def top_of(wallets, field, n):
+    """top() computed from {address: wallet} in one pass."""
+    return [(address, -negated)
+            for negated, address in heapq.nsmallest(n, ((-wallet[field], address) for address, wallet in wallets.items()))]
+
+def count_ahead_of(wallets, field, value, address):
+    """count_ahead() computed from {address: wallet} in one pass."""
+    key = (-value, address)
+    return sum(1 for other, wallet in wallets.items() if (-wallet[field], other) < key)
+
+def check_field(field):
+    if field not in FIELDS:
+        raise ValueError(f"Unknown leaderboard field: {field} (expected one of {', '.join(FIELDS)})")
@@ -0,0 +1,1293 @@
+import heapq
+import importlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+import zlib
+from contextlib import contextmanager
+
+import journal
+import leaderboard
+import metrics
+import wallettable
+
+# Shared ledger storage for the miner, task client and wallet.
+#
+# All clients go through the module-level functions below, which delegate to
+# the configured backend:
+#   COOIN_BACKEND    'json' (snapshot + journal, the default), 'sqlite' or
+#                    'binary' (memory-mapped fixed-width records, binledger.py)
+#   COOIN_DATA_FILE  ledger path (defaults to cooin_data.json / .db / .bin)
+#   COOIN_SHARDS     number of address-prefix shards (default 1, unsharded)
+#   COOIN_CACHE      '0' turns off the in-process read cache (see LedgerCache)
+#   COOIN_DAEMON     '0' never uses a running ledger daemon (see ledgerd.py)
+
+DEFAULT_DATA_FILES = {
+    'json': 'cooin_data.json',
+    'sqlite': 'cooin_data.db',
+    'binary': 'cooin_data.bin',
+}
+
+# Shards are picked from this many leading address characters
+SHARD_PREFIX_LEN = 2
+
+# Optimistic update retries (see update_wallet)
+MAX_RETRIES = 20
+RETRY_BACKOFF = 0.002 # seconds, doubled on every retry
+RETRY_BACKOFF_MAX = 0.25 # ...up to this
+
+# How long a CommitBatcher holds transactions before writing them (ms)
+COMMIT_WINDOW = float(os.environ.get('COOIN_COMMIT_WINDOW', '50')) / 1000
+
+class LedgerError(Exception):
+    """Raised when the ledger cannot be read or written."""
+
+class CrossShardCommit(LedgerError):
+    """A commit touched wallets on more than one shard, which can't be done atomically."""
+    pass
+
+class VersionConflict(LedgerError):
+    """Raised when a commit's version expectations no longer hold."""
+
+def malformed(records):
+    """A LedgerError describing what's wrong with a commit's records, or None if they are well-formed."""
+    try:
+        journal.check_commit(records)
+    except ValueError as e:
+        return LedgerError(f"Malformed commit: {e}")
+    return None
+
+# --- Backend Interface ---
+
+class LedgerBackend:
+    """Storage backend interface. Mutations are expressed as journal records."""
+
+    def load_all(self):
+        """Returns the whole ledger as {"wallets": {address: wallet}}."""
+        raise NotImplementedError
+
+    def save_all(self, data):
+        """Replaces the whole ledger with the given data."""
+        raise NotImplementedError
+
+    def get_wallet(self, address):
+        """Returns a single wallet dict, or None if the address is unknown."""
+        return self.load_all()['wallets'].get(address)
+
+    def get_wallets(self, addresses):
+        """Returns {address: wallet} for the known addresses among `addresses`."""
+        wallets = {}
+        for address in addresses:
+            wallet = self.get_wallet(address)
+            if wallet is not None:
+                wallets[address] = wallet
+        return wallets
+
+    def wallet_exists(self, address):
+        return self.get_wallet(address) is not None
+
+    def wallet_count(self):
+        return len(self.load_all()['wallets'])
+
+    def commit(self, records):
+        """Atomically applies a list of mutation records."""
+        raise NotImplementedError
+
+    def commit_group(self, groups):
+        """Commits several unrelated transactions (lists of records) together.
+
+        Each group stays atomic on its own. Returns one outcome per group:
+        None if it was committed, otherwise the LedgerError it failed with.
+        Backends override this to share one write (and one sync) per call.
+        """
+        outcomes = []
+        for records in groups:
+            try:
+                self.commit(records)
+                outcomes.append(None)
+            except LedgerError as e:
+                outcomes.append(e)
+        return outcomes
+
+    def change_token(self):
+        """A cheap value that changes whenever the ledger is written, by any process.
+
+        None means the backend can't tell, and reads through LedgerCache
+        always go to the backend.
+        """
+        return None
+
+    def subscribe(self, addresses):
+        """A Subscription to changes of these wallets, made by any process."""
+        return Subscription(self, addresses)
+
+    def top_wallets(self, field, n):
+        """The `n` wallets ranked highest by `field`, as (address, value) pairs.
+
+        Ties are broken by address. Backends with an index override this and
+        count_ahead(); the fallback scans every wallet.
+        """
+        leaderboard.check_field(field)
+        return leaderboard.top_of(self.load_all()['wallets'], field, n)
+
+    def count_ahead(self, field, value, address):
+        """How many wallets rank above a wallet with this `field` value and address."""
+        leaderboard.check_field(field)
+        return leaderboard.count_ahead_of(self.load_all()['wallets'], field, value, address)
+
+    def commit_independent(self, records):
+        """Commits records that don't depend on each other (e.g. one per wallet).
+
+        Uses as few transactions as possible. Returns the records that hit a
+        version conflict; every other record is committed.
+        """
+        try:
+            self.commit(records)
+            return []
+        except VersionConflict:
+            conflicts = []
+            for record in records:
+                try:
+                    self.commit([record])
+                except VersionConflict:
+                    conflicts.append(record)
+            return conflicts
+
+    def close(self):
+        pass
+
+# --- JSON Backend (snapshot + journal) ---
+
+def _copy_wallet(wallet):
+    # Compact histories are replaced, never mutated in place, so only
+    # legacy list histories need copying. copy() also turns a WalletRow
+    # into a plain dict.
+    wallet = wallet.copy()
+    if isinstance(wallet.get('flight_score_history'), list):
+        wallet['flight_score_history'] = list(wallet['flight_score_history'])
+    return wallet
+
+class JSONBackend(LedgerBackend):
+    """Snapshot + journal (see journal.py).
+
+    The replayed ledger is kept in memory; each call only reads the journal
+    commits other processes appended since the previous call, and reloads the
+    snapshot only after another process checkpointed. The leaderboard index
+    is built on the first ranking query and then updated with every commit
+    replayed into memory.
+
+    If a damaged snapshot had to be loaded without its damaged wallets (see
+    journal.read_snapshot), those wallets can't be read or committed to and
+    the ledger isn't compacted until 'python integrity.py repair' has run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = journal.LedgerLock(path)
+        self._compact_lock = journal.LedgerLock(path, journal.COMPACT_LOCK_SUFFIX)
+        self._data = None
+        self._snapshot_id = None
+        self._loaded_generation = 0 # generation of the snapshot replay started from
+        self._from_previous = False # True if that was the previous snapshot (the current one is damaged)
+        self._generation = 0 # journal being read and appended to
+        self._offset = 0
+        self._commits = 0
+        self._compact_at = journal.COMPACT_THRESHOLD # commits before the next compaction attempt
+        self._board = None # leaderboard.Leaderboard of self._data, once queried
+        self._damaged = set() # addresses of the wallets a damaged snapshot was loaded without
+        self._damaged_count = 0 # including those whose address is unreadable
+
+    def _snapshot_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def change_token(self):
+        # Lock-free: checkpoints replace the snapshot (new stat) and every
+        # commit, like every checkpoint's rotate marker, grows the journal,
+        # so both are visible without replaying
+        snapshot_id = self._snapshot_stat()
+        if self._data is None or snapshot_id != self._snapshot_id:
+            return (snapshot_id, None)
+        try:
+            size = os.path.getsize(journal.journal_path(self.path, self._generation))
+        except OSError:
+            size = 0
+        return (snapshot_id, self._generation, size)
+
+    def _reload(self, snapshot_id):
+        data, self._from_previous, damaged = journal.read_snapshot(self.path, wallettable.loads_snapshot)
+        self._damaged = {address for _, address in damaged if address is not None}
+        self._damaged_count = len(damaged)
+        self._data = data if data is not None else {"wallets": wallettable.WalletTable()}
+        self._snapshot_id = snapshot_id
+        self._loaded_generation = self._generation = self._data.get('journal_generation', 0)
+        self._offset = 0
+        self._commits = 0
+        self._compact_at = journal.COMPACT_THRESHOLD
+        self._board = None
+
+    def _catch_up(self, stop=None):
+        """Replays journal commits written since the last call. Caller holds the lock."""
+        snapshot_id = self._snapshot_stat()
+        if self._data is None or snapshot_id != self._snapshot_id:
+            # First read, or another process checkpointed a new snapshot
+            self._reload(snapshot_id)
+
+        while True:
+            commits, self._offset = journal.read_commits(self.path, self._generation, self._offset, stop)
+            rotated = False
+            for records in commits:
+                if records is None:
+                    continue
+                if journal.is_rotation(records):
+                    # A checkpoint ended this journal; continue in the next one
+                    rotated = True
+                    break
+                self._apply(records)
+                self._commits += 1
+            if not rotated:
+                return
+            self._generation += 1
+            self._offset = 0
+
+    def _apply(self, records):
+        """apply_commit() on the in-memory ledger, keeping the leaderboard in step."""
+        if not journal.apply_commit(self._data, records):
+            return False
+        if self._board is not None:
+            wallets = self._data['wallets']
+            for address in {record['addr'] for record in records}:
+                self._board.update(address, wallets.get(address))
+        return True
+
+    def _check_intact(self, addresses):
+        for address in addresses:
+            if address in self._damaged:
+                raise LedgerError(f"Wallet {address} is damaged in the ledger snapshot; "
+                                  f"run 'python integrity.py repair'.")
+
+    def _leaderboard(self):
+        if self._board is None:
+            self._board = leaderboard.Leaderboard(self._data['wallets'])
+        return self._board
+
+    @contextmanager
+    def _synced(self, exclusive=False):
+        try:
+            with self._lock.hold(exclusive):
+                self._catch_up()
+                yield
+        except (json.JSONDecodeError, journal.CorruptSnapshot) as e:
+            self._data = None
+            raise LedgerError(f"Ledger file corrupted: {e}")
+        except IOError as e:
+            raise LedgerError(f"Ledger I/O error: {e}")
+
+    def load_all(self):
+        with self._synced():
+            return {"wallets": {address: _copy_wallet(wallet)
+                                for address, wallet in self._data['wallets'].items()}}
+
+    def save_all(self, data):
+        with self._compact_lock.hold(exclusive=True), self._synced(exclusive=True):
+            generation = journal.rotate(self.path, self._generation)
+            data = {
+                "wallets": {address: _copy_wallet(wallet) for address, wallet in data['wallets'].items()},
+                "journal_generation": generation,
+            }
+            tmp_file = journal.write_snapshot(self.path, data)
+            data['wallets'] = wallettable.WalletTable(data['wallets'])
+            self._install(tmp_file, data)
+
+    def _install(self, tmp_file, data):
+        """Swaps in a written snapshot of `data`. Caller holds both locks, the ledger lock exclusively."""
+        journal.install_snapshot(self.path, tmp_file, data['journal_generation'], self._loaded_generation,
+                                 keep_previous=not self._from_previous)
+        if data['wallets'] is not self._data['wallets']:
+            self._board = None # save_all() replaced the wallets; compaction keeps them
+        self._data = data
+        self._snapshot_id = self._snapshot_stat()
+        self._loaded_generation = self._generation = data['journal_generation']
+        self._from_previous = False
+        self._damaged = set()
+        self._damaged_count = 0
+        self._offset = 0
+        self._commits = 0
+        self._compact_at = journal.COMPACT_THRESHOLD
+
+    def get_wallet(self, address):
+        with self._synced():
+            self._check_intact([address])
+            wallet = self._data['wallets'].get(address)
+            return _copy_wallet(wallet) if wallet is not None else None
+
+    def get_wallets(self, addresses):
+        with self._synced():
+            self._check_intact(addresses)
+            wallets = self._data['wallets']
+            return {address: _copy_wallet(wallets[address]) for address in addresses if address in wallets}
+
+    def wallet_exists(self, address):
+        with self._synced():
+            self._check_intact([address])
+            return address in self._data['wallets']
+
+    def wallet_count(self):
+        with self._synced():
+            return len(self._data['wallets'])
+
+    def top_wallets(self, field, n):
+        leaderboard.check_field(field)
+        with self._synced():
+            return self._leaderboard().top(field, n)
+
+    def count_ahead(self, field, value, address):
+        leaderboard.check_field(field)
+        with self._synced():
+            return self._leaderboard().count_ahead(field, value, address)
+
+    def commit(self, records):
+        error = malformed(records)
+        if error is not None:
+            raise error # before it's written: the journal would replay it forever
+        line = journal.encode_commit(records)
+        with self._synced():
+            self._check_intact(record['addr'] for record in records)
+            # _synced() caught up to the newest journal, and no checkpoint can
+            # end it while we hold the shared lock
+            start = journal.append_commit(self.path, self._generation, line)
+            # Replay whatever other processes appended ahead of us, then our own
+            # commit: its outcome is decided by its position in the journal.
+            self._catch_up(stop=start)
+            if self._offset != start:
+                raise LedgerError("Journal tail is corrupted; the commit was not recorded.")
+            self._offset += len(line)
+            self._commits += 1
+            applied = self._apply(records)
+
+        self._compact_if_due()
+        if not applied:
+            raise VersionConflict("Wallet was modified by another process.")
+
+    def commit_group(self, groups):
+        # One journal line per group, all appended in a single write
+        outcomes = [malformed(records) for records in groups]
+        lines = [journal.encode_commit(records) if outcome is None else None
+                 for records, outcome in zip(groups, outcomes)]
+        with self._synced():
+            written = []
+            for i, records in enumerate(groups):
+                if outcomes[i] is not None:
+                    continue
+                try:
+                    self._check_intact(record['addr'] for record in records)
+                    written.append(i)
+                except LedgerError as e:
+                    outcomes[i] = e
+            start = journal.append_commit(self.path, self._generation, b''.join(lines[i] for i in written))
+            self._catch_up(stop=start)
+            if self._offset != start:
+                raise LedgerError("Journal tail is corrupted; the commits were not recorded.")
+            for i in written:
+                self._offset += len(lines[i])
+                self._commits += 1
+                if not self._apply(groups[i]):
+                    outcomes[i] = VersionConflict("Wallet was modified by another process.")
+
+        self._compact_if_due()
+        return outcomes
+
+    def _compact_if_due(self):
+        # Runs after commits that are already durable: a failed compaction
+        # must not turn them into errors (callers would retry and apply
+        # them twice), so it only warns and is tried again later
+        if self._commits < self._compact_at:
+            return
+        try:
+            if self.compact(blocking=False) or not self._damaged_count:
+                return
+        except LedgerError as e:
+            print(f"Warning: could not compact the ledger: {e}", file=sys.stderr)
+        # Waiting for a repair, or failing: try again after another
+        # threshold's worth of commits, not on every one
+        self._compact_at = self._commits + journal.COMPACT_THRESHOLD
+
+    def compact(self, blocking=True):
+        """Folds the journal into a new snapshot. Returns False if skipped.
+
+        Other processes keep reading and committing while the snapshot is
+        serialized and written; the exclusive lock is only held to end the
+        current journal and to swap the new snapshot in. With
+        blocking=False, skips instead of waiting for another compaction.
+        """
+        try:
+            if self._damaged_count:
+                # Checked before taking the locks, so that commits aren't held
+                # up for nothing; catching up first sees a repair another
+                # process made (it replaces the snapshot)
+                with self._synced():
+                    if self._damaged_count:
+                        return False
+            with self._compact_lock.hold(exclusive=True, blocking=blocking) as acquired:
+                if not acquired:
+                    return False
+                with self._lock.hold(exclusive=True):
+                    self._catch_up()
+                    if not blocking and self._commits < journal.COMPACT_THRESHOLD:
+                        # Another process compacted while we waited
+                        return False
+                    if self._damaged_count:
+                        # The new snapshot would leave the damaged wallets out for good
+                        return False
+                    snapshot_id = self._snapshot_id
+                    self._generation = journal.rotate(self.path, self._generation)
+                    self._offset = 0
+
+                # Nothing is applied to self._data until the swap, so it is
+                # exactly the ledger up to the rotate marker
+                data = dict(self._data, journal_generation=self._generation)
+                tmp_file = journal.write_snapshot(self.path, data)
+
+                with self._lock.hold(exclusive=True):
+                    if self._snapshot_stat() != snapshot_id:
+                        # Only happens if someone replaced the snapshot by hand
+                        os.remove(tmp_file)
+                        self._data = None
+                        return False
+                    self._install(tmp_file, data)
+                    return True
+        except (json.JSONDecodeError, journal.CorruptSnapshot) as e:
+            self._data = None
+            raise LedgerError(f"Ledger file corrupted: {e}")
+        except IOError as e:
+            raise LedgerError(f"Ledger I/O error: {e}")
+
+    def close(self):
+        self._lock.close()
+        self._compact_lock.close()
+
+# --- SQLite Backend (WAL, one row per wallet) ---
+
+class SQLiteBackend(LedgerBackend):
+    COLUMNS = "address, balance, flight_score, history, version, task_day"
+    INSERT = f"INSERT INTO wallets ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)"
+    UPSERT = f"INSERT OR REPLACE INTO wallets ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)"
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS wallets ("
+                " address TEXT PRIMARY KEY,"
+                " balance REAL NOT NULL,"
+                " flight_score REAL NOT NULL,"
+                " history TEXT,"
+                " version INTEGER NOT NULL DEFAULT 0,"
+                " task_day INTEGER)"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(wallets)")]
+            if 'version' not in columns:
+                self.conn.execute("ALTER TABLE wallets ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            if 'task_day' not in columns:
+                self.conn.execute("ALTER TABLE wallets ADD COLUMN task_day INTEGER")
+            # Leaderboard indexes: top N is an index walk, a rank an index range count
+            for field in leaderboard.FIELDS:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS wallets_by_{field} ON wallets ({field} DESC, address)")
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not open ledger database: {e}")
+        self._writes = 0
+
+    @staticmethod
+    def _row_to_wallet(row):
+        address, balance, flight_score, history, version, task_day = row
+        wallet = {
+            "balance": balance,
+            "flight_score": flight_score,
+            "wallet_address": address,
+            "version": version,
+        }
+        if history is not None:
+            wallet['flight_score_history'] = json.loads(history)
+        if task_day is not None:
+            wallet['task_day'] = task_day
+        return wallet
+
+    @staticmethod
+    def _wallet_to_row(address, wallet):
+        history = wallet.get('flight_score_history')
+        return (
+            address,
+            wallet['balance'],
+            wallet['flight_score'],
+            json.dumps(history, separators=(',', ':')) if history is not None else None,
+            wallet.get('version', 0),
+            wallet.get('task_day'),
+        )
+
+    def _select(self, address):
+        return self.conn.execute(
+            f"SELECT {self.COLUMNS} FROM wallets WHERE address = ?",
+            (address,),
+        ).fetchone()
+
+    def load_all(self):
+        try:
+            rows = self.conn.execute(
+                f"SELECT {self.COLUMNS} FROM wallets"
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+        return {"wallets": {row[0]: self._row_to_wallet(row) for row in rows}}
+
+    def save_all(self, data):
+        rows = [self._wallet_to_row(address, wallet) for address, wallet in data['wallets'].items()]
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.execute("DELETE FROM wallets")
+            self.conn.executemany(self.INSERT, rows)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._rollback()
+            raise LedgerError(f"Error saving ledger: {e}")
+        finally:
+            self._writes += 1
+
+    def get_wallet(self, address):
+        try:
+            row = self._select(address)
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+        return self._row_to_wallet(row) if row else None
+
+    def get_wallets(self, addresses):
+        addresses = list(addresses)
+        wallets = {}
+        try:
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(addresses), 500):
+                chunk = addresses[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT {self.COLUMNS} FROM wallets"
+                    f" WHERE address IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                wallets.update((row[0], self._row_to_wallet(row)) for row in rows)
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+        return wallets
+
+    def wallet_exists(self, address):
+        try:
+            return self.conn.execute(
+                "SELECT 1 FROM wallets WHERE address = ?", (address,)
+            ).fetchone() is not None
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+
+    def wallet_count(self):
+        try:
+            return self.conn.execute("SELECT COUNT(*) FROM wallets").fetchone()[0]
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+
+    def top_wallets(self, field, n):
+        leaderboard.check_field(field)
+        try:
+            return self.conn.execute(
+                f"SELECT address, {field} FROM wallets ORDER BY {field} DESC, address LIMIT ?", (n,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+
+    def count_ahead(self, field, value, address):
+        leaderboard.check_field(field)
+        try:
+            return self.conn.execute(
+                f"SELECT (SELECT COUNT(*) FROM wallets WHERE {field} > ?)"
+                f" + (SELECT COUNT(*) FROM wallets WHERE {field} = ? AND address < ?)",
+                (value, value, address),
+            ).fetchone()[0]
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+
+    def _apply(self, records):
+        """Applies records to just the rows they touch. Caller holds a write transaction."""
+        touched = {"wallets": {}}
+        for address in {record['addr'] for record in records}:
+            row = self._select(address)
+            if row is not None:
+                touched['wallets'][address] = self._row_to_wallet(row)
+
+        if not journal.apply_commit(touched, records):
+            return False
+        self.conn.executemany(
+            self.UPSERT,
+            [self._wallet_to_row(address, wallet) for address, wallet in touched['wallets'].items()],
+        )
+        return True
+
+    def commit(self, records):
+        error = malformed(records)
+        if error is not None:
+            raise error
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            if not self._apply(records):
+                self._rollback()
+                raise VersionConflict("Wallet was modified by another process.")
+            self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._rollback()
+            raise LedgerError(f"Error saving ledger: {e}")
+        finally:
+            self._writes += 1
+
+    def commit_group(self, groups):
+        # One transaction, a savepoint per group
+        outcomes = []
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            for records in groups:
+                error = malformed(records)
+                if error is not None:
+                    outcomes.append(error)
+                    continue
+                self.conn.execute("SAVEPOINT grp")
+                if self._apply(records):
+                    outcomes.append(None)
+                else:
+                    self.conn.execute("ROLLBACK TO grp")
+                    outcomes.append(VersionConflict("Wallet was modified by another process."))
+                self.conn.execute("RELEASE grp")
+            self.conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            self._rollback()
+            raise LedgerError(f"Error saving ledger: {e}")
+        finally:
+            self._writes += 1
+        return outcomes
+
+    def change_token(self):
+        # data_version only moves for other connections' commits
+        try:
+            return (self.conn.execute("PRAGMA data_version").fetchone()[0], self._writes)
+        except sqlite3.Error as e:
+            raise LedgerError(f"Could not read ledger: {e}")
+
+    def _rollback(self):
+        if self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+
+    def close(self):
+        self.conn.close()
+
+# Backends given as 'module.Class' are imported on first use
+BACKENDS = {
+    'json': JSONBackend,
+    'sqlite': SQLiteBackend,
+    'binary': 'binledger.BinaryBackend',
+}
+
+def backend_class(name):
+    if name not in BACKENDS:
+        raise LedgerError(f"Unknown ledger backend: {name}")
+    cls = BACKENDS[name]
+    if isinstance(cls, str):
+        module, _, attr = cls.rpartition('.')
+        cls = BACKENDS[name] = getattr(importlib.import_module(module), attr)
+    return cls
+
+# --- Sharded Backend ---
+
+def shard_index(address, shards):
+    """Shard for an address. Generated addresses are uniformly random, so prefixes spread evenly."""
+    return zlib.crc32(address[:SHARD_PREFIX_LEN].encode()) % shards
+
+def shard_path(path, index):
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index:02d}{ext}"
+
+class ShardedBackend(LedgerBackend):
+    """Partitions wallets by address prefix over independent child backends.
+
+    Every shard has its own files (and, for JSON, its own lock and journal),
+    so operations on one wallet only touch its shard and miners working on
+    different shards never contend. Whole-ledger calls fan out to all shards.
+    """
+
+    def __init__(self, name, path, shards):
+        self.path = path
+        self._check_manifest(name, shards)
+        self.shards = [backend_class(name)(shard_path(path, i)) for i in range(shards)]
+
+    def _check_manifest(self, name, shards):
+        # Re-opening with another shard count would silently misroute wallets
+        manifest = os.path.splitext(self.path)[0] + '.shards'
+        try:
+            if os.path.exists(manifest):
+                with open(manifest, 'r') as f:
+                    layout = json.load(f)
+                if layout != {"backend": name, "shards": shards}:
+                    raise LedgerError(
+                        f"Ledger is sharded as {layout['shards']} x {layout['backend']}, "
+                        f"not {shards} x {name}.")
+            else:
+                with open(manifest, 'w') as f:
+                    json.dump({"backend": name, "shards": shards}, f)
+        except (IOError, ValueError, KeyError) as e:
+            raise LedgerError(f"Could not read shard manifest: {e}")
+
+    def shard(self, address):
+        return self.shards[shard_index(address, len(self.shards))]
+
+    def _by_shard(self, items, address_of):
+        groups = {}
+        for item in items:
+            groups.setdefault(shard_index(address_of(item), len(self.shards)), []).append(item)
+        return groups
+
+    def load_all(self):
+        wallets = {}
+        for shard in self.shards:
+            wallets.update(shard.load_all()['wallets'])
+        return {"wallets": wallets}
+
+    def save_all(self, data):
+        groups = self._by_shard(data['wallets'].items(), lambda item: item[0])
+        for i, shard in enumerate(self.shards):
+            shard.save_all({"wallets": dict(groups.get(i, []))})
+
+    def get_wallet(self, address):
+        return self.shard(address).get_wallet(address)
+
+    def get_wallets(self, addresses):
+        wallets = {}
+        for i, group in self._by_shard(addresses, lambda address: address).items():
+            wallets.update(self.shards[i].get_wallets(group))
+        return wallets
+
+    def wallet_exists(self, address):
+        return self.shard(address).wallet_exists(address)
+
+    def wallet_count(self):
+        return sum(shard.wallet_count() for shard in self.shards)
+
+    def top_wallets(self, field, n):
+        tops = [shard.top_wallets(field, n) for shard in self.shards]
+        return heapq.nsmallest(n, (tuple(pair) for top in tops for pair in top),
+                               key=lambda pair: (-pair[1], pair[0]))
+
+    def count_ahead(self, field, value, address):
+        return sum(shard.count_ahead(field, value, address) for shard in self.shards)
+
+    def commit(self, records):
+        error = malformed(records)
+        if error is not None:
+            raise error
+        groups = self._by_shard(records, lambda record: record['addr'])
+        if len(groups) > 1:
+            raise CrossShardCommit("A single commit cannot span shards; use commit_independent().")
+        for i, group in groups.items():
+            self.shards[i].commit(group)
+
+    def commit_independent(self, records):
+        error = malformed(records)
+        if error is not None:
+            raise error
+        conflicts = []
+        for i, group in self._by_shard(records, lambda record: record['addr']).items():
+            conflicts.extend(self.shards[i].commit_independent(group))
+        return conflicts
+
+    def commit_group(self, groups):
+        outcomes = [None] * len(groups)
+        by_shard = {}
+        for i, records in enumerate(groups):
+            outcomes[i] = malformed(records)
+            if outcomes[i] is not None:
+                continue
+            indexes = {shard_index(record['addr'], len(self.shards)) for record in records}
+            if len(indexes) > 1:
+                outcomes[i] = CrossShardCommit("A single commit cannot span shards; use commit_independent().")
+            elif indexes:
+                by_shard.setdefault(indexes.pop(), []).append(i)
+        for shard, members in by_shard.items():
+            results = self.shards[shard].commit_group([groups[i] for i in members])
+            for i, outcome in zip(members, results):
+                outcomes[i] = outcome
+        return outcomes
+
+    def change_token(self):
+        tokens = tuple(shard.change_token() for shard in self.shards)
+        return None if None in tokens else tokens
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+def open_backend(name, path=None, shards=1):
+    """Opens a ledger backend by name, optionally split into address-prefix shards."""
+    cls = backend_class(name)
+    path = path or DEFAULT_DATA_FILES[name]
+    if shards > 1:
+        return ShardedBackend(name, path, shards)
+    return cls(path)
+
+# --- Read Cache ---
+
+class LedgerCache:
+    """Parsed wallets kept in memory between reads.
+
+    Before every read the backend's change_token() is compared with the one
+    the cached wallets were read under; if any process (this one included)
+    wrote in between, the cache is dropped and the read goes to the backend.
+    Otherwise it's served from memory. `hits` and `misses` count reads.
+    """
+
+    # Per-address entries kept before the cache starts over
+    MAX_ENTRIES = 100_000
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self._token = None
+        self._wallets = {} # address -> wallet, or None if the address is unknown
+        self._complete = False # True once _wallets holds the whole ledger
+        self._count = None
+
+    def _validate(self):
+        token = self.backend.change_token()
+        if token is None or token != self._token:
+            self.invalidate()
+            self._token = token
+
+    def _known(self, address):
+        return self._complete or address in self._wallets
+
+    def _remember(self, address, wallet):
+        if len(self._wallets) >= self.MAX_ENTRIES and not self._complete:
+            self._wallets.clear()
+        self._wallets[address] = wallet
+
+    def load_all(self):
+        self._validate()
+        if self._complete:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._wallets = self.backend.load_all()['wallets']
+            self._complete = True
+        return {"wallets": {address: _copy_wallet(wallet)
+                            for address, wallet in self._wallets.items() if wallet is not None}}
+
+    def get_wallet(self, address):
+        self._validate()
+        if self._known(address):
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._remember(address, self.backend.get_wallet(address))
+        wallet = self._wallets.get(address)
+        return _copy_wallet(wallet) if wallet is not None else None
+
+    def get_wallets(self, addresses):
+        self._validate()
+        addresses = list(addresses)
+        missing = [address for address in addresses if not self._known(address)]
+        self.hits += len(addresses) - len(missing)
+        if missing:
+            self.misses += len(missing)
+            found = self.backend.get_wallets(missing)
+            for address in missing:
+                self._remember(address, found.get(address))
+        wallets = {}
+        for address in addresses:
+            wallet = self._wallets.get(address)
+            if wallet is not None:
+                wallets[address] = _copy_wallet(wallet)
+        return wallets
+
+    def wallet_exists(self, address):
+        self._validate()
+        if self._known(address):
+            self.hits += 1
+            return self._wallets.get(address) is not None
+        self.misses += 1
+        return self.backend.wallet_exists(address)
+
+    def wallet_count(self):
+        self._validate()
+        if self._count is None and self._complete:
+            self._count = sum(1 for wallet in self._wallets.values() if wallet is not None)
+        if self._count is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._count = self.backend.wallet_count()
+        return self._count
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+# --- Change Notifications ---
+
+class Subscription:
+    """Changes to a few wallets, found by watching the backend's change_token().
+
+    poll() returns {address: wallet, or None once it's gone} for the watched
+    wallets that changed since the last call; the first call returns every
+    one that exists. Nothing is read while the token stays the same, and
+    then only the watched wallets, never the whole ledger. Clients of a
+    ledger daemon get changes pushed instead (ledgerd.PushSubscription);
+    this is the fallback without one. Call poll() from the thread that uses
+    the backend.
+    """
+
+    def __init__(self, backend, addresses):
+        self.backend = backend
+        self.addresses = list(addresses)
+        self._token = None
+        self._states = {} # address -> wallet as last returned
+
+    def poll(self):
+        # Read before the wallets: a write in between changes it again
+        token = self.backend.change_token()
+        if token is not None and token == self._token:
+            return {}
+        wallets = self.backend.get_wallets(self.addresses)
+        self._token = token
+        changes = {}
+        for address in self.addresses:
+            wallet = wallets.get(address)
+            if wallet != self._states.get(address):
+                # Callers may change what they get; keep a copy to compare with
+                self._states[address] = _copy_wallet(wallet) if wallet is not None else None
+                changes[address] = wallet
+        return changes
+
+    def close(self):
+        pass
+
+# --- Module-level Ledger API ---
+
+_backend = None
+_cache = None
+
+def get_backend():
+    """Returns the process-wide backend, opening it from the environment on first use."""
+    global _backend
+    if _backend is None:
+        name = os.environ.get('COOIN_BACKEND', 'json')
+        path = os.environ.get('COOIN_DATA_FILE') or DEFAULT_DATA_FILES.get(name)
+        shards = int(os.environ.get('COOIN_SHARDS', '1'))
+        backend_class(name) # an unknown name is a LedgerError, daemon or not
+        # Prefer a running ledger daemon (ledgerd.py) for this ledger
+        import ledgerd
+        _backend = ledgerd.connect(name, path, shards) or open_backend(name, path, shards)
+    return _backend
+
+def set_backend(backend):
+    """Replaces the process-wide backend (e.g. for scripts and benchmarks)."""
+    global _backend, _cache
+    if _backend is not None and _backend is not backend:
+        _backend.close()
+    _backend = backend
+    _cache = None
+
+def get_cache():
+    """Returns the process-wide read cache, or None if COOIN_CACHE=0."""
+    global _cache
+    if os.environ.get('COOIN_CACHE', '1') == '0':
+        return None
+    if _cache is None or _cache.backend is not get_backend():
+        _cache = LedgerCache(get_backend())
+    return _cache
+
+def cache_stats():
+    """Hit and miss counts of the process-wide read cache."""
+    cache = get_cache()
+    return cache.stats() if cache is not None else {"hits": 0, "misses": 0}
+
+def _reader():
+    return get_cache() or get_backend()
+
+def _written():
+    if _cache is not None:
+        _cache.invalidate()
+
+def _count_commits(groups, outcomes):
+    """Metrics for committed groups of records; outcomes as from commit_group()."""
+    if not metrics.ENABLED:
+        return
+    for records, outcome in zip(groups, outcomes):
+        if outcome is None:
+            metrics.inc('cooin_ledger_commits_total', outcome='ok')
+            metrics.inc('cooin_wallets_touched_total', len({record['addr'] for record in records}))
+        else:
+            metrics.inc('cooin_ledger_commits_total',
+                        outcome='conflict' if isinstance(outcome, VersionConflict) else 'error')
+
+def _cache_metrics():
+    if _cache is None:
+        return []
+    return [('cooin_ledger_cache_hits_total', {}, _cache.hits),
+            ('cooin_ledger_cache_misses_total', {}, _cache.misses)]
+
+metrics.add_collector(_cache_metrics)
+
+def load_all_wallets():
+    with metrics.timed('cooin_ledger_seconds', op='load_all'):
+        return _reader().load_all()
+
+def save_all_wallets(data):
+    try:
+        with metrics.timed('cooin_ledger_seconds', op='save_all'):
+            get_backend().save_all(data)
+    finally:
+        _written()
+
+def get_wallet(address):
+    return _reader().get_wallet(address)
+
+def get_wallets(addresses):
+    return _reader().get_wallets(addresses)
+
+def wallet_exists(address):
+    return _reader().wallet_exists(address)
+
+def wallet_count():
+    return _reader().wallet_count()
+
+def top_wallets(field='balance', n=10):
+    """The `n` wallets ranked highest by balance or flight_score, as (address, value) pairs."""
+    with metrics.timed('cooin_ledger_seconds', op='top'):
+        return [tuple(pair) for pair in get_backend().top_wallets(field, n)]
+
+def wallet_rank(address, field='balance'):
+    """(rank, number of wallets) of a wallet by balance or flight_score, 1 being the top; None if unknown."""
+    wallet = get_wallet(address)
+    if wallet is None:
+        return None
+    with metrics.timed('cooin_ledger_seconds', op='rank'):
+        ahead = get_backend().count_ahead(field, wallet[field], address)
+    return ahead + 1, wallet_count()
+
+def subscribe(addresses):
+    """Watches wallets for changes by any process; poll() the result (see Subscription)."""
+    return get_backend().subscribe(addresses)
+
+def commit(*records):
+    """Commits mutation records (see journal.py for the record constructors)."""
+    records = list(records)
+    outcome = None
+    try:
+        with metrics.timed('cooin_ledger_seconds', op='commit'):
+            get_backend().commit(records)
+    except LedgerError as e:
+        outcome = e
+        raise
+    finally:
+        _written()
+        _count_commits([records], [outcome])
+
+def commit_group(groups):
+    """Commits unrelated transactions (lists of records) in one write; one outcome per group (see LedgerBackend)."""
+    groups = [list(records) for records in groups]
+    if not groups:
+        return []
+    try:
+        with metrics.timed('cooin_ledger_seconds', op='commit'):
+            outcomes = get_backend().commit_group(groups)
+    finally:
+        _written()
+    _count_commits(groups, outcomes)
+    return outcomes
+
+def commit_independent(records):
+    """Commits per-wallet records in as few transactions as possible; returns the conflicting ones."""
+    records = list(records)
+    try:
+        with metrics.timed('cooin_ledger_seconds', op='commit'):
+            conflicts = get_backend().commit_independent(records)
+    finally:
+        _written()
+    if metrics.ENABLED:
+        failed = {id(record) for record in conflicts}
+        _count_commits([[record] for record in records],
+                       [VersionConflict() if id(record) in failed else None for record in records])
+    return conflicts
+
+# --- Transactions ---
+
+class Transaction:
+    """The reads and mutation records of one user action, committed in one write.
+
+    Records for wallets read through get_wallet() are pinned to the version
+    that was read, so the commit fails with VersionConflict if another
+    process changed one of them in between. Nothing is written before
+    commit(), and the commit is atomic, so a process that dies mid-action
+    leaves the ledger untouched.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._read = {}
+
+    def get_wallet(self, address):
+        wallet = get_wallet(address)
+        if wallet is not None:
+            self._read.setdefault(address, _copy_wallet(wallet))
+        return wallet
+
+    def add(self, *records):
+        self.records.extend(records)
+
+    def updated(self, address):
+        """The wallet as read, with this transaction's records applied."""
+        data = {"wallets": {address: _copy_wallet(self._read[address])}}
+        for record in self.records:
+            if record['addr'] == address:
+                journal.apply_record(data, record)
+        return data['wallets'][address]
+
+    def pinned_records(self):
+        for record in self.records:
+            if 'expect' not in record and record['addr'] in self._read:
+                record['expect'] = self._read[record['addr']].get('version', 0)
+        return self.records
+
+    def commit(self):
+        if self.records:
+            commit(*self.pinned_records())
+
+@contextmanager
+def transaction():
+    """Collects one action's records and commits them on exit (not if it raises)."""
+    tx = Transaction()
+    yield tx
+    tx.commit()
+
+def retry_delay(attempt):
+    """Random sleep before retry `attempt`, doubling from RETRY_BACKOFF up to RETRY_BACKOFF_MAX."""
+    return random.uniform(0, min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX))
+
+def run_transaction(action, retries=MAX_RETRIES):
+    """Runs `action(tx)` and commits its records, re-running it on conflict.
+
+    Returns whatever `action` returned for the attempt that was committed.
+    """
+    for attempt in range(retries):
+        tx = Transaction()
+        result = action(tx)
+        try:
+            tx.commit()
+        except VersionConflict:
+            time.sleep(retry_delay(attempt))
+            continue
+        return result
+
+    raise VersionConflict(f"Gave up after {retries} conflicting attempts.")
+
+def update_wallet(address, mutate, retries=MAX_RETRIES):
+    """Optimistic read-modify-write of a single wallet.
+
+    `mutate(wallet)` returns the records to commit, or None to leave the
+    wallet alone. The records are pinned to the version that was read; if
+    another process changes the wallet first, the wallet is re-read and
+    `mutate` runs again. Returns the updated wallet, or None if `mutate`
+    declined.
+    """
+    def action(tx):
+        wallet = tx.get_wallet(address)
+        if wallet is None:
+            raise LedgerError(f"Unknown wallet: {address}")
+        records = mutate(dict(wallet))
+        if not records:
+            return None
+        tx.add(*records)
+        return tx.updated(address)
+
+    try:
+        return run_transaction(action, retries)
+    except VersionConflict:
+        raise VersionConflict(f"Gave up updating {address} after {retries} conflicting attempts.")
+
+class CommitBatcher:
+    """Holds independent transactions and writes them together, for headless use.
+
+    Queued transactions go out in one commit_group() call once the oldest
+    has waited `window` seconds (checked on submit), once `max_size` are
+    queued, or on flush(). Each stays atomic on its own; ones still queued
+    when a process dies were never written at all. Reads don't see queued
+    transactions, so a batch should not pin the same wallet twice.
+    """
+
+    def __init__(self, window=COMMIT_WINDOW, max_size=256):
+        self.window = window
+        self.max_size = max_size
+        self.failed = [] # (records, LedgerError) of transactions that didn't commit
+        self._queue = []
+        self._started = 0.0
+
+    def submit(self, tx):
+        """Queues a Transaction (or a list of records)."""
+        records = tx.pinned_records() if isinstance(tx, Transaction) else list(tx)
+        if not records:
+            return
+        if not self._queue:
+            self._started = time.monotonic()
+        self._queue.append(records)
+        if len(self._queue) >= self.max_size or time.monotonic() - self._started >= self.window:
+            self.flush()
+
+    def flush(self):
+        queue, self._queue = self._queue, []
+        outcomes = commit_group(queue)
+        self.failed.extend((records, outcome) for records, outcome in zip(queue, outcomes)
+                           if outcome is not None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+# --- Main Execution ---
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Copy a Cooin ledger between backends or shard layouts.")
+    parser.add_argument('src_backend', choices=sorted(BACKENDS))
+    parser.add_argument('src_path')
+    parser.add_argument('dst_backend', choices=sorted(BACKENDS))
+    parser.add_argument('dst_path')
+    parser.add_argument('--src-shards', type=int, default=1)
+    parser.add_argument('--dst-shards', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    try:
+        src = open_backend(args.src_backend, args.src_path, args.src_shards)
+        dst = open_backend(args.dst_backend, args.dst_path, args.dst_shards)
+        data = src.load_all()
+        dst.save_all(data)
+    except LedgerError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Copied {len(data['wallets'])} wallets from {args.src_path} to {args.dst_path}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
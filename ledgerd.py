@@ -0,0 +1,544 @@
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+
+import journal
+import leaderboard
+import ledger
+
+# Optional ledger daemon.
+#
+# One process owns the ledger and serves every client over a Unix domain
+# socket, one JSON request per line:
+#   -> {"op": "get_wallet", "args": ["<address>"]}
+#   <- {"ok": {...}}  or  {"error": "conflict" | "ledger", "message": "..."}
+# Reads are answered straight from the daemon's backend. Commits that arrive
+# while the previous write is in flight are queued and written together as
+# one group commit (LedgerBackend.commit_group), so concurrent clients share
+# the write and sync cost while each commit stays atomic on its own.
+#
+# A connection can also subscribe to wallets instead of sending requests:
+#   -> {"op": "subscribe", "args": [["<address>", ...]]}
+#   <- {"ok": {"<address>": {...}, ...}}    the current state of each one
+#   <- {"event": "wallets", "wallets": {"<address>": {...} | null}}
+# and from then on gets an event line with the new state of every watched
+# wallet a commit changed. Writes that don't go through the daemon are
+# noticed from the backend's change_token() and pushed the same way.
+#
+# Clients don't talk to this module directly: ledger.get_backend() connects
+# to a running daemon for the configured ledger (COOIN_SOCKET, by default
+# cooin_data.sock next to the ledger file) and falls back to direct file
+# access when none is running. COOIN_DAEMON=0 skips the daemon.
+#
+# Every client imports this module on its first ledger access, so asyncio
+# (which only the server needs, and which costs more to import than the
+# rest of the ledger together) is imported inside the server code.
+
+# Most commits written as one group
+MAX_GROUP = 256
+
+# Connections a client keeps open (one per concurrent caller)
+POOL_SIZE = 4
+
+# How often the daemon checks for writes by other processes while anyone is subscribed (seconds)
+WATCH_INTERVAL = 0.25
+
+READ_OPS = {'load_all', 'get_wallet', 'get_wallets', 'wallet_exists', 'wallet_count',
+            'top_wallets', 'count_ahead'}
+
+def socket_path(path):
+    """Default socket for a ledger path: cooin_data.json -> cooin_data.sock. None without a path."""
+    if path is None:
+        return None
+    return os.environ.get('COOIN_SOCKET') or os.path.splitext(path)[0] + '.sock'
+
+def _layout(name, path, shards):
+    return {"backend": name, "path": os.path.abspath(path), "shards": shards}
+
+# Error kinds sent to clients, so they raise the same exception a direct backend would
+ERRORS = {'conflict': ledger.VersionConflict, 'cross_shard': ledger.CrossShardCommit}
+
+def _error(e):
+    kind = next((kind for kind, cls in ERRORS.items() if isinstance(e, cls)), 'ledger')
+    return {"error": kind, "message": str(e)}
+
+def _exception(reply):
+    return ERRORS.get(reply['error'], ledger.LedgerError)(reply['message'])
+
+# --- Server ---
+
+class LedgerServer:
+    def __init__(self, backend, layout, group_window=0.0):
+        self.backend = backend
+        self.layout = layout
+        self.group_window = group_window
+        self.groups = 0
+        self.commits = 0
+        self._pending = []
+        self._wakeup = None
+        self._clients = {} # handler task -> its writer
+        self.pushes = 0
+        self._watchers = {} # address -> writers subscribed to it
+        self._subscriptions = {} # writer -> addresses it watches
+        self._states = {} # watched address -> wallet as last pushed (None if missing)
+        self._token = None
+
+    def _read(self, op, args):
+        try:
+            result = getattr(self.backend, op)(*args)
+        except ledger.LedgerError as e:
+            return _error(e)
+        return {"ok": result}
+
+    async def _commit(self, records):
+        import asyncio
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((records, future))
+        self._wakeup.set()
+        return await future
+
+    async def _committer(self):
+        import asyncio
+        while True:
+            await self._wakeup.wait()
+            if self.group_window:
+                await asyncio.sleep(self.group_window)
+            self._wakeup.clear()
+            batch, self._pending = self._pending[:MAX_GROUP], self._pending[MAX_GROUP:]
+            if self._pending:
+                self._wakeup.set()
+            if not batch:
+                continue
+
+            try:
+                outcomes = self.backend.commit_group([records for records, _ in batch])
+            except ledger.LedgerError as e:
+                outcomes = [e] * len(batch)
+            except Exception as e:
+                # Fail this batch's commits but keep the committer running for the next ones
+                print(f"Warning: group commit failed: {e!r}", file=sys.stderr)
+                outcomes = [ledger.LedgerError(f"Group commit failed: {e}")] * len(batch)
+            self.groups += 1
+            self.commits += len(batch)
+            for (_, future), outcome in zip(batch, outcomes):
+                future.set_result({"ok": None} if outcome is None else _error(outcome))
+            if self._watchers:
+                self._publish({record['addr'] for (records, _), outcome in zip(batch, outcomes)
+                               if outcome is None for record in records})
+
+    # --- Subscriptions ---
+
+    def _subscribe(self, writer, addresses):
+        """Makes `addresses` the wallets this connection watches. Returns their current states."""
+        self._unsubscribe(writer)
+        # Catch the other subscribers up first: the states read below become the ones last pushed
+        self._publish(addresses)
+        fresh = [address for address in dict.fromkeys(addresses) if address not in self._states]
+        wallets = self.backend.get_wallets(fresh) if fresh else {}
+        for address in fresh:
+            self._states[address] = wallets.get(address)
+        self._subscriptions[writer] = set(addresses)
+        for address in addresses:
+            self._watchers.setdefault(address, set()).add(writer)
+        return {address: self._states[address] for address in addresses
+                if self._states[address] is not None}
+
+    def _unsubscribe(self, writer):
+        for address in self._subscriptions.pop(writer, ()):
+            watchers = self._watchers[address]
+            watchers.discard(writer)
+            if not watchers:
+                del self._watchers[address]
+                del self._states[address]
+
+    def _publish(self, addresses):
+        """Pushes the new state of every watched wallet among `addresses` that changed."""
+        watched = [address for address in addresses if address in self._watchers]
+        if not watched:
+            return
+        try:
+            wallets = self.backend.get_wallets(watched)
+        except ledger.LedgerError as e:
+            print(f"Warning: could not read subscribed wallets: {e}")
+            return
+        events = {} # writer -> {address: wallet}
+        for address in watched:
+            wallet = wallets.get(address)
+            if wallet == self._states[address]:
+                continue
+            self._states[address] = wallet
+            for writer in self._watchers[address]:
+                events.setdefault(writer, {})[address] = wallet
+        for writer, changed in events.items():
+            if not writer.is_closing():
+                writer.write((json.dumps({"event": "wallets", "wallets": changed}, separators=(',', ':')) + "\n").encode())
+                self.pushes += 1
+
+    async def _watch(self):
+        # Commits made through the daemon are published as they land; this
+        # catches everything else (save_all, clients without the daemon)
+        import asyncio
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            if not self._watchers:
+                continue
+            try:
+                token = self.backend.change_token()
+            except ledger.LedgerError:
+                continue
+            if token is None or token != self._token:
+                self._token = token
+                self._publish(list(self._watchers))
+
+    async def handle(self, reader, writer):
+        import asyncio
+        self._clients[asyncio.current_task()] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    op, args = request['op'], request.get('args', [])
+                    # Records are checked here, before they can reach the committer
+                    if op == 'commit' and args and args[0]:
+                        journal.check_commit(args[0])
+                    elif op == 'commit_group':
+                        for records in args[0]:
+                            journal.check_commit(records)
+                except (ValueError, KeyError, TypeError, IndexError):
+                    reply = {"error": "ledger", "message": "Malformed request."}
+                else:
+                    if op == 'hello':
+                        reply = {"ok": self.layout}
+                    elif op == 'commit':
+                        reply = await self._commit(args[0]) if args and args[0] else {"ok": None}
+                    elif op == 'commit_group':
+                        replies = await asyncio.gather(*(self._commit(records) for records in args[0]))
+                        reply = {"ok": [reply.get('error') and reply for reply in replies]}
+                    elif op == 'subscribe':
+                        try:
+                            reply = {"ok": self._subscribe(writer, args[0])}
+                        except ledger.LedgerError as e:
+                            reply = _error(e)
+                    elif op == 'stats':
+                        reply = {"ok": {"groups": self.groups, "commits": self.commits,
+                                        "subscribers": len(self._subscriptions), "pushes": self.pushes}}
+                    elif op in READ_OPS:
+                        reply = self._read(op, args)
+                    else:
+                        reply = {"error": "ledger", "message": f"Unknown operation: {op}"}
+                writer.write((json.dumps(reply, separators=(',', ':')) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._clients[asyncio.current_task()]
+            self._unsubscribe(writer)
+            writer.close()
+
+    async def serve(self, path):
+        import asyncio
+        self._wakeup = asyncio.Event()
+        committer = asyncio.create_task(self._committer())
+        watcher = asyncio.create_task(self._watch())
+        server = await asyncio.start_unix_server(self.handle, path, limit=2 ** 24)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        async with server:
+            await stop.wait()
+            # Let every client see EOF before the loop goes away
+            server.close()
+            for writer in list(self._clients.values()):
+                writer.close()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+        committer.cancel()
+        watcher.cancel()
+
+def _socket_in_use(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(path)
+        return True
+    except OSError:
+        return False
+
+def run_server(name, path, shards, sock, group_window=0.0):
+    import asyncio
+    if _socket_in_use(sock):
+        raise ledger.LedgerError(f"A ledger daemon is already listening on {sock}.")
+    if os.path.exists(sock):
+        os.unlink(sock) # left behind by a daemon that died
+
+    backend = ledger.open_backend(name, path, shards)
+    server = LedgerServer(backend, _layout(name, path, shards), group_window)
+    try:
+        asyncio.run(server.serve(sock))
+    finally:
+        backend.close()
+        if os.path.exists(sock):
+            os.unlink(sock)
+    return server
+
+# --- Client ---
+
+class DaemonBackend(ledger.LedgerBackend):
+    """Ledger backend that forwards every call to a running daemon.
+
+    Keeps a small pool of connections so threads can call concurrently. If
+    the daemon goes away, the call in flight raises LedgerError and later
+    calls use the ledger files directly.
+    """
+
+    def __init__(self, sock, name, path, shards=1, pool_size=POOL_SIZE):
+        self.sock = sock
+        self.layout = (name, path, shards)
+        self.pool_size = pool_size
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._direct = None
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.sock)
+        except OSError:
+            s.close()
+            raise
+        return s, s.makefile('rb')
+
+    def _checkout(self):
+        with self._pool_lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def _checkin(self, conn):
+        with self._pool_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn[0].close()
+
+    def _fall_back(self):
+        if self._direct is None:
+            self._direct = ledger.open_backend(*self.layout)
+        return self._direct
+
+    def _call(self, op, *args):
+        if self._direct is not None:
+            return getattr(self._direct, op)(*args)
+        try:
+            conn = self._checkout()
+        except OSError:
+            return getattr(self._fall_back(), op)(*args)
+        try:
+            conn[0].sendall((json.dumps({"op": op, "args": args}, separators=(',', ':')) + "\n").encode())
+        except OSError:
+            # The daemon is gone and never saw the request
+            conn[0].close()
+            self.close_idle()
+            return getattr(self._fall_back(), op)(*args)
+        try:
+            line = conn[1].readline()
+            if not line:
+                raise ConnectionError("connection closed")
+            reply = json.loads(line)
+        except (OSError, ValueError) as e:
+            conn[0].close()
+            self.close_idle()
+            if op in READ_OPS:
+                return getattr(self._fall_back(), op)(*args)
+            # A commit may or may not have landed
+            raise ledger.LedgerError(f"Lost the ledger daemon: {e}")
+        self._checkin(conn)
+
+        if 'error' in reply:
+            raise _exception(reply)
+        return reply['ok']
+
+    def hello(self):
+        return self._call('hello')
+
+    def load_all(self):
+        return self._call('load_all')
+
+    def save_all(self, data):
+        # Whole-ledger rewrites bypass the daemon; its backend catches up on the next call
+        self._fall_back().save_all(data)
+
+    def get_wallet(self, address):
+        return self._call('get_wallet', address)
+
+    def get_wallets(self, addresses):
+        return self._call('get_wallets', list(addresses))
+
+    def wallet_exists(self, address):
+        return self._call('wallet_exists', address)
+
+    def wallet_count(self):
+        return self._call('wallet_count')
+
+    def top_wallets(self, field, n):
+        leaderboard.check_field(field)
+        return [tuple(pair) for pair in self._call('top_wallets', field, n)]
+
+    def count_ahead(self, field, value, address):
+        leaderboard.check_field(field)
+        return self._call('count_ahead', field, value, address)
+
+    def commit(self, records):
+        self._call('commit', records)
+
+    def commit_independent(self, records):
+        # Each record is its own commit in the daemon's next group
+        conflicts = []
+        for record, outcome in zip(records, self.commit_group([[record] for record in records])):
+            if isinstance(outcome, ledger.VersionConflict):
+                conflicts.append(record)
+            elif outcome is not None:
+                raise outcome
+        return conflicts
+
+    def commit_group(self, groups):
+        if self._direct is not None:
+            return self._direct.commit_group(groups)
+        outcomes = self._call('commit_group', groups)
+        if self._direct is not None:
+            return outcomes # the daemon was gone and the fallback answered
+        return [None if outcome is None else _exception(outcome) for outcome in outcomes]
+
+    def subscribe(self, addresses):
+        if self._direct is None:
+            try:
+                return PushSubscription(self, addresses)
+            except OSError:
+                pass # the daemon is gone
+        return self._fall_back().subscribe(addresses)
+
+    def close_idle(self):
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+        for s, _ in idle:
+            s.close()
+
+    def close(self):
+        self.close_idle()
+        if self._direct is not None:
+            self._direct.close()
+
+class PushSubscription:
+    """Wallet changes pushed by the daemon; poll() and close() as ledger.Subscription.
+
+    Has a connection of its own, read by a background thread, so poll()
+    only hands over what has arrived and is safe from any thread. If the
+    daemon goes away, the backend falls back to the ledger files and
+    poll() carries on with a ledger.Subscription (call it from the thread
+    that uses the backend then).
+    """
+
+    def __init__(self, backend, addresses):
+        self.backend = backend
+        self.addresses = list(addresses)
+        self._lock = threading.Lock()
+        self._lost = False
+        self._closed = False
+        self._fallback = None
+        self._sock, self._file = backend._connect()
+        try:
+            self._sock.sendall((json.dumps({"op": "subscribe", "args": [self.addresses]},
+                                           separators=(',', ':')) + "\n").encode())
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("connection closed")
+            reply = json.loads(line)
+        except (OSError, ValueError) as e:
+            self._sock.close()
+            raise OSError(f"Could not subscribe: {e}")
+        if 'error' in reply:
+            self._sock.close()
+            raise _exception(reply)
+        self._changes = reply['ok'] # the first poll() returns every wallet that exists
+        threading.Thread(target=self._listen, name='cooin-subscription', daemon=True).start()
+
+    def _listen(self):
+        try:
+            for line in self._file:
+                changed = json.loads(line)['wallets']
+                with self._lock:
+                    self._changes.update(changed)
+        except (OSError, ValueError, KeyError):
+            pass
+        self._file.close()
+        with self._lock:
+            self._lost = True
+
+    def poll(self):
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            lost = self._lost
+        if self._fallback is None and lost and not self._closed:
+            # Changes made after the last push are in the fallback's first poll
+            self._fallback = ledger.Subscription(self.backend._fall_back(), self.addresses)
+        if self._fallback is not None:
+            changes.update(self._fallback.poll())
+        return changes
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+
+def connect(name, path, shards=1):
+    """A DaemonBackend if a daemon is serving this exact ledger, else None."""
+    if os.environ.get('COOIN_DAEMON', '1') == '0' or not hasattr(socket, 'AF_UNIX') or path is None:
+        return None
+    backend = DaemonBackend(socket_path(path), name, path, shards)
+    try:
+        backend._checkin(backend._connect())
+        if backend.hello() != _layout(name, path, shards):
+            backend.close()
+            return None
+    except (OSError, ledger.LedgerError):
+        backend.close()
+        return None
+    return backend
+
+# --- Main Execution ---
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve a Cooin ledger to local clients over a Unix socket.")
+    parser.add_argument('--backend', choices=sorted(ledger.BACKENDS),
+                        default=os.environ.get('COOIN_BACKEND', 'json'))
+    parser.add_argument('--data-file', default=os.environ.get('COOIN_DATA_FILE'))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('COOIN_SHARDS', '1')))
+    parser.add_argument('--socket', help="socket path (default: next to the ledger file)")
+    parser.add_argument('--group-window', type=float, default=0.0,
+                        help="milliseconds to wait for more commits before writing a group")
+    args = parser.parse_args(argv)
+
+    path = args.data_file or ledger.DEFAULT_DATA_FILES[args.backend]
+    sock = args.socket or socket_path(path)
+    print(f"Serving {args.backend} ledger {path} on {sock} (Ctrl+C to stop)")
+    try:
+        server = run_server(args.backend, path, args.shards, sock, args.group_window / 1000)
+    except ledger.LedgerError as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"Stopped after {server.commits} commits in {server.groups} group writes.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
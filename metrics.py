@@ -0,0 +1,219 @@
+import atexit
+import bisect
+import os
+import sys
+import threading
+import time
+
+# Hot-path metrics for the miner, task client and wallet.
+#
+# Off unless COOIN_METRICS names a directory. Then every process keeps
+# counters and latency histograms in memory and writes them, in Prometheus
+# text format, to <directory>/<program>.prom (ready for node_exporter's
+# textfile collector): at exit and at most every COOIN_METRICS_INTERVAL
+# seconds while running. When off, every hook returns on its first line.
+#
+#   python metrics.py [directory]   prints the current files as a summary
+
+DIRECTORY = os.environ.get('COOIN_METRICS') or None
+ENABLED = DIRECTORY is not None
+DUMP_INTERVAL = float(os.environ.get('COOIN_METRICS_INTERVAL', '10'))
+PROGRAM = os.path.splitext(os.path.basename(sys.argv[0] or ''))[0] or 'python'
+
+# Histogram bucket bounds, in seconds
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+METRICS = {
+    'cooin_ledger_seconds': ('histogram', "Time spent in ledger operations (load, parse, serialize, write, commit)."),
+    'cooin_ledger_bytes_read_total': ('counter', "Bytes read from ledger files."),
+    'cooin_ledger_bytes_written_total': ('counter', "Bytes written to ledger files."),
+    'cooin_ledger_commits_total': ('counter', "Ledger commits by outcome."),
+    'cooin_wallets_touched_total': ('counter', "Wallets changed by committed records."),
+    'cooin_ledger_cache_hits_total': ('counter', "Reads served by the in-process ledger cache."),
+    'cooin_ledger_cache_misses_total': ('counter', "Reads that went to the ledger backend."),
+    'cooin_flight_delay_seconds': ('histogram', "Simulated Proof-of-Flight delay."),
+    'cooin_mining_attempts_total': ('counter', "Paid Proof-of-Flight attempts."),
+    'cooin_mining_successes_total': ('counter', "Successful Proof-of-Flight attempts."),
+    'cooin_task_completions_total': ('counter', "Daily tasks completed."),
+    'cooin_logins_total': ('counter', "Logins by result."),
+    'cooin_registrations_total': ('counter', "Wallets registered."),
+    'cooin_transfers_total': ('counter', "Transfers applied in blocks, by outcome."),
+    'cooin_transfer_confirmation_seconds': ('histogram', "Time from submitting a transfer to its block being committed."),
+}
+
+_lock = threading.Lock()
+_counters = {} # (name, labels) -> value
+_histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+_collectors = []
+_last_dump = time.monotonic()
+
+# --- Hooks ---
+
+def inc(name, amount=1, **labels):
+    """Adds to a counter."""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_dump()
+
+def observe(name, seconds, **labels):
+    """Records one duration in a histogram."""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        i = bisect.bisect_left(BUCKETS, seconds)
+        if i < len(BUCKETS):
+            histogram[i] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+    _maybe_dump()
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+_NULL_TIMER = _NullTimer()
+
+def timed(name, **labels):
+    """Context manager that records how long its block took."""
+    return _Timer(name, labels) if ENABLED else _NULL_TIMER
+
+def add_collector(collect):
+    """Registers `collect()`, which returns (name, labels dict, value) triples read at dump time."""
+    _collectors.append(collect)
+
+# --- Export ---
+
+def _format_labels(labels, extra=()):
+    pairs = [('program', PROGRAM)] + list(labels) + list(extra)
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+def render():
+    """All metrics in Prometheus text format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(values) for key, values in _histograms.items()}
+    for collect in _collectors:
+        for name, labels, value in collect():
+            counters[(name, tuple(sorted(labels.items())))] = value
+
+    lines = []
+    for name, (kind, text) in METRICS.items():
+        series = sorted((key, value) for key, value in (histograms if kind == 'histogram' else counters).items()
+                        if key[0] == name)
+        if not series:
+            continue
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (_, labels), value in series:
+            if kind != 'histogram':
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS, value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {value[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+def dump():
+    """Writes <directory>/<program>.prom (atomically, so scrapers never see half a file)."""
+    global _last_dump
+    if not ENABLED:
+        return
+    _last_dump = time.monotonic()
+    try:
+        os.makedirs(DIRECTORY, exist_ok=True)
+        path = os.path.join(DIRECTORY, f"{PROGRAM}.prom")
+        with open(path + '.tmp', 'w') as f:
+            f.write(render())
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        print(f"Warning: could not write metrics: {e}", file=sys.stderr)
+
+def _maybe_dump():
+    if time.monotonic() - _last_dump >= DUMP_INTERVAL:
+        dump()
+
+def enable(directory):
+    """Turns metrics on for this process (same as setting COOIN_METRICS)."""
+    global DIRECTORY, ENABLED
+    if not ENABLED:
+        atexit.register(dump)
+    DIRECTORY, ENABLED = directory, True
+
+if ENABLED:
+    atexit.register(dump)
+
+# --- Stats Command ---
+
+def summarize(text):
+    """Per-program totals from Prometheus text: counters, and count/mean for histograms."""
+    rows = []
+    sums = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        if '_bucket{' in series:
+            continue
+        if '_sum{' in series or '_count{' in series:
+            base, _, labels = series.partition('{')
+            name, kind = base.rsplit('_', 1)
+            sums.setdefault((name, labels), {})[kind] = float(value)
+            continue
+        rows.append(f"  {series:<80} {float(value):g}")
+    for (name, labels), values in sorted(sums.items()):
+        count = values.get('count', 0)
+        mean = values.get('sum', 0) / count * 1e3 if count else 0
+        rows.append(f"  {name + '{' + labels:<80} n={count:g} mean={mean:.3f} ms")
+    return rows
+
+def main(argv=None):
+    import argparse
+    import glob
+    parser = argparse.ArgumentParser(description="Show Cooin metrics written by the clients.")
+    parser.add_argument('directory', nargs='?', default=DIRECTORY or '.')
+    args = parser.parse_args(argv)
+
+    paths = sorted(glob.glob(os.path.join(args.directory, '*.prom')))
+    if not paths:
+        print(f"No metrics in {args.directory}. Run the clients with COOIN_METRICS={args.directory}.")
+        return 1
+    for path in paths:
+        age = time.time() - os.path.getmtime(path)
+        print(f"{os.path.basename(path)} (written {age:.0f} s ago)")
+        with open(path, 'r') as f:
+            for row in summarize(f.read()):
+                print(row)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
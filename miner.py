@@ -1,47 +1,47 @@
-import json
 import time
 import random
-import os
-import string
 
-DATA_FILE = 'cooin_data.json'
-# Rewards and difficulty settings (Miner-specific)
-BASE_MINE_REWARD = 1.0 
-MINE_COST = 0.005
-FLIGHT_SCORE_INCREASE = 0.01
+import ledger
+import metrics
+from core import MINE_COST, fly
+from history import FlightHistory
 
-# --- Utility Functions (Shared with Wallet) ---
+# Ranks can take a scan of every wallet (binary and sharded ledgers), so the
+# status shows them as of the last refresh: every this many rounds, and
+# after the leaderboard was viewed
+RANK_REFRESH_ROUNDS = 10
 
-def load_all_wallets():
-    """Loads all wallets from the JSON file. Initializes the 'wallets' map if file is new."""
-    default_data = {"wallets": {}}
+# --- Utility Functions ---
 
-    if not os.path.exists(DATA_FILE):
-        return default_data
-    
+def fetch_wallet(address):
+    """Reads a single wallet from the ledger, or None if it is missing or unreadable."""
+    try:
+        return ledger.get_wallet(address)
+    except ledger.LedgerError as e:
+        print(f"Warning: {e}")
+        return None
+
+def poll_wallet(subscription, address, wallet_data):
+    """The wallet as last seen, with any change the ledger pushed for it since."""
     try:
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-            if 'wallets' not in data:
-                return default_data
-            return data
-            
-    except (json.JSONDecodeError, IOError):
-        print("Warning: Ledger file corrupted or empty. Cannot mine until a wallet exists.")
-        return default_data
-
-def save_all_wallets(data):
-    """Saves the entire wallet data dictionary to the JSON file."""
+        changes = subscription.poll()
+    except ledger.LedgerError as e:
+        print(f"Warning: {e}")
+        return wallet_data
+    return changes.get(address, wallet_data)
+
+def fetch_ranks(address):
+    """{field: (rank, wallet count)} for the wallet, or None if the ledger can't be read."""
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except IOError as e:
-        print(f"Error saving data file: {e}")
+        return {field: ledger.wallet_rank(address, field) for field in ('balance', 'flight_score')}
+    except ledger.LedgerError as e:
+        print(f"Warning: {e}")
+        return None
 
-# --- Mining Logic ---
+# --- Mining Session ---
 
-def display_miner_status(wallet_data):
-    """Displays essential mining stats for the logged-in user."""
+def display_miner_status(wallet_data, ranks=None):
+    """Displays essential mining stats (and leaderboard ranks) for the logged-in user."""
     print("\n" + "="*50)
     print(f"⛏️  Cooin PoF Mining Client - Active Session")
     print("="*50)
@@ -49,18 +49,16 @@ def display_miner_status(wallet_data):
     print(f"Current Balance: {wallet_data['balance']:.4f} COO")
     print(f"Flight Score (Efficiency): {wallet_data['flight_score']:.2f}")
     print(f"Cost per PoF Flight: {MINE_COST:.4f} COO")
+    if ranks and ranks['balance'] and ranks['flight_score']:
+        print(f"Leaderboard: #{ranks['balance'][0]} by balance, #{ranks['flight_score'][0]} by flight score"
+              f" (of {ranks['balance'][1]})")
     print("="*50 + "\n")
 
-def view_history(all_wallets, current_address):
+def view_history(wallet_data):
     """Displays the last 5 Flight Score entries for the user."""
-    wallet_data = all_wallets['wallets'][current_address]
-    
-    # Initialize history list if it's missing (e.g., wallet created before this feature)
-    if 'flight_score_history' not in wallet_data or not isinstance(wallet_data['flight_score_history'], list):
-        wallet_data['flight_score_history'] = [wallet_data.get('flight_score', 1.0)]
-        save_all_wallets(all_wallets)
-        
-    history = wallet_data['flight_score_history']
+    # Viewing never writes: a missing or legacy history is backfilled as part
+    # of the wallet's next flight (see flight_cost_records)
+    history = FlightHistory.load(wallet_data.get('flight_score_history', [wallet_data.get('flight_score', 1.0)]))
     
     print("\n--- Flight Score History (Last 5 Updates) ---")
     if len(history) <= 1:
@@ -71,7 +69,7 @@ def view_history(all_wallets, current_address):
         
     
     # Display the last few entries
-    display_list = history[-5:]
+    display_list = history.last(5)
     
     for i, score in enumerate(display_list):
         if i == len(display_list) - 1:
@@ -82,24 +80,34 @@ def view_history(all_wallets, current_address):
     print("------------------------------------------")
     time.sleep(2)
 
+def view_leaderboard(current_address, n=10):
+    """Displays the top miners by balance and by flight score."""
+    try:
+        boards = [("Balance", ledger.top_wallets('balance', n), "{:.4f} COO"),
+                  ("Flight Score", ledger.top_wallets('flight_score', n), "{:.2f}")]
+    except ledger.LedgerError as e:
+        print(f"Error reading leaderboard: {e}")
+        time.sleep(1)
+        return
+
+    for title, top, value_format in boards:
+        print(f"\n--- Top {n} Miners by {title} ---")
+        for rank, (address, value) in enumerate(top, 1):
+            marker = " (YOU)" if address == current_address else ""
+            print(f"{rank:>3}. {address}  {value_format.format(value)}{marker}")
+    print("------------------------------------------")
+    time.sleep(2)
+
+def not_enough_cooin():
+    print(f"❌ ERROR: Not enough Cooin to initiate flight. Need {MINE_COST:.4f} COO.")
+    print("Suggestion: Use the 'cooin_task_app.py' to earn your initial balance!")
+    time.sleep(2)
 
-def simulate_mining(all_wallets, current_address):
+def simulate_mining(wallet_data, current_address):
     """Simulates Proof-of-Flight (PoF) consensus mining for the current user."""
-    wallet_data = all_wallets['wallets'][current_address]
-    
     if wallet_data['balance'] < MINE_COST:
-        print(f"❌ ERROR: Not enough Cooin to initiate flight. Need {MINE_COST:.4f} COO.")
-        print("Suggestion: Use the 'cooin_task_app.py' to earn your initial balance!")
-        time.sleep(2)
+        not_enough_cooin()
         return
-
-    # Deduct the cost immediately (this is the cost of the "postage")
-    wallet_data['balance'] -= MINE_COST
-    # Note: History tracking needs to be initialized if not present
-    if 'flight_score_history' not in wallet_data or not isinstance(wallet_data['flight_score_history'], list):
-        wallet_data['flight_score_history'] = [wallet_data.get('flight_score', 1.0)]
-
-    save_all_wallets(all_wallets)
     
     print("🚀 Initiating Proof-of-Flight... The Cooin Carrier Pigeon is airborne!")
     
@@ -107,26 +115,32 @@ def simulate_mining(all_wallets, current_address):
     delay_time = 3 + random.random() * 2 # 3 to 5 second wait
     
     # Visual loading bar
-    for i in range(1, 11):
-        print(f"|{'#' * i}{'.' * (10 - i)}| Verifying delivery... ({i*10}%)", end='\r')
-        time.sleep(delay_time / 10)
+    with metrics.timed('cooin_flight_delay_seconds'):
+        for i in range(1, 11):
+            print(f"|{'#' * i}{'.' * (10 - i)}| Verifying delivery... ({i*10}%)", end='\r')
+            time.sleep(delay_time / 10)
     print("\n") 
 
-    # Success chance increases with Flight Score (up to a max of 95%)
-    base_success_chance = 0.6 
-    success_chance = min(0.95, base_success_chance + (wallet_data['flight_score'] - 1.0) / 10)
+    # The cost of the "postage", the reward and the score bump are committed
+    # together, against the latest version of the wallet, so a concurrent
+    # task reward is never overwritten and a crash never leaves a paid
+    # flight without its reward.
+    roll, reward_roll = random.random(), random.random()
+    try:
+        updated, reward = ledger.run_transaction(
+            lambda tx: fly(tx, current_address, roll, reward_roll))
+    except ledger.LedgerError as e:
+        print(f"Error saving data file: {e}")
+        return
 
-    if random.random() < success_chance:
-        reward = BASE_MINE_REWARD * random.uniform(0.9, 1.1)
-        
-        # Update balance and flight score on successful "delivery"
-        wallet_data['balance'] += reward
-        wallet_data['flight_score'] += FLIGHT_SCORE_INCREASE
-        
-        # Track history
-        wallet_data['flight_score_history'].append(wallet_data['flight_score'])
-        
-        save_all_wallets(all_wallets)
+    if updated is None:
+        not_enough_cooin()
+        return
+    wallet_data.update(updated)
+    metrics.inc('cooin_mining_attempts_total')
+
+    if reward is not None:
+        metrics.inc('cooin_mining_successes_total')
         print(f"✅ SUCCESS! Block confirmed by Cooin. You earned {reward:.4f} COO.")
         print(f"      -> Flight Score increased to {wallet_data['flight_score']:.2f}!")
     else:
@@ -142,9 +156,13 @@ def main():
     current_address = None
     
     while not current_address:
-        all_wallets = load_all_wallets()
+        try:
+            has_wallets = ledger.wallet_count() > 0
+        except ledger.LedgerError:
+            print("Warning: Ledger file corrupted or empty. Cannot mine until a wallet exists.")
+            has_wallets = False
         
-        if not all_wallets or not all_wallets.get('wallets'):
+        if not has_wallets:
             print("\n❌ No Cooin Wallets found. Please register one first using 'cooin_wallet.py'.")
             time.sleep(2)
             return
@@ -152,37 +170,61 @@ def main():
         print("\n--- Miner Login ---")
         address_input = input("Enter your 16-character Wallet Address (Miner Target): ").strip()
         
-        if address_input in all_wallets['wallets']:
+        if fetch_wallet(address_input) is not None:
             current_address = address_input
+            metrics.inc('cooin_logins_total', result='ok')
             print(f"\n✅ Miner Logged in. Ready to mine for: {current_address}")
             time.sleep(1)
         else:
+            metrics.inc('cooin_logins_total', result='failed')
             print("\n❌ Invalid Address. Cannot start mining session.")
             time.sleep(1)
 
-    # Mining Session Loop
+    # Mining Session Loop. The wallet isn't re-read every round: the ledger
+    # pushes each change to it (this miner's flights, task rewards, payouts)
+    # and the status shows the latest one.
+    try:
+        subscription = ledger.subscribe([current_address])
+    except ledger.LedgerError as e:
+        print(f"Error: {e}")
+        return
+    wallet_data = None
+    ranks, rounds = None, 0
     while current_address:
-        all_wallets = load_all_wallets()
-        wallet_data = all_wallets['wallets'][current_address]
+        wallet_data = poll_wallet(subscription, current_address, wallet_data)
+        if wallet_data is None:
+            print(f"\n❌ Wallet {current_address} is no longer readable. Ending mining session.")
+            subscription.close()
+            return
         
-        display_miner_status(wallet_data)
+        if ranks is None or rounds >= RANK_REFRESH_ROUNDS:
+            ranks, rounds = fetch_ranks(current_address), 0
+        rounds += 1
+        display_miner_status(wallet_data, ranks)
         
         print("1. Start PoF Mining (Generate Cooin)")
         print("2. View Flight Score History")
-        print("3. Logout and Close Miner")
+        print("3. View Leaderboard")
+        print("4. Logout and Close Miner")
         
         choice = input("Enter your choice: ")
         
         if choice == '1':
-            simulate_mining(all_wallets, current_address)
+            simulate_mining(wallet_data, current_address)
         elif choice == '2':
-            view_history(all_wallets, current_address)
+            view_history(wallet_data)
         elif choice == '3':
+            view_leaderboard(current_address)
+            ranks = None # refreshed with the next status
+        elif choice == '4':
             print(f"Logging out of mining session for {current_address}.")
+            stats = ledger.cache_stats()
+            print(f"Ledger cache: {stats['hits']} hits, {stats['misses']} misses.")
             current_address = None # End loop
+            subscription.close()
             time.sleep(1)
         else:
-            print("Invalid choice. Please enter 1, 2, or 3.")
+            print("Invalid choice. Please enter 1, 2, 3, or 4.")
             time.sleep(1)
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import datetime
+import sys
+import time
+
+import journal
+import ledger
+import metrics
+from core import DAILY_TASK_REWARD
+
+# Headless daily-task payouts.
+#
+# Pays the daily task reward to many wallets in one pass, e.g. from cron.
+# Each wallet records the last day it was paid (task_day, a date ordinal),
+# written atomically with the reward by the journal's "task" record, which
+# pays nothing if that day is already recorded. A rerun after a crash skips
+# everything already paid without writing, and can never pay a wallet twice
+# for the same day, whether through a rerun, a concurrent run or the task
+# client's button.
+
+# Wallets looked up and paid per commit
+CHUNK_SIZE = 100_000
+
+def today():
+    return datetime.date.today().toordinal()
+
+def paid_today(wallet, day=None):
+    return wallet.get('task_day') == (day or today())
+
+def pay_daily_tasks(addresses, day=None, reward=DAILY_TASK_REWARD, chunk_size=CHUNK_SIZE):
+    """Pays `reward` to every address not yet paid for `day` (default today).
+
+    Returns {"paid": n, "already_paid": n, "unknown": n}.
+    """
+    day = day or today()
+    summary = {"paid": 0, "already_paid": 0, "unknown": 0}
+    addresses = list(dict.fromkeys(addresses))
+    for start in range(0, len(addresses), chunk_size):
+        pending = addresses[start:start + chunk_size]
+        for attempt in range(ledger.MAX_RETRIES):
+            wallets = ledger.get_wallets(pending)
+            summary['unknown'] += sum(1 for address in pending if address not in wallets)
+
+            records = []
+            for address in pending:
+                wallet = wallets.get(address)
+                if wallet is None:
+                    continue
+                if paid_today(wallet, day):
+                    summary['already_paid'] += 1
+                    continue
+                record = journal.task(address, reward, day)
+                record['expect'] = wallet.get('version', 0)
+                records.append(record)
+
+            conflicts = {record['addr'] for record in ledger.commit_independent(records)} if records else set()
+            paid = len(records) - len(conflicts)
+            summary['paid'] += paid
+            metrics.inc('cooin_task_completions_total', paid)
+
+            # Wallets another process changed in the meantime are re-read
+            pending = [record['addr'] for record in records if record['addr'] in conflicts]
+            if not pending:
+                break
+            time.sleep(ledger.retry_delay(attempt))
+        else:
+            raise ledger.VersionConflict("Gave up paying daily tasks after repeated conflicts.")
+    return summary
+
+# --- Main Execution ---
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Pay the Cooin daily task reward to many wallets at once.")
+    parser.add_argument('addresses', nargs='*', help="wallet addresses to pay")
+    parser.add_argument('--all', action='store_true', help="pay every wallet in the ledger")
+    parser.add_argument('--from-file', help="file with one address per line")
+    parser.add_argument('--day', type=datetime.date.fromisoformat,
+                        help="payout day as YYYY-MM-DD (default: today)")
+    args = parser.parse_args(argv)
+
+    try:
+        addresses = list(args.addresses)
+        if args.from_file:
+            with open(args.from_file, 'r') as f:
+                addresses.extend(line.strip() for line in f if line.strip())
+        if args.all:
+            addresses.extend(ledger.load_all_wallets()['wallets'])
+        if not addresses:
+            parser.error("give wallet addresses, --from-file or --all")
+
+        day = args.day or datetime.date.today()
+        summary = pay_daily_tasks(addresses, day.toordinal())
+    except (ledger.LedgerError, IOError) as e:
+        print(f"Error: {e}")
+        return 1
+
+    print(f"Daily tasks for {day.isoformat()}: paid {summary['paid']} wallets "
+          f"{DAILY_TASK_REWARD:.4f} COO each, {summary['already_paid']} already paid, "
+          f"{summary['unknown']} unknown addresses.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
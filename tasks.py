@@ -1,42 +1,19 @@
-import json
-import time
 import random
-import os
-import string
 import tkinter as tk
 from tkinter import messagebox
 
-DATA_FILE = 'cooin_data.json'
-DAILY_TASK_REWARD = 0.5 # Fixed, guaranteed reward for a quick task
-
-# --- Utility Functions (Shared) ---
-
-def load_all_wallets():
-    """Loads all wallets from the JSON file."""
-    default_data = {"wallets": {}}
-
-    if not os.path.exists(DATA_FILE):
-        return default_data
-    
-    try:
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-            if 'wallets' not in data:
-                return default_data
-            return data
-            
-    except (json.JSONDecodeError, IOError):
-        # In GUI, show a message box instead of printing
-        messagebox.showerror("File Error", "Ledger file corrupted or empty. Please register a wallet first.")
-        return default_data
-
-def save_all_wallets(data):
-    """Saves the entire wallet data dictionary to the JSON file."""
-    try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except IOError as e:
-        messagebox.showerror("Save Error", f"Error saving data file: {e}")
+import background
+import ledger
+import metrics
+import payout
+from core import DAILY_TASK_REWARD
+
+# --- Utility Functions ---
+
+def show_ledger_error(e):
+    """Reports a failed ledger read. Runs on the Tk thread, after the background read failed."""
+    # In GUI, show a message box instead of printing
+    messagebox.showerror("File Error", f"{e}\nPlease register a wallet first.")
 
 # --- GUI Application Class ---
 
@@ -50,6 +27,10 @@ class TaskApp:
         self.current_address = None
         self.wallet_data = None
 
+        # Ledger calls run in the background so the window never freezes
+        self.worker = background.LedgerWorker(master)
+        master.protocol("WM_DELETE_WINDOW", self.close)
+
         self.master.grid_rowconfigure(0, weight=1)
         self.master.grid_columnconfigure(0, weight=1)
 
@@ -62,15 +43,22 @@ class TaskApp:
             messagebox.showerror("Error", "Please log in first.")
             return
 
-        all_wallets = load_all_wallets()
-        
         # Ensure we are operating on the latest data
-        if self.current_address not in all_wallets['wallets']:
+        address = self.current_address
+        self.worker.submit('task', lambda: ledger.get_wallet(address), self.start_task, show_ledger_error,
+                           buttons=(self.task_button,))
+
+    def start_task(self, wallet_data):
+        """Runs the task once the wallet has been read."""
+        self.wallet_data = wallet_data
+        if self.wallet_data is None:
             messagebox.showerror("Error", "Wallet not found. Please log in again.")
             self.login_screen()
             return
-            
-        self.wallet_data = all_wallets['wallets'][self.current_address]
+
+        if payout.paid_today(self.wallet_data):
+            messagebox.showinfo("Already Done", "🐦 You have already completed today's task. Come back tomorrow!")
+            return
         
         tasks = [
             "Scouting the high-rise for fresh seeds",
@@ -84,22 +72,42 @@ class TaskApp:
         # Simulate work visually (simple dialog for simulation)
         messagebox.showinfo("Task In Progress", f"🐦 Initiating Daily Task: {task_name}...")
         
-        # Grant reward
-        reward = DAILY_TASK_REWARD
-        self.wallet_data['balance'] += reward
-        
-        # Save and update the display
-        all_wallets['wallets'][self.current_address] = self.wallet_data
-        save_all_wallets(all_wallets)
+        # Grant reward. The payout pays at most once per day, even if a batch
+        # payout (payout.py) got to this wallet first.
+        address = self.current_address
+        self.worker.submit('task', lambda: payout.pay_daily_tasks([address]), self.task_done, self.task_failed,
+                           buttons=(self.task_button,))
+
+    def task_failed(self, e):
+        messagebox.showerror("Save Error", f"Error saving data file: {e}")
+
+    def task_done(self, summary):
+        """Reports the payout and updates the display."""
+        if summary['unknown']:
+            messagebox.showerror("Error", "Wallet not found. Please log in again.")
+            self.login_screen()
+            return
+        if not summary['paid']:
+            messagebox.showinfo("Already Done", "🐦 Today's task was already paid to this wallet.")
+            self.update_status_display()
+            return
         
-        messagebox.showinfo("Success!", f"🎉 TASK COMPLETE! You earned {reward:.4f} COO.")
+        messagebox.showinfo("Success!", f"🎉 TASK COMPLETE! You earned {DAILY_TASK_REWARD:.4f} COO.")
         self.update_status_display()
         
     def update_status_display(self):
         """Refreshes the balance and address labels."""
-        all_wallets = load_all_wallets()
-        if self.current_address in all_wallets['wallets']:
-            self.wallet_data = all_wallets['wallets'][self.current_address]
+        address = self.current_address
+        self.worker.submit('status', lambda: ledger.get_wallet(address), self.show_status, show_ledger_error)
+
+    def wallet_changed(self, changes):
+        """Shows a pushed change to the logged-in wallet (see task_screen)."""
+        if self.current_address in changes:
+            self.show_status(changes[self.current_address])
+
+    def show_status(self, wallet_data):
+        self.wallet_data = wallet_data
+        if self.wallet_data is not None:
             self.address_label.config(text=f"Address: {self.current_address}", fg='#006400')
             self.balance_label.config(text=f"Balance: {self.wallet_data['balance']:.4f} COO", fg='#8B4513')
         else:
@@ -115,6 +123,7 @@ class TaskApp:
 
     def login_screen(self):
         """Displays the login screen for the wallet address."""
+        self.worker.unwatch() # the labels it updates are about to go
         self.clear_frame()
         
         # Main Frame setup
@@ -130,21 +139,30 @@ class TaskApp:
         self.address_entry.pack(ipady=5, pady=5)
         
         # Login Button
-        login_button = tk.Button(login_frame, text="Login & Start Tasking", command=self.attempt_login, bg='#4CAF50', fg='white', font=("Arial", 12, "bold"), relief=tk.FLAT, activebackground='#45a049')
-        login_button.pack(pady=20, ipadx=10, ipady=5)
+        self.login_button = tk.Button(login_frame, text="Login & Start Tasking", command=self.attempt_login, bg='#4CAF50', fg='white', font=("Arial", 12, "bold"), relief=tk.FLAT, activebackground='#45a049')
+        self.login_button.pack(pady=20, ipadx=10, ipady=5)
         
         tk.Label(login_frame, text="Use 'cooin_wallet.py' to register new addresses.", font=("Arial", 9, "italic"), bg='#f0f0f0', fg='#777777').pack(pady=5)
         
     def attempt_login(self):
         """Checks if the entered address is valid and transitions to the task screen."""
         address = self.address_entry.get().strip()
-        all_wallets = load_all_wallets()
-        
-        if address in all_wallets['wallets']:
+        self.worker.submit('login', lambda: ledger.get_wallet(address),
+                           lambda wallet_data: self.login_done(address, wallet_data), self.login_failed,
+                           buttons=(self.login_button,))
+
+    def login_failed(self, e):
+        show_ledger_error(e)
+        self.login_done(None, None)
+
+    def login_done(self, address, wallet_data):
+        if wallet_data is not None:
             self.current_address = address
-            self.wallet_data = all_wallets['wallets'][address]
+            self.wallet_data = wallet_data
+            metrics.inc('cooin_logins_total', result='ok')
             self.task_screen()
         else:
+            metrics.inc('cooin_logins_total', result='failed')
             messagebox.showerror("Login Failed", "Invalid or unregistered 16-character address.")
 
     def task_screen(self):
@@ -167,22 +185,30 @@ class TaskApp:
         self.balance_label.pack(pady=10)
         
         # Task Button
-        task_button = tk.Button(task_frame, text="COMPLETE DAILY TASK (0.5 COO)", command=self.complete_daily_task, 
-                                bg='#FFC107', fg='#333333', font=("Arial", 12, "bold"), relief=tk.FLAT, activebackground='#ffaa00')
-        task_button.pack(pady=20, ipadx=10, ipady=10)
+        self.task_button = tk.Button(task_frame, text="COMPLETE DAILY TASK (0.5 COO)", command=self.complete_daily_task, 
+                                     bg='#FFC107', fg='#333333', font=("Arial", 12, "bold"), relief=tk.FLAT, activebackground='#ffaa00')
+        self.task_button.pack(pady=20, ipadx=10, ipady=10)
 
         # Logout Button
         logout_button = tk.Button(task_frame, text="Logout", command=self.logout, bg='#d9534f', fg='white', relief=tk.FLAT, activebackground='#c9302c')
         logout_button.pack(pady=10)
 
-        self.update_status_display()
+        # The watch's first change is the wallet as it is now; after that the
+        # ledger pushes every change to it, e.g. a batch payout or a flight
+        address = self.current_address
+        self.worker.watch(lambda: ledger.subscribe([address]), self.wallet_changed)
 
     def logout(self):
         """Clears the session and returns to the login screen."""
+        self.worker.cancel() # Replies still on their way belong to the old session
         self.current_address = None
         self.wallet_data = None
         self.login_screen()
 
+    def close(self):
+        self.worker.shutdown()
+        self.master.destroy()
+
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+import collections
+import math
+import os
+import sys
+import time
+
+import journal
+import ledger
+import metrics
+
+# Wallet-to-wallet transfers.
+#
+# Transfers are validated when they are submitted and wait in an in-memory
+# Mempool; a BlockProducer then takes them out in blocks of up to
+# BLOCK_SIZE and commits each block with one ledger.commit_group() call, so
+# a thousand transfers cost one journal append (one SQLite transaction)
+# instead of a thousand. A block is cut once it is full or once its oldest
+# transfer has waited BLOCK_INTERVAL.
+#
+# Every transfer is its own atomic group in the block: a spend record on the
+# sender (a debit that only applies if the balance covers it) and a credit
+# to the recipient. The mempool already refuses transfers the sender can't
+# cover together with its other pending ones, but a miner can spend the
+# same coins between submission and the block; the ledger re-checks the
+# balance when the block is applied, so such a transfer is rejected and the
+# rest of the block still goes through.
+#
+# On a sharded ledger a transfer between two shards can't be one commit.
+# Those are applied in two steps, every spend first and then the credits for
+# the spends that went through, so a process that dies in between leaves
+# those senders debited without the recipients credited.
+#
+#   COOIN_BLOCK_SIZE      transfers per block (default 1000)
+#   COOIN_BLOCK_INTERVAL  longest a transfer waits for its block, in ms (default 1000)
+
+BLOCK_SIZE = int(os.environ.get('COOIN_BLOCK_SIZE', '1000'))
+BLOCK_INTERVAL = float(os.environ.get('COOIN_BLOCK_INTERVAL', '1000')) / 1000
+
+class TransferRejected(ledger.LedgerError):
+    pass
+
+def transfer_records(transfer):
+    """The records of one transfer, committed together."""
+    return [journal.spend(transfer['from'], transfer['amount']),
+            journal.credit(transfer['to'], transfer['amount'])]
+
+# --- Mempool ---
+
+class Mempool:
+    """Validated transfers waiting for a block, oldest first."""
+
+    def __init__(self, max_size=100_000):
+        self.max_size = max_size
+        self._queue = collections.deque()
+        self._outgoing = {} # sender -> [pending transfers, their total amount]
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def pending_outgoing(self, address):
+        """Total amount of the wallet's transfers still in the mempool."""
+        return self._outgoing.get(address, (0, 0.0))[1]
+
+    def submit(self, sender, recipient, amount):
+        """Validates a transfer and queues it. Returns the transfer, or raises TransferRejected."""
+        amount = float(amount)
+        if not math.isfinite(amount) or amount <= 0:
+            raise TransferRejected(f"Invalid amount: {amount}")
+        if sender == recipient:
+            raise TransferRejected("Cannot transfer to the same wallet.")
+        if len(self._queue) >= self.max_size:
+            raise TransferRejected("Mempool is full; try again after the next block.")
+
+        wallets = ledger.get_wallets([sender, recipient])
+        for address in (sender, recipient):
+            if address not in wallets:
+                raise TransferRejected(f"Unknown wallet: {address}")
+        available = wallets[sender]['balance'] - self.pending_outgoing(sender)
+        if amount > available:
+            raise TransferRejected(f"Insufficient funds: {max(available, 0.0):.4f} COO available "
+                                   f"after pending transfers, {amount:.4f} COO needed.")
+
+        self._next_id += 1
+        transfer = {"id": self._next_id, "from": sender, "to": recipient, "amount": amount,
+                    "submitted": time.monotonic()}
+        self._queue.append(transfer)
+        pending = self._outgoing.setdefault(sender, [0, 0.0])
+        pending[0] += 1
+        pending[1] += amount
+        return transfer
+
+    def oldest_age(self):
+        """Seconds the oldest pending transfer has waited (0 if none)."""
+        return time.monotonic() - self._queue[0]['submitted'] if self._queue else 0.0
+
+    def take(self, n):
+        """Removes and returns up to `n` of the oldest transfers."""
+        taken = []
+        while self._queue and len(taken) < n:
+            transfer = self._queue.popleft()
+            pending = self._outgoing[transfer['from']]
+            pending[0] -= 1
+            pending[1] -= transfer['amount']
+            if not pending[0]:
+                del self._outgoing[transfer['from']] # no float residue left behind
+            taken.append(transfer)
+        return taken
+
+# --- Blocks ---
+
+def apply_block(transfers):
+    """Commits transfers as one block. Returns one outcome per transfer: None if confirmed, else the LedgerError."""
+    outcomes = ledger.commit_group([transfer_records(transfer) for transfer in transfers])
+
+    split = [i for i, outcome in enumerate(outcomes) if isinstance(outcome, ledger.CrossShardCommit)]
+    if split:
+        spent = ledger.commit_group([[journal.spend(transfers[i]['from'], transfers[i]['amount'])] for i in split])
+        for i, outcome in zip(split, spent):
+            outcomes[i] = outcome
+        paid = [i for i in split if outcomes[i] is None]
+        credited = ledger.commit_group([[journal.credit(transfers[i]['to'], transfers[i]['amount'])] for i in paid])
+        for i, outcome in zip(paid, credited):
+            if outcome is not None:
+                outcomes[i] = ledger.LedgerError(f"Transfer {transfers[i]['id']} was debited but not credited: {outcome}")
+
+    # Transfers carry no version expectations: a conflict can only be a failed balance check
+    return [TransferRejected("Insufficient funds when the block was applied.")
+            if isinstance(outcome, ledger.VersionConflict) else outcome for outcome in outcomes]
+
+class BlockProducer:
+    """Cuts blocks from a mempool and applies them, keeping throughput and latency statistics."""
+
+    def __init__(self, mempool, block_size=BLOCK_SIZE, interval=BLOCK_INTERVAL):
+        self.mempool = mempool
+        self.block_size = block_size
+        self.interval = interval
+        self.height = 0 # blocks applied so far
+        self.confirmed = 0
+        self.rejected = 0
+        self.commit_seconds = 0.0
+        self.latencies = [] # submission to confirmation, per confirmed transfer
+
+    def due(self):
+        return len(self.mempool) >= self.block_size or (
+            len(self.mempool) > 0 and self.mempool.oldest_age() >= self.interval)
+
+    def produce(self):
+        """Applies the next block. Returns (transfers, outcomes); empty if the mempool is."""
+        transfers = self.mempool.take(self.block_size)
+        if not transfers:
+            return [], []
+        started = time.perf_counter()
+        outcomes = apply_block(transfers)
+        self.commit_seconds += time.perf_counter() - started
+        confirmed_at = time.monotonic()
+
+        self.height += 1
+        for transfer, outcome in zip(transfers, outcomes):
+            if outcome is None:
+                self.confirmed += 1
+                latency = confirmed_at - transfer['submitted']
+                self.latencies.append(latency)
+                metrics.observe('cooin_transfer_confirmation_seconds', latency)
+            else:
+                self.rejected += 1
+        metrics.inc('cooin_transfers_total', len(transfers) - outcomes.count(None), outcome='rejected')
+        metrics.inc('cooin_transfers_total', outcomes.count(None), outcome='confirmed')
+        return transfers, outcomes
+
+    def poll(self):
+        """Applies a block if one is due. Returns what produce() did, or None."""
+        return self.produce() if self.due() else None
+
+    def drain(self):
+        """Applies blocks until the mempool is empty."""
+        while len(self.mempool):
+            self.produce()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * q))] if latencies else None
+        return {
+            "blocks": self.height,
+            "confirmed": self.confirmed,
+            "rejected": self.rejected,
+            "commit_seconds": self.commit_seconds,
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+        }
+
+def send(sender, recipient, amount):
+    """Submits one transfer and confirms it right away, in a block of its own."""
+    mempool = Mempool()
+    mempool.submit(sender, recipient, amount)
+    _, outcomes = BlockProducer(mempool, block_size=1).produce()
+    if outcomes[0] is not None:
+        raise outcomes[0]
+
+# --- Main Execution ---
+
+def read_transfers(path):
+    """(sender, recipient, amount) per 'sender,recipient,amount' line; '-' reads stdin."""
+    f = sys.stdin if path == '-' else open(path, 'r')
+    try:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                sender, recipient, amount = (field.strip() for field in line.split(','))
+                yield sender, recipient, float(amount)
+            except ValueError:
+                raise ledger.LedgerError(f"{path}:{number}: expected 'sender,recipient,amount'")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Send Cooin between wallets.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    one = commands.add_parser('send', help="send one transfer and wait for it to be confirmed")
+    one.add_argument('sender')
+    one.add_argument('recipient')
+    one.add_argument('amount', type=float)
+    many = commands.add_parser('batch', help="submit transfers from a file and apply them in blocks")
+    many.add_argument('file', help="'sender,recipient,amount' per line ('-' for stdin)")
+    many.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'send':
+        try:
+            send(args.sender, args.recipient, args.amount)
+        except ledger.LedgerError as e:
+            print(f"❌ Transfer failed: {e}")
+            return 1
+        print(f"✅ Sent {args.amount:.4f} COO from {args.sender} to {args.recipient}.")
+        return 0
+
+    mempool = Mempool(max_size=max(args.block_size, 1) * 100)
+    producer = BlockProducer(mempool, block_size=args.block_size)
+    refused = 0
+    try:
+        # Read the whole file first, so a malformed line doesn't leave it half applied
+        requested = list(read_transfers(args.file))
+        started = time.perf_counter()
+        for sender, recipient, amount in requested:
+            try:
+                mempool.submit(sender, recipient, amount)
+            except TransferRejected as e:
+                refused += 1
+                print(f"Refused {sender} -> {recipient} {amount:.4f}: {e}")
+            if len(mempool) >= args.block_size:
+                producer.produce()
+        producer.drain()
+    except (ledger.LedgerError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    elapsed = time.perf_counter() - started
+
+    stats = producer.stats()
+    print(f"Confirmed {stats['confirmed']} transfers in {stats['blocks']} blocks "
+          f"({stats['confirmed'] / elapsed:.0f}/s); {stats['rejected']} rejected in a block, {refused} refused.")
+    if stats['latency_p50'] is not None:
+        print(f"Confirmation latency: p50 {stats['latency_p50'] * 1e3:.1f} ms, p99 {stats['latency_p99'] * 1e3:.1f} ms.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
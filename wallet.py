@@ -1,47 +1,28 @@
-import json
-import time
-import random
-import os
-import string
 import tkinter as tk
 from tkinter import messagebox
 
-DATA_FILE = 'cooin_data.json'
-# Wallet settings (used for display, not mining)
-MINE_COST = 0.005
+import background
+import ledger
+import metrics
+from core import MINE_COST, register_wallet
 
-# --- Utility Functions (Shared with Miner) ---
+# --- Utility Functions ---
 
-def generate_wallet_address():
-    """Generates a random 16-character alphanumeric wallet address (Token)."""
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choices(characters, k=16))
-
-def load_all_wallets():
-    """Loads all wallets from the JSON file. Initializes the 'wallets' map if file is new."""
-    default_data = {"wallets": {}}
-
-    if not os.path.exists(DATA_FILE):
-        return default_data
-    
+def fetch_wallet(address):
+    """Reads a single wallet from the ledger, or None if it is missing or unreadable."""
     try:
-        with open(DATA_FILE, 'r') as f:
-            data = json.load(f)
-            if 'wallets' not in data:
-                return default_data
-            return data
-            
-    except (json.JSONDecodeError, IOError):
+        return ledger.get_wallet(address)
+    except ledger.LedgerError:
         # In a GUI app, we silence warnings but return a safe default
-        return default_data
+        return None
 
-def save_all_wallets(data):
-    """Saves the entire wallet data dictionary to the JSON file."""
+def fetch_leaderboard(address, n=5):
+    """(balance rank, flight score rank, top `n` by balance) for the wallet, or None if unreadable."""
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except IOError:
-        messagebox.showerror("File Error", "Could not save wallet data. Check file permissions.")
+        return (ledger.wallet_rank(address, 'balance'), ledger.wallet_rank(address, 'flight_score'),
+                ledger.top_wallets('balance', n))
+    except ledger.LedgerError:
+        return None
 
 # --- Main Application Class ---
 
@@ -49,12 +30,15 @@ class CooinWalletApp(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("🕊️ Cooin Roost Chain Wallet (v2.0)")
-        self.geometry("400x450")
+        self.geometry("400x600")
         self.resizable(False, False)
         
         # State variables
         self.current_address = None
-        self.all_wallets = load_all_wallets()
+
+        # Ledger calls run in the background so the window never freezes
+        self.worker = background.LedgerWorker(self)
+        self.protocol("WM_DELETE_WINDOW", self.close)
 
         # Container for stacking frames
         self.container = tk.Frame(self)
@@ -82,14 +66,23 @@ class CooinWalletApp(tk.Tk):
         """Called upon successful login or registration."""
         self.current_address = address
         wallet_frame = self.frames[WalletFrame]
-        wallet_frame.update_status() # Load and display current wallet data
+        # The watch's first change is the wallet as it is now; after that the
+        # ledger pushes every change to it, whoever makes it
+        self.worker.watch(lambda: ledger.subscribe([address]), wallet_frame.wallet_changed)
         self.show_frame(WalletFrame)
 
     def logout(self):
         """Clears the session and returns to the authentication screen."""
+        self.worker.unwatch()
+        self.worker.cancel() # Replies still on their way belong to the old session
         self.current_address = None
+        self.frames[WalletFrame].clear_status()
         self.show_frame(AuthFrame)
 
+    def close(self):
+        self.worker.shutdown()
+        self.destroy()
+
 # --- Authentication Frame ---
 
 class AuthFrame(tk.Frame):
@@ -103,36 +96,41 @@ class AuthFrame(tk.Frame):
         self.address_entry = tk.Entry(self, width=30, font=('Courier', 10))
         self.address_entry.pack(pady=5, padx=20)
         
-        tk.Button(self, text="Login to Existing Wallet", command=self.login, 
-                  bg='#00BFFF', fg='white', font=('Arial', 10, 'bold')).pack(pady=10, ipadx=10)
+        self.login_button = tk.Button(self, text="Login to Existing Wallet", command=self.login, 
+                                      bg='#00BFFF', fg='white', font=('Arial', 10, 'bold'))
+        self.login_button.pack(pady=10, ipadx=10)
         
-        tk.Button(self, text="Register New Wallet", command=self.register, 
-                  bg='#3CB371', fg='white', font=('Arial', 10, 'bold')).pack(pady=10, ipadx=10)
+        self.register_button = tk.Button(self, text="Register New Wallet", command=self.register, 
+                                         bg='#3CB371', fg='white', font=('Arial', 10, 'bold'))
+        self.register_button.pack(pady=10, ipadx=10)
 
     def login(self):
         address = self.address_entry.get().strip()
-        self.controller.all_wallets = load_all_wallets() # Refresh wallets before login
-        
-        if address in self.controller.all_wallets['wallets']:
+        self.controller.worker.submit('auth', lambda: fetch_wallet(address),
+                                      lambda wallet_data: self.login_done(address, wallet_data),
+                                      buttons=(self.login_button, self.register_button))
+
+    def login_done(self, address, wallet_data):
+        if wallet_data is not None:
+            metrics.inc('cooin_logins_total', result='ok')
             messagebox.showinfo("Success", f"Logged in as {address[:8]}...")
             self.controller.login_success(address)
         else:
+            metrics.inc('cooin_logins_total', result='failed')
             messagebox.showerror("Login Failed", "Address not found in the Roost Chain ledger.")
             
     def register(self):
-        self.controller.all_wallets = load_all_wallets()
-        
-        new_address = generate_wallet_address()
-        
-        # Initialize new wallet data
-        self.controller.all_wallets['wallets'][new_address] = {
-            "balance": 0.0,
-            "flight_score": 1.0, 
-            "wallet_address": new_address
-        }
-        
-        save_all_wallets(self.controller.all_wallets)
-        
+        self.controller.worker.submit('auth', register_wallet, self.register_done, self.register_failed,
+                                      buttons=(self.login_button, self.register_button))
+
+    def register_failed(self, error):
+        if isinstance(error, ledger.VersionConflict):
+            messagebox.showerror("File Error", "Could not allocate a unique wallet address.")
+        else:
+            messagebox.showerror("File Error", "Could not save wallet data. Check file permissions.")
+
+    def register_done(self, new_address):
+        metrics.inc('cooin_registrations_total')
         messagebox.showinfo("Registration Success", 
                             f"New Wallet Created!\nYour Address: {new_address}\n\n"
                             "This is your permanent login token. Write it down!")
@@ -164,12 +162,20 @@ class WalletFrame(tk.Frame):
         self.score_label = tk.Label(self, text="1.00", font=('Arial', 14))
         self.score_label.pack(pady=5)
 
+        # Leaderboard Display
+        tk.Label(self, text="Leaderboard:", font=('Arial', 10, 'underline')).pack()
+        self.rank_label = tk.Label(self, text="-", font=('Arial', 10))
+        self.rank_label.pack()
+        self.top_label = tk.Label(self, text="", font=('Courier', 9), justify='left')
+        self.top_label.pack(pady=5)
+
         # Mining Hint
         tk.Label(self, text=f"(Mining Cost: {MINE_COST:.4f} COO)", font=('Arial', 8)).pack(pady=5)
 
         # Action Buttons
-        tk.Button(self, text="Refresh Status", command=self.update_status, 
-                  bg='#F0E68C', fg='black', font=('Arial', 10)).pack(pady=10, ipadx=20)
+        self.refresh_button = tk.Button(self, text="Refresh Status", command=self.update_status, 
+                                        bg='#F0E68C', fg='black', font=('Arial', 10))
+        self.refresh_button.pack(pady=10, ipadx=20)
         
         tk.Button(self, text="Logout", command=self.controller.logout, 
                   bg='#FF4500', fg='white', font=('Arial', 10, 'bold')).pack(pady=20, ipadx=30)
@@ -179,17 +185,32 @@ class WalletFrame(tk.Frame):
 
 
     def update_status(self):
-        """Fetches the latest data from the JSON file and updates GUI labels."""
+        """Fetches the latest data for this wallet from the ledger and updates GUI labels."""
         if not self.controller.current_address:
             return
 
-        # Reload all wallets to get the latest data from the ledger
-        self.controller.all_wallets = load_all_wallets()
+        # Reload just this wallet to get the latest data from the ledger
         current_address = self.controller.current_address
-        
+        self.controller.worker.submit('status', lambda: fetch_wallet(current_address),
+                                      lambda wallet_data: self.show_status(current_address, wallet_data),
+                                      buttons=(self.refresh_button,))
+        self.controller.worker.submit('leaderboard', lambda: fetch_leaderboard(current_address),
+                                      lambda board: self.show_leaderboard(current_address, board))
+
+    def wallet_changed(self, changes):
+        """Shows a pushed change to the logged-in wallet, and the ranks it may have moved."""
+        current_address = self.controller.current_address
+        if current_address not in changes:
+            return
+        self.show_status(current_address, changes[current_address])
+        if self.controller.current_address == current_address:
+            self.controller.worker.submit('leaderboard', lambda: fetch_leaderboard(current_address),
+                                          lambda board: self.show_leaderboard(current_address, board))
+
+    def show_status(self, current_address, wallet_data):
+        """Updates the GUI labels with a freshly read wallet."""
         # Check if the address exists after reload
-        if current_address in self.controller.all_wallets['wallets']:
-            wallet_data = self.controller.all_wallets['wallets'][current_address]
+        if wallet_data is not None:
             
             self.address_label.config(text=wallet_data['wallet_address'])
             self.balance_label.config(text=f"{wallet_data['balance']:.4f} COO")
@@ -201,6 +222,28 @@ class WalletFrame(tk.Frame):
             messagebox.showerror("Error", "Wallet data missing. Logging out.")
             self.controller.logout()
 
+    def show_leaderboard(self, current_address, board):
+        """Updates the rank line and the top-5 list."""
+        if board is None or board[0] is None or board[1] is None:
+            self.rank_label.config(text="-")
+            self.top_label.config(text="")
+            return
+
+        (balance_rank, total), (score_rank, _), top = board
+        self.rank_label.config(text=f"#{balance_rank} by balance, #{score_rank} by flight score (of {total})")
+        lines = [f"{rank}. {address[:8]}... {balance:>12.4f}{' *' if address == current_address else ''}"
+                 for rank, (address, balance) in enumerate(top, 1)]
+        self.top_label.config(text="\n".join(lines))
+
+    def clear_status(self):
+        """Resets the labels, so the next login doesn't show this wallet while loading."""
+        self.address_label.config(text="N/A")
+        self.balance_label.config(text="0.0000 COO")
+        self.score_label.config(text="1.00")
+        self.rank_label.config(text="-")
+        self.top_label.config(text="")
+        self.controller.title("🕊️ Cooin Roost Chain Wallet (v2.0)")
+
 
 if __name__ == "__main__":
     app = CooinWalletApp()
@@ -0,0 +1,241 @@
+import json
+from array import array
+from collections.abc import MutableMapping
+
+# Compact in-memory wallets.
+#
+# The JSON backend keeps the whole replayed ledger in memory. As a dict of
+# wallet dicts that costs about 450 bytes per wallet: the dict itself, a
+# float object per balance and score, and the address stored twice (as the
+# key and again as wallet_address). A WalletTable keeps the same wallets as
+# columns instead: balances, flight scores, versions and task days in typed
+# arrays, one list of addresses, and an address -> row dict. Histories and
+# any unknown fields stay Python objects, but most wallets have neither.
+#
+# It is a mapping of address -> WalletRow, and a WalletRow reads and writes
+# its fields like a wallet dict, so journal.apply_record() and the backend
+# code work on it unchanged; wallet.copy() gives a plain dict. A wallet's
+# wallet_address is always its key.
+
+# Fields held in columns; everything else a wallet carries goes in `extra`
+COLUMNS = frozenset(('balance', 'flight_score', 'wallet_address', 'version', 'task_day', 'flight_score_history'))
+
+class WalletRow(MutableMapping):
+    """One wallet of a WalletTable, read and written like a wallet dict."""
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key):
+        table, row = self._table, self._row
+        if key == 'balance':
+            return table.balance[row]
+        if key == 'flight_score':
+            return table.flight_score[row]
+        if key == 'wallet_address':
+            return table.addresses[row]
+        if key == 'version':
+            return table.version[row]
+        if key == 'task_day':
+            if table.task_day[row]:
+                return table.task_day[row]
+        elif key == 'flight_score_history':
+            if table.history[row] is not None:
+                return table.history[row]
+        elif row in table.extra:
+            return table.extra[row][key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        table, row = self._table, self._row
+        if key == 'balance':
+            table.balance[row] = value
+        elif key == 'flight_score':
+            table.flight_score[row] = value
+        elif key == 'wallet_address':
+            if value != table.addresses[row]:
+                raise ValueError(f"Wallet {table.addresses[row]} can't change its address to {value}")
+        elif key == 'version':
+            table.version[row] = value
+        elif key == 'task_day':
+            table.task_day[row] = value or 0
+        elif key == 'flight_score_history':
+            table.history[row] = value
+        else:
+            table.extra.setdefault(row, {})[key] = value
+
+    def __delitem__(self, key):
+        table, row = self._table, self._row
+        if key == 'task_day' and table.task_day[row]:
+            table.task_day[row] = 0
+        elif key == 'flight_score_history' and table.history[row] is not None:
+            table.history[row] = None
+        elif key in table.extra.get(row, ()):
+            del table.extra[row][key]
+        else:
+            raise KeyError(key)
+
+    def keys(self):
+        table, row = self._table, self._row
+        keys = ['balance', 'flight_score', 'wallet_address', 'version']
+        if table.history[row] is not None:
+            keys.append('flight_score_history')
+        if table.task_day[row]:
+            keys.append('task_day')
+        if row in table.extra:
+            keys.extend(table.extra[row])
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def copy(self):
+        """The wallet as a plain dict."""
+        return self._table.row_dict(self._row)
+
+    def __repr__(self):
+        return f"WalletRow({self.copy()!r})"
+
+class WalletTable(MutableMapping):
+    """address -> wallet, stored column by column."""
+
+    def __init__(self, wallets=None):
+        self.addresses = [] # row -> address (None once deleted)
+        self.index = {} # address -> row
+        self.balance = array('d')
+        self.flight_score = array('d')
+        self.version = array('q')
+        self.task_day = array('i') # date ordinal, 0 = never
+        self.history = [] # stored flight_score_history, or None
+        self.extra = {} # row -> {field: value} for fields without a column
+        if wallets:
+            for address, wallet in wallets.items():
+                self[address] = wallet
+
+    def _append(self, wallet):
+        """Adds a row for a wallet dict. Returns its row number."""
+        row = len(self.history)
+        self.balance.append(wallet['balance'])
+        self.flight_score.append(wallet['flight_score'])
+        self.version.append(wallet.get('version', 0))
+        self.task_day.append(wallet.get('task_day') or 0)
+        self.history.append(wallet.get('flight_score_history'))
+        if not COLUMNS.issuperset(wallet):
+            self.extra[row] = {key: value for key, value in wallet.items() if key not in COLUMNS}
+        return row
+
+    def __getitem__(self, address):
+        return WalletRow(self, self.index[address])
+
+    def get(self, address, default=None):
+        row = self.index.get(address)
+        return WalletRow(self, row) if row is not None else default
+
+    def __contains__(self, address):
+        return address in self.index
+
+    def __setitem__(self, address, wallet):
+        row = self.index.get(address)
+        if row is not None:
+            # Replacing a wallet: its old row is dropped, not reused
+            self._clear(row)
+        row = self._append(wallet)
+        self.addresses.append(address)
+        self.index[address] = row
+
+    def __delitem__(self, address):
+        self._clear(self.index.pop(address))
+
+    def _clear(self, row):
+        # Rows are never reused; a deleted row only keeps its fixed-width columns
+        self.addresses[row] = None
+        self.history[row] = None
+        self.extra.pop(row, None)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def items(self):
+        return ((address, WalletRow(self, row)) for address, row in self.index.items())
+
+    def values(self):
+        return (WalletRow(self, row) for row in self.index.values())
+
+    def column(self, field):
+        """(address, value) of every wallet for 'balance' or 'flight_score'."""
+        values = self.balance if field == 'balance' else self.flight_score
+        return ((address, values[row]) for address, row in self.index.items())
+
+    def row_dict(self, row):
+        wallet = {
+            "balance": self.balance[row],
+            "flight_score": self.flight_score[row],
+            "wallet_address": self.addresses[row],
+            "version": self.version[row],
+        }
+        if self.history[row] is not None:
+            wallet['flight_score_history'] = self.history[row]
+        if self.task_day[row]:
+            wallet['task_day'] = self.task_day[row]
+        if row in self.extra:
+            wallet.update(self.extra[row])
+        return wallet
+
+# --- Snapshots ---
+
+def loads_snapshot(text):
+    """json.loads() for a ledger snapshot, with the wallets parsed straight into a WalletTable.
+
+    Every wallet object becomes a table row as soon as it is parsed, so the
+    wallet dicts never all exist at once.
+    """
+    table = WalletTable()
+    # Called for every object in the snapshot, so the columns' append
+    # methods are looked up once, not per wallet
+    balance, flight_score = table.balance.append, table.flight_score.append
+    version, task_day, history = table.version.append, table.task_day.append, table.history.append
+    extra, columns = table.extra, COLUMNS
+
+    def wallet_row(obj):
+        if 'flight_score' not in obj:
+            return obj # the snapshot itself, or a flight score history
+        row = len(table.history)
+        try:
+            balance(obj['balance'])
+            flight_score(obj['flight_score'])
+            version(obj.get('version', 0))
+            task_day(obj.get('task_day') or 0)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"malformed wallet {obj.get('wallet_address')!r}: {e}")
+        history(obj.get('flight_score_history'))
+        if not columns.issuperset(obj):
+            extra[row] = {key: value for key, value in obj.items() if key not in columns}
+        return row
+
+    data = json.loads(text, object_hook=wallet_row)
+    rows = data.get('wallets') if isinstance(data, dict) else None
+    if isinstance(rows, dict):
+        if not all(type(row) is int for row in rows.values()):
+            raise ValueError("malformed wallet in the snapshot")
+        # Rows of addresses that appear twice stay behind unreferenced
+        table.addresses = [None] * len(table.history)
+        for address, row in rows.items():
+            table.addresses[row] = address
+        table.index = rows
+        data['wallets'] = table
+    return data